@@ -0,0 +1,232 @@
+"""
+Bulk balance import and batch adjustment.
+
+Rows come as CSV (header: user_id plus delta or balance) or NDJSON
+({"user_id": ..., "delta": ...} or {"user_id": ..., "balance": ...}). A delta
+is added to the balance; a balance replaces it (a migration). The rows are
+parsed and checked first, without the data lock. Then every valid row is
+applied in one data transaction: one write of DATA_FILE and one change log
+record, however many rows there are. Each changed balance emits
+BalanceAdjusted, so the history and the leaderboard see it.
+
+A row is rejected, and the rest still applied, when it cannot be parsed, has
+a bad user id or amount, would take the balance below 0, or would take it
+above the max_balance_uah setting. Rows for the same user apply in file order.
+
+A batch id (the Idempotency-Key of the admin endpoint) is saved in the data
+file in the same transaction as the balances, under data_sync.import_batches.
+A retry with that id, from any process, returns the saved summary instead of
+crediting again; the same id with different rows is refused.
+
+    python balance_import.py promo.csv --reason promo [--batch-id promo-2026-10] [--dry-run]
+"""
+
+import csv
+import hashlib
+import io
+import json
+import logging
+import math
+import sys
+import time
+
+import bot_settings
+import data_sync
+import events
+import metrics
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'ndjson')
+# Rejected rows listed in a report; the rest are only counted
+MAX_REPORTED = 100
+# Applied batch ids kept in the data file, newest first
+MAX_BATCHES = 1000
+MAX_BATCH_ID_LENGTH = 255
+
+IMPORT_ROWS = metrics.Counter('balance_import_rows_total', 'Bulk balance import rows by outcome', ('outcome',))
+
+def _parse_row(record):
+    """(user_id, 'delta' | 'balance', amount) from a row mapping; ValueError with the reason"""
+    user_id = str(record.get('user_id') or '').strip()
+    if not user_id.isdigit():
+        raise ValueError('user_id must be a number')
+    delta, balance = record.get('delta'), record.get('balance')
+    # CSV has both columns when some rows use one and some the other
+    delta = None if delta in (None, '') else delta
+    balance = None if balance in (None, '') else balance
+    if (delta is None) == (balance is None):
+        raise ValueError('exactly one of delta or balance is required')
+    kind, raw = ('delta', delta) if delta is not None else ('balance', balance)
+    try:
+        amount = float(raw)
+    except (TypeError, ValueError):
+        raise ValueError(f'{kind} is not a number') from None
+    if not math.isfinite(amount):
+        raise ValueError(f'{kind} is not a number')
+    if kind == 'balance' and amount < 0:
+        raise ValueError('balance cannot be negative')
+    return user_id, kind, amount
+
+def _records(lines, fmt):
+    """Yield (line number, mapping or None if unreadable) from text lines"""
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        if not reader.fieldnames or 'user_id' not in reader.fieldnames:
+            raise ValueError('CSV needs a header with user_id and delta or balance')
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_no, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_no, None
+            continue
+        yield line_no, record if isinstance(record, dict) else None
+
+def parse(lines, fmt):
+    """Valid rows [(line, user_id, kind, amount)] and rejected rows [(line, reason)].
+    Raises ValueError if the input as a whole is unusable (unknown format, no CSV header)."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r} (one of: {', '.join(FORMATS)})")
+    rows, rejected = [], []
+    for line_no, record in _records(lines, fmt):
+        if record is None:
+            rejected.append((line_no, 'not a JSON object'))
+            continue
+        try:
+            rows.append((line_no,) + _parse_row(record))
+        except ValueError as e:
+            rejected.append((line_no, str(e)))
+    return rows, rejected
+
+class BatchConflict(ValueError):
+    """The batch id was already applied with different rows"""
+
+def fingerprint(rows):
+    """Digest of the parsed rows, to tell a retry of a batch from a different one"""
+    digest = hashlib.sha1()
+    for row in rows:
+        digest.update(repr(row).encode())
+    return digest.hexdigest()
+
+def _remember_batch(batch_id, summary):
+    """Record an applied batch in the data; caller holds the transaction"""
+    batches = data_sync.import_batches
+    batches[batch_id] = summary
+    if len(batches) > MAX_BATCHES:
+        for old_id in sorted(batches, key=lambda key: batches[key]['ts'])[:len(batches) - MAX_BATCHES]:
+            del batches[old_id]
+
+def apply(rows, reason='import', dry_run=False, batch_id=None):
+    """Apply parsed rows in one transaction: (applied, rejected [(line, reason)], users, total delta),
+    or the saved summary dict if batch_id was applied before (BatchConflict if with other rows).
+    With dry_run everything is checked against the current balances and nothing is saved."""
+    max_balance = float(bot_settings.get_setting('max_balance_uah'))
+    applied, rejected = 0, []
+    # user_id -> balance before the batch, for one event per user
+    before = {}
+    digest = fingerprint(rows) if batch_id is not None else None
+    with data_sync.transaction():
+        if batch_id is not None and batch_id in data_sync.import_batches:
+            summary = data_sync.import_batches[batch_id]
+            if summary['fingerprint'] != digest:
+                raise BatchConflict(f"Batch {batch_id!r} was already applied with different rows")
+            return summary
+        balances = data_sync.user_balances
+        # A dry run works on the changed entries only, never on the live balances
+        changed = {}
+        for line_no, user_id, kind, amount in rows:
+            current = changed.get(user_id, balances.get(user_id, 0.0))
+            new_balance = current + amount if kind == 'delta' else amount
+            if new_balance < 0:
+                rejected.append((line_no, f'balance would go below 0 ({current:.2f} {amount:+.2f})'))
+                continue
+            if new_balance > max_balance:
+                rejected.append((line_no, f'balance would exceed the limit of {max_balance:,.0f} UAH'))
+                continue
+            before.setdefault(user_id, balances.get(user_id, 0.0))
+            changed[user_id] = new_balance
+            applied += 1
+        total = sum(changed[user_id] - before[user_id] for user_id in changed)
+        if not dry_run and batch_id is not None:
+            # Saved with the balances, so the batch is recorded exactly when it is applied
+            _remember_batch(batch_id, {'ts': time.time(), 'fingerprint': digest, 'reason': reason,
+                                       'applied': applied, 'rejected': len(rejected), 'users': len(changed),
+                                       'total_delta_uah': round(total, 2)})
+        if not dry_run and (changed or batch_id is not None):
+            balances.update(changed)
+            data_sync.save_data()
+            for user_id, new_balance in changed.items():
+                if new_balance != before[user_id]:
+                    data_sync.emit(events.BalanceAdjusted(user_id=user_id, amount_uah=new_balance - before[user_id],
+                                                          balance=new_balance, reason=reason))
+    return applied, rejected, len(changed), total
+
+def import_balances(lines, fmt, reason='import', dry_run=False, batch_id=None):
+    """Parse, check and apply a CSV/NDJSON stream of rows; returns a report dict.
+    A batch applied before is not applied again: the report is its saved summary with replayed=True."""
+    if batch_id is not None and not 0 < len(batch_id) <= MAX_BATCH_ID_LENGTH:
+        raise ValueError(f"Batch id must be 1-{MAX_BATCH_ID_LENGTH} characters")
+    started = time.perf_counter()
+    rows, rejected = parse(lines, fmt)
+    parsed = time.perf_counter()
+    result = apply(rows, reason, dry_run, batch_id)
+    if isinstance(result, dict):
+        logger.info("Balance import batch %s was applied before, not applying again", batch_id)
+        return dict(result, batch_id=batch_id, replayed=True, dry_run=dry_run)
+    applied, rejected_on_apply, users, total = result
+    finished = time.perf_counter()
+    rejected = sorted(rejected + rejected_on_apply)
+    if not dry_run:
+        IMPORT_ROWS.inc(applied, outcome='applied')
+        IMPORT_ROWS.inc(len(rejected), outcome='rejected')
+        logger.info("Balance import (%s): %d rows applied to %d users, %+.2f UAH, %d rejected, %.2fs",
+                    reason, applied, users, total, len(rejected), finished - started)
+    seconds = finished - started
+    return {
+        'dry_run': dry_run,
+        'batch_id': batch_id,
+        'replayed': False,
+        'applied': applied,
+        'rejected': len(rejected),
+        'users': users,
+        'total_delta_uah': round(total, 2),
+        'rejected_rows': [{'line': line_no, 'error': error} for line_no, error in rejected[:MAX_REPORTED]],
+        'parse_seconds': round(parsed - started, 3),
+        'apply_seconds': round(finished - parsed, 3),
+        'rows_per_second': round((applied + len(rejected)) / seconds) if seconds > 0 else None,
+    }
+
+def text_lines(binary):
+    """Text lines of an uploaded byte stream (a UTF-8 BOM is dropped)"""
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Apply balance deltas or set balances from a CSV/NDJSON file')
+    parser.add_argument('file', help="CSV or NDJSON file, '-' for stdin")
+    parser.add_argument('--format', choices=FORMATS, help='default: from the file extension, else csv')
+    parser.add_argument('--reason', default='import', help='recorded with every adjustment (history)')
+    parser.add_argument('--batch-id', help='apply this batch at most once (a rerun returns the first result)')
+    parser.add_argument('--dry-run', action='store_true', help='check the rows against current balances, save nothing')
+    args = parser.parse_args(argv)
+    fmt = args.format or ('ndjson' if args.file.endswith(('.ndjson', '.jsonl')) else 'csv')
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.file == '-':
+        lines = text_lines(sys.stdin.buffer)
+    else:
+        lines = open(args.file, 'r', encoding='utf-8-sig', newline='')
+    try:
+        with lines:
+            report = import_balances(lines, fmt, args.reason, args.dry_run, args.batch_id)
+    except ValueError as e:
+        parser.exit(1, f"{e}\n")
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    data_sync.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmarks of bot.py against the local Bot API stub.
+
+Each scenario runs bot.main() in a fresh process with TELEGRAM_API_URL pointed
+at telegram_stub.StubTelegramServer and a seeded data directory:
+  * commands - users send a command (default /balance) at a fixed rate;
+               handler throughput and update-to-reply latency,
+  * deposit  - every user walks the deposit flow (button, currency, amount);
+               completed flows per second and per-step latency,
+  * win      - every user holds a bet and the admin sends /win; time until
+               all result notifications are sent, and how many were lost.
+
+Examples:
+    python benchmarks/bench_bot.py
+    python benchmarks/bench_bot.py --scenario win --users 2000 --rate-limit 30 --latency 0.02
+    python benchmarks/bench_bot.py --scenario commands --rate 500 --command /start
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from bench_http import RESULTS_DIR, git_revision, percentile, seed_data
+from telegram_stub import StubTelegramServer
+
+SCENARIOS = ('commands', 'deposit', 'win')
+FIRST_USER_ID = 1000000
+# bot.ADMINS[0]
+ADMIN_ID = 5118163519
+DEPOSIT_STEPS = (('callback', 'deposit_balance'), ('text', '💸 UAH'), ('text', '1000 UAH 💰'))
+
+def latency_summary(latencies):
+    values = sorted(latencies)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_ms': round(1000 * sum(values) / len(values), 3),
+        'p50_ms': round(1000 * percentile(values, 0.50), 3),
+        'p95_ms': round(1000 * percentile(values, 0.95), 3),
+        'p99_ms': round(1000 * percentile(values, 0.99), 3),
+        'max_ms': round(1000 * values[-1], 3),
+    }
+
+async def scenario_commands(stub, args):
+    user_ids = [FIRST_USER_ID + i for i in range(args.users)]
+    items = [{'user_id': user_ids[i % len(user_ids)], 'text': args.command} for i in range(args.updates)]
+    start = time.monotonic()
+    await stub.play(items, args.rate)
+    completed = await stub.wait_for(lambda s: len(s.sent) >= len(items), args.timeout)
+    elapsed = (stub.sent[-1]['time'] if stub.sent else time.monotonic()) - start
+    return {
+        'updates': len(items),
+        'replies': len(stub.sent),
+        'completed': completed,
+        'seconds': round(elapsed, 3),
+        'updates_per_second': round(len(stub.sent) / elapsed, 2) if elapsed else None,
+        'latency': latency_summary(stub.reply_latencies()),
+    }
+
+async def scenario_deposit(stub, args):
+    user_ids = [FIRST_USER_ID + i for i in range(args.users)]
+    flow_times = []
+
+    async def walk(user_id, delay):
+        await asyncio.sleep(delay)
+        started = time.monotonic()
+        for step, (kind, value) in enumerate(DEPOSIT_STEPS, 1):
+            if kind == 'callback':
+                stub.push_callback(user_id, value)
+            else:
+                stub.push_message(user_id, value)
+            replied = await stub.wait_for(
+                lambda s: sum(1 for r in s.sent if r['chat_id'] == user_id) >= step, args.timeout)
+            if not replied:
+                return
+        flow_times.append(time.monotonic() - started)
+
+    start = time.monotonic()
+    # Users start their flows at `rate` per second
+    await asyncio.gather(*(walk(user_id, i / args.rate if args.rate else 0)
+                           for i, user_id in enumerate(user_ids)))
+    elapsed = time.monotonic() - start
+    return {
+        'users': len(user_ids),
+        'completed_flows': len(flow_times),
+        'seconds': round(elapsed, 3),
+        'flows_per_second': round(len(flow_times) / elapsed, 2) if elapsed else None,
+        'flow_latency': latency_summary(flow_times),
+        'step_latency': latency_summary(stub.reply_latencies()),
+    }
+
+async def scenario_win(stub, args, settings):
+    import metrics
+
+    winner = settings['teams']['team2']
+    start = time.monotonic()
+    stub.push_message(ADMIN_ID, f'/win {winner}')
+
+    def finished(s):
+        # Every notification was attempted; they are sent from the outbox after the handler returns
+        return sum(metrics.NOTIFICATIONS.get(kind=kind, outcome=outcome)
+                   for kind in ('win', 'lose') for outcome in ('ok', 'error')) >= args.users
+
+    completed = await stub.wait_for(finished, args.timeout)
+    notifications = [r for r in stub.sent if r['chat_id'] != ADMIN_ID]
+    elapsed = (notifications[-1]['time'] if notifications else time.monotonic()) - start
+    failed = sum(metrics.NOTIFICATIONS.get(kind=kind, outcome='error') for kind in ('win', 'lose'))
+    return {
+        'bettors': args.users,
+        'completed': completed,
+        'notifications_sent': len(notifications),
+        'notifications_failed': failed,
+        'throttled_429': sum(stub.throttled.values()),
+        'seconds_to_last_notification': round(elapsed, 3),
+        'notifications_per_second': round(len(notifications) / elapsed, 2) if elapsed else None,
+        'settlement_p50_s': metrics.SETTLEMENT_LATENCY.quantile(0.5),
+    }
+
+async def run_scenario(args):
+    """Start the stub, import and start the bot, run one scenario"""
+    stub = StubTelegramServer(args.latency, args.jitter, args.rate_limit, args.chat_rate_limit, args.error_rate)
+    url = await stub.start()
+    os.environ['TELEGRAM_API_URL'] = url
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:BENCHMARK')
+    if not args.throttling:
+        os.environ['RATE_LIMIT_ENABLED'] = '0'
+
+    import bot
+
+    polling = asyncio.create_task(bot.main())
+    # Started once the bot has registered its commands and begun polling
+    await stub.wait_for(lambda s: s.calls['getupdates'] > 0, 30)
+    stub.sent.clear()
+    try:
+        if args.child == 'commands':
+            result = await scenario_commands(stub, args)
+        elif args.child == 'deposit':
+            result = await scenario_deposit(stub, args)
+        else:
+            with open('bot_settings.json', encoding='utf-8') as f:
+                result = await scenario_win(stub, args, json.load(f))
+    finally:
+        await bot.dp.stop_polling()
+        polling.cancel()
+        for task in asyncio.all_tasks():
+            if task is not asyncio.current_task():
+                task.cancel()
+        await stub.stop()
+    result['stub'] = stub.summary()
+    return result
+
+def run_child(args):
+    directory = tempfile.mkdtemp(prefix='bench-bot-')
+    try:
+        os.chdir(directory)
+        seed_data(directory, args.users, bet_ratio=1.0 if args.child == 'win' else 0.0)
+        # seed_data uses string ids starting at FIRST_USER_ID, as the web app stores them
+        result = asyncio.run(run_scenario(args))
+        print(json.dumps(result))
+    finally:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(directory, ignore_errors=True)
+
+def measure(scenario, argv):
+    env = dict(os.environ, LOG_LEVEL=os.environ.get('LOG_LEVEL', 'ERROR'))
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', scenario] + argv,
+                            env=env, capture_output=True, text=True)
+    if output.returncode != 0:
+        raise SystemExit(f"Scenario {scenario} failed:\n{output.stderr[-3000:]}")
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scenario', default=','.join(SCENARIOS), help=f"comma-separated: {', '.join(SCENARIOS)}")
+    parser.add_argument('--users', type=int, default=500, help='simulated users (bettors for win)')
+    parser.add_argument('--updates', type=int, default=2000, help='updates sent in the commands scenario')
+    parser.add_argument('--rate', type=float, default=200.0,
+                        help='updates (commands) or flow starts (deposit) per second, 0 = all at once')
+    parser.add_argument('--command', default='/balance', help='command for the commands scenario')
+    parser.add_argument('--latency', type=float, default=0.0, help='stub latency per Bot API call, seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random stub latency, seconds')
+    parser.add_argument('--rate-limit', type=float, help='stub global messages/s before 429 (Telegram: ~30)')
+    parser.add_argument('--chat-rate-limit', type=float, help='stub messages/s per chat before 429 (Telegram: ~1)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of a random 429 per send')
+    parser.add_argument('--throttling', action='store_true', help="keep the bot's own per-user rate limiting on")
+    parser.add_argument('--timeout', type=float, default=120.0, help='seconds to wait for a scenario to finish')
+    parser.add_argument('--output', help='results JSON path (default: benchmarks/results/bot-<time>.json)')
+    parser.add_argument('--child', choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args)
+        return None
+
+    argv = list(sys.argv[1:] if argv is None else argv)
+    # Options are passed through to the scenario processes
+    if '--scenario' in argv:
+        index = argv.index('--scenario')
+        del argv[index:index + 2]
+    argv = [arg for arg in argv if not arg.startswith('--scenario=')]
+
+    results = {}
+    for scenario in args.scenario.split(','):
+        if scenario not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario: {scenario} (known: {', '.join(SCENARIOS)})")
+        results[scenario] = measure(scenario, argv)
+        print(f"{scenario}: {json.dumps({k: v for k, v in results[scenario].items() if k != 'stub'})}", flush=True)
+
+    report = {
+        'meta': {
+            'benchmark': 'bot',
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'options': {k: v for k, v in vars(args).items() if k not in ('child', 'output')},
+        },
+        'results': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"bot-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {output}")
+    return report
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+HTTP load test for the web API.
+
+Seeds betting_data.json / bot_settings.json with N synthetic users in a
+temporary directory, starts the web server there, drives the API endpoints
+with a configurable concurrency and request mix, and reports throughput and
+p50/p95/p99 latency per endpoint. Results are written as JSON so runs of
+different versions can be compared (--compare).
+
+Examples:
+    python benchmarks/bench_http.py --users 10000 --concurrency 16 --duration 20
+    python benchmarks/bench_http.py --mix balance=3,check_result=3,place_bet=1
+    python benchmarks/bench_http.py --compare benchmarks/results/old.json
+    python benchmarks/bench_http.py --url http://127.0.0.1:5000   # already running server
+
+With --url the synthetic users exist only locally, so balance-dependent requests
+(place_bet) are rejected by the target server; use it for read mixes.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, 'benchmarks', 'results')
+sys.path.insert(0, REPO_DIR)
+
+MIXES = {
+    'read': {'balance': 4, 'check_result': 4, 'settings': 2},
+    'write': {'place_bet': 1, 'deposit': 1},
+    'mixed': {'balance': 30, 'check_result': 30, 'settings': 15, 'place_bet': 10, 'deposit': 15},
+}
+ENDPOINTS = ('balance', 'check_result', 'settings', 'place_bet', 'deposit', 'bootstrap')
+
+# Default server: the Flask app on its built-in threaded server
+DEFAULT_SERVER_CMD = [sys.executable, '-c',
+                      'import os, web_server; '
+                      'web_server.app.run(host="127.0.0.1", port=int(os.environ["PORT"]), threaded=True)']
+
+def seed_data(directory, users, bet_ratio=0.1):
+    """Write synthetic data and settings files; returns (user ids, ids without a bet, settings)"""
+    import bot_settings
+
+    settings = json.loads(json.dumps(bot_settings.DEFAULT_SETTINGS))
+    team1, team2 = settings['teams']['team1'], settings['teams']['team2']
+    user_ids = [str(1000000 + i) for i in range(users)]
+    balances = {}
+    states = {}
+    for i, user_id in enumerate(user_ids):
+        balances[user_id] = 10000.0
+        if random.random() < bet_ratio:
+            team = team1 if i % 2 else team2
+            states[user_id] = {'team': team, 'currency': '💸 UAH', 'coef': 2.0, 'bet': 100.0, 'bet_uah': 100.0}
+    data = {
+        'user_balances': balances,
+        'user_bets': list(states),
+        'user_state': states,
+        'match_result': None,
+        'user_results': {},
+    }
+    with open(os.path.join(directory, 'betting_data.json'), 'w') as f:
+        json.dump(data, f, indent=2)
+    with open(os.path.join(directory, 'bot_settings.json'), 'w', encoding='utf-8') as f:
+        json.dump(settings, f, ensure_ascii=False, indent=2)
+    return user_ids, [user_id for user_id in user_ids if user_id not in states], settings
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_ready(host, port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=1)
+            conn.request('GET', '/ping')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"Server on port {port} did not become ready")
+
+def start_server(directory, port, server_cmd):
+    env = dict(os.environ)
+    env.update({
+        'PORT': str(port),
+        'PYTHONPATH': REPO_DIR + os.pathsep + env.get('PYTHONPATH', ''),
+        'RATE_LIMIT_ENABLED': '0',
+        'LOG_LEVEL': env.get('LOG_LEVEL', 'WARNING'),
+    })
+    # Server output goes to a file: an unread pipe would fill up and stall the server
+    log = open(os.path.join(directory, f'server-{port}.log'), 'wb')
+    process = subprocess.Popen(server_cmd, cwd=directory, env=env, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    try:
+        wait_ready('127.0.0.1', port)
+    except RuntimeError:
+        process.kill()
+        with open(os.path.join(directory, f'server-{port}.log'), 'rb') as f:
+            raise RuntimeError(f.read().decode(errors='replace')[-2000:])
+    return process
+
+def parse_mix(text):
+    if text in MIXES:
+        return dict(MIXES[text])
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint in mix: {name} (known: {', '.join(ENDPOINTS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+class FreshBettors:
+    """Hands out users without a bet so place_bet measures accepted bets"""
+
+    def __init__(self, user_ids):
+        self.lock = threading.Lock()
+        self.ids = list(user_ids)
+        random.shuffle(self.ids)
+
+    def next(self):
+        with self.lock:
+            return self.ids.pop() if self.ids else None
+
+def build_request(name, user_id, settings, bettors=None):
+    """(method, path, body) for one request"""
+    if name == 'settings':
+        return 'GET', '/api/settings', None
+    if name == 'place_bet':
+        # Once every user has bet, requests are rejected with 400 (still a valid measurement)
+        user_id = (bettors.next() if bettors is not None else None) or user_id
+        team = random.choice([settings['teams']['team1'], settings['teams']['team2']])
+        body = {'user_id': user_id, 'team': team, 'currency': 'UAH', 'amount': 10, 'coef': 2.0}
+        return 'POST', '/api/place_bet', body
+    if name == 'deposit':
+        return 'POST', '/api/deposit', {'user_id': user_id, 'amount': 10}
+    return 'POST', f'/api/{name}', {'user_id': user_id}
+
+class Worker(threading.Thread):
+    """Keep-alive client issuing requests until the deadline"""
+
+    def __init__(self, host, port, names, weights, user_ids, bettors, settings, start_at, warmup_until, deadline):
+        super().__init__(daemon=True)
+        self.host, self.port = host, port
+        self.names, self.weights = names, weights
+        self.user_ids, self.bettors, self.settings = user_ids, bettors, settings
+        self.start_at, self.warmup_until, self.deadline = start_at, warmup_until, deadline
+        self.latencies = {name: [] for name in names}
+        self.statuses = {name: {} for name in names}
+        self.errors = {name: 0 for name in names}
+
+    def run(self):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        headers = {'Content-Type': 'application/json'}
+        while time.monotonic() < self.start_at:
+            time.sleep(0.001)
+        while True:
+            now = time.monotonic()
+            if now >= self.deadline:
+                break
+            name = random.choices(self.names, self.weights)[0]
+            method, path, body = build_request(name, random.choice(self.user_ids), self.settings, self.bettors)
+            payload = json.dumps(body) if body is not None else None
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+                status = None
+            elapsed = time.perf_counter() - start
+            if now < self.warmup_until:
+                continue
+            if status is None:
+                self.errors[name] += 1
+                self.statuses[name]['connection_error'] = self.statuses[name].get('connection_error', 0) + 1
+                continue
+            self.latencies[name].append(elapsed)
+            self.statuses[name][str(status)] = self.statuses[name].get(str(status), 0) + 1
+            if status >= 500:
+                self.errors[name] += 1
+        conn.close()
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def summarize(latencies, statuses, errors, seconds):
+    values = sorted(latencies)
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'statuses': statuses,
+        'rps': round(len(values) / seconds, 2),
+        'mean_ms': round(1000 * sum(values) / len(values), 3) if values else None,
+        'p50_ms': round(1000 * percentile(values, 0.50), 3) if values else None,
+        'p95_ms': round(1000 * percentile(values, 0.95), 3) if values else None,
+        'p99_ms': round(1000 * percentile(values, 0.99), 3) if values else None,
+        'max_ms': round(1000 * values[-1], 3) if values else None,
+    }
+
+def run_load(host, port, mix, user_ids, fresh_ids, settings, concurrency, duration, warmup):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    start_at = time.monotonic() + 0.2
+    warmup_until = start_at + warmup
+    deadline = warmup_until + duration
+    bettors = FreshBettors(fresh_ids)
+    workers = [Worker(host, port, names, weights, user_ids, bettors, settings, start_at, warmup_until, deadline)
+               for _ in range(concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    per_endpoint = {}
+    all_latencies = []
+    all_statuses = {}
+    all_errors = 0
+    for name in names:
+        latencies = [x for w in workers for x in w.latencies[name]]
+        statuses = {}
+        for w in workers:
+            for status, count in w.statuses[name].items():
+                statuses[status] = statuses.get(status, 0) + count
+                all_statuses[status] = all_statuses.get(status, 0) + count
+        errors = sum(w.errors[name] for w in workers)
+        all_errors += errors
+        all_latencies.extend(latencies)
+        per_endpoint[name] = summarize(latencies, statuses, errors, duration)
+    return {'overall': summarize(all_latencies, all_statuses, all_errors, duration), 'endpoints': per_endpoint}
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results):
+    header = f"{'endpoint':<14}{'req':>9}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'err':>7}"
+    print(header)
+    print('-' * len(header))
+    rows = list(results['endpoints'].items()) + [('overall', results['overall'])]
+    for name, r in rows:
+        print(f"{name:<14}{r['requests']:>9}{r['rps']:>10.1f}{_ms(r['p50_ms'])}{_ms(r['p95_ms'])}"
+              f"{_ms(r['p99_ms'])}{r['errors']:>7}")
+
+def _ms(value):
+    return f"{value:>10.2f}" if value is not None else f"{'-':>10}"
+
+def print_comparison(old, new):
+    print(f"\nCompared with {old['meta'].get('git_revision')} ({old['meta'].get('timestamp')}):")
+    for name, r in list(new['results']['endpoints'].items()) + [('overall', new['results']['overall'])]:
+        before = old['results']['overall'] if name == 'overall' else old['results']['endpoints'].get(name)
+        if not before or not before['rps'] or before['p99_ms'] is None or r['p99_ms'] is None:
+            continue
+        print(f"  {name:<14} rps {before['rps']:>9.1f} -> {r['rps']:>9.1f} ({100 * (r['rps'] / before['rps'] - 1):+.1f}%)"
+              f"   p99 {before['p99_ms']:>8.2f} -> {r['p99_ms']:>8.2f} ms")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=1000, help='synthetic users to seed')
+    parser.add_argument('--concurrency', type=int, default=8, help='parallel keep-alive clients')
+    parser.add_argument('--duration', type=float, default=10.0, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=2.0, help='unmeasured seconds before measuring')
+    parser.add_argument('--mix', default='mixed', help=f"{', '.join(MIXES)} or name=weight,... over {', '.join(ENDPOINTS)}")
+    parser.add_argument('--url', help='benchmark an already running server instead (its data is not seeded)')
+    parser.add_argument('--server-cmd', help='command that starts the server on $PORT in the data directory')
+    parser.add_argument('--output', help='results JSON path (default: benchmarks/results/http-<time>.json)')
+    parser.add_argument('--compare', help='previous results JSON to compare with')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    mix = parse_mix(args.mix)
+    directory = tempfile.mkdtemp(prefix='bench-http-')
+    process = None
+    try:
+        user_ids, fresh_ids, settings = seed_data(directory, args.users)
+        if args.url:
+            parts = urlsplit(args.url)
+            host, port = parts.hostname, parts.port or 80
+        else:
+            host, port = '127.0.0.1', free_port()
+            server_cmd = args.server_cmd.split() if args.server_cmd else DEFAULT_SERVER_CMD
+            process = start_server(directory, port, server_cmd)
+
+        print(f"Load: {args.concurrency} clients, {args.duration:g}s (+{args.warmup:g}s warmup), "
+              f"{args.users} users, mix {mix}")
+        results = run_load(host, port, mix, user_ids, fresh_ids, settings, args.concurrency, args.duration, args.warmup)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(10)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'benchmark': 'http',
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'users': args.users,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'mix': mix,
+            'server': args.url or args.server_cmd or 'flask dev server (threaded)',
+        },
+        'results': results,
+    }
+    print_results(results)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"http-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), report)
+    return report
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the data_sync JSON store.
+
+Measures load_data, save_data, reload_data, update_user_balance,
+clear_all_bets and the /api/check_result route at increasing user counts. Every (operation, size) pair runs in
+a fresh subprocess against a seeded data file so peak RSS is attributable to
+that pair alone. Reported per operation:
+  * wall time (min / median over the repeats),
+  * bytes read and written (from data_sync's storage metrics),
+  * peak RSS growth over the seeded process,
+  * allocations: tracemalloc peak and net allocated blocks of one call.
+
+Examples:
+    python benchmarks/bench_storage.py
+    python benchmarks/bench_storage.py --sizes 1000,10000 --ops save_data,update_user_balance
+    python benchmarks/bench_storage.py --sizes 1000,100000,1000000 --ops check_result
+    python benchmarks/bench_storage.py --compare benchmarks/results/storage-old.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from bench_http import RESULTS_DIR, git_revision
+
+OPERATIONS = ('load_data', 'save_data', 'reload_data', 'update_user_balance', 'clear_all_bets', 'check_result')
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+BET_RATIO = 0.1
+
+def seed_file(path, users, settled=False):
+    """Data file with `users` balances, BET_RATIO of them with a bet;
+    with settled, the match is over and every bet has its result"""
+    balances = {}
+    states = {}
+    results = {}
+    for i in range(users):
+        user_id = str(1000000 + i)
+        balances[user_id] = 1000.0
+        if i % int(1 / BET_RATIO) == 0:
+            states[user_id] = _bet_state(i)
+            if settled:
+                results[user_id] = _result(states[user_id], balances[user_id])
+    with open(path, 'w') as f:
+        json.dump({
+            'user_balances': balances,
+            'user_bets': list(states),
+            'user_state': states,
+            'match_result': WINNER if settled else None,
+            'user_results': results,
+        }, f, indent=2)
+
+def _bet_state(i):
+    team = 'Faze' if i % 2 else 'Sovkamax'
+    return {'team': team, 'currency': '💸 UAH', 'coef': 2.22 if team == 'Faze' else 1.82,
+            'bet': 100.0, 'bet_uah': 100.0}
+
+WINNER = 'Faze'
+
+def _result(state, balance):
+    if state['team'] == WINNER:
+        payout = state['bet_uah'] * state['coef']
+        return {'result': 'win', 'balance': balance, 'winnings': payout - state['bet_uah'], 'payout': payout,
+                'winning_team': WINNER, 'user_team': state['team']}
+    return {'result': 'lose', 'balance': balance, 'lost': state['bet_uah'],
+            'winning_team': WINNER, 'user_team': state['team']}
+
+def _peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _storage_bytes(metrics):
+    return (metrics.STORAGE_BYTES.get(operation='load'), metrics.STORAGE_BYTES.get(operation='save'))
+
+def run_child(operation, users, repeat, budget):
+    """Measure one operation in this (fresh) process; prints a JSON result"""
+    directory = tempfile.mkdtemp(prefix='bench-storage-')
+    try:
+        os.chdir(directory)
+        # check_result reads results, so its match is already settled
+        seed_file('betting_data.json', users, settled=operation == 'check_result')
+        import data_sync
+        import metrics
+
+        # data_sync loads lazily; the seeded load is not part of any measurement
+        data_sync.reload_data()
+        user_ids = list(data_sync.user_balances)
+        client = None
+        if operation == 'check_result':
+            # The whole route through Flask's test client: JSON in, refresh_data, lookup, JSON out
+            import web_server
+            client = web_server.app.test_client()
+
+        def prepare():
+            # clear_all_bets needs bets to clear on every run
+            if operation == 'clear_all_bets' and not data_sync.user_state:
+                for i, user_id in enumerate(user_ids[::int(1 / BET_RATIO)]):
+                    data_sync.user_state[user_id] = _bet_state(i)
+                    data_sync.user_bets.add(user_id)
+
+        def call():
+            if operation == 'load_data':
+                data_sync.load_data()
+            elif operation == 'save_data':
+                data_sync.save_data()
+            elif operation == 'reload_data':
+                data_sync.reload_data()
+            elif operation == 'update_user_balance':
+                data_sync.update_user_balance(random.choice(user_ids), 1.0)
+            elif operation == 'clear_all_bets':
+                data_sync.clear_all_bets()
+            elif operation == 'check_result':
+                response = client.post('/api/check_result', json={'user_id': random.choice(user_ids)})
+                assert response.status_code == 200, response.status_code
+
+        rss_before = _peak_rss()
+        times = []
+        read_bytes = written_bytes = 0
+        started = time.perf_counter()
+        while len(times) < repeat and (not times or time.perf_counter() - started < budget):
+            prepare()
+            loaded, saved = _storage_bytes(metrics)
+            start = time.perf_counter()
+            call()
+            times.append(time.perf_counter() - start)
+            after_loaded, after_saved = _storage_bytes(metrics)
+            read_bytes, written_bytes = after_loaded - loaded, after_saved - saved
+        rss_peak = _peak_rss()
+
+        # One more call under tracemalloc, kept out of the timings
+        prepare()
+        tracemalloc.start()
+        blocks_before = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+        tracemalloc.reset_peak()
+        call()
+        _, traced_peak = tracemalloc.get_traced_memory()
+        blocks_after = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+        tracemalloc.stop()
+
+        result = {
+            'operation': operation,
+            'users': users,
+            'runs': len(times),
+            'min_ms': round(min(times) * 1000, 3),
+            'median_ms': round(statistics.median(times) * 1000, 3),
+            'bytes_read': read_bytes,
+            'bytes_written': written_bytes,
+            'file_bytes': os.path.getsize('betting_data.json'),
+            'peak_rss_growth_bytes': rss_peak - rss_before if rss_before is not None else None,
+            'alloc_peak_bytes': traced_peak,
+            'alloc_net_blocks': blocks_after - blocks_before,
+        }
+        print(json.dumps(result))
+    finally:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(directory, ignore_errors=True)
+
+def measure(operation, users, repeat, budget):
+    """Run one (operation, size) pair in a subprocess"""
+    env = dict(os.environ, LOG_LEVEL='WARNING', RATE_LIMIT_ENABLED='0')
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', operation, str(users),
+         '--repeat', str(repeat), '--budget', str(budget)],
+        env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def _size(value):
+    if value is None:
+        return '-'
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(value) < 1024 or unit == 'GB':
+            return f'{value:.0f} {unit}' if unit == 'B' else f'{value:.1f} {unit}'
+        value /= 1024
+
+def print_row(r):
+    print(f"{r['operation']:<20}{r['users']:>9}{r['min_ms']:>11.2f}{r['median_ms']:>11.2f}"
+          f"{_size(r['bytes_read']):>11}{_size(r['bytes_written']):>11}{_size(r['peak_rss_growth_bytes']):>11}"
+          f"{_size(r['alloc_peak_bytes']):>11}{r['alloc_net_blocks']:>9}", flush=True)
+
+def print_comparison(old, new):
+    print(f"\nCompared with {old['meta'].get('git_revision')} ({old['meta'].get('timestamp')}):")
+    before = {(r['operation'], r['users']): r for r in old['results']}
+    for r in new['results']:
+        b = before.get((r['operation'], r['users']))
+        if b is None or not b['median_ms']:
+            continue
+        print(f"  {r['operation']:<20}{r['users']:>9}  median {b['median_ms']:>10.2f} -> {r['median_ms']:>10.2f} ms "
+              f"({100 * (r['median_ms'] / b['median_ms'] - 1):+.1f}%)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help='comma-separated user counts')
+    parser.add_argument('--ops', default=','.join(OPERATIONS), help='comma-separated operations')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per operation')
+    parser.add_argument('--budget', type=float, default=10.0,
+                        help='stop repeating an operation after this many seconds (at least one run)')
+    parser.add_argument('--output', help='results JSON path (default: benchmarks/results/storage-<time>.json)')
+    parser.add_argument('--compare', help='previous results JSON to compare with')
+    parser.add_argument('--child', nargs=2, metavar=('OPERATION', 'USERS'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child[0], int(args.child[1]), args.repeat, args.budget)
+        return None
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    operations = args.ops.split(',')
+    for operation in operations:
+        if operation not in OPERATIONS:
+            raise SystemExit(f"Unknown operation: {operation} (known: {', '.join(OPERATIONS)})")
+
+    print(f"{'operation':<20}{'users':>9}{'min ms':>11}{'median ms':>11}{'read':>11}{'written':>11}"
+          f"{'rss +':>11}{'alloc pk':>11}{'blocks':>9}")
+    results = []
+    for users in sizes:
+        for operation in operations:
+            result = measure(operation, users, args.repeat, args.budget)
+            results.append(result)
+            print_row(result)
+
+    report = {
+        'meta': {
+            'benchmark': 'storage',
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sizes': sizes,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"storage-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), report)
+    return report
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+"""
+Concurrency stress test that checks money is conserved.
+
+Starts several web server processes and one bot process (against the Bot API
+stub) over the same data directory, then concurrently:
+  * web client threads deposit, place bets and poll check_result,
+  * the bot walks its deposit flow for its own users,
+and finally settles the match from several web processes and the bot's /win
+at the same moment. Every confirmed operation is written to a client-side
+ledger, and the final data file is checked against it:
+  * conservation: deposits - stakes + payouts == sum of balances,
+  * per user: no lost deposit or stake (under-credited) and no double
+    payout (over-credited),
+  * no lost bets: every accepted bet has a settled result,
+  * the match is settled once, and no balance is negative.
+Throughput and latency of every operation are reported as well.
+
+Exit status is 1 when an invariant is violated, so the harness can gate a
+change to the storage or concurrency scheme.
+
+Examples:
+    python benchmarks/stress_money.py
+    python benchmarks/stress_money.py --web-procs 4 --threads 32 --users 1000 --bot-users 100
+    python benchmarks/stress_money.py --web-procs 1 --threads 1 --bot-users 0   # sequential baseline
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from bench_http import DEFAULT_SERVER_CMD, RESULTS_DIR, free_port, git_revision, percentile, start_server
+
+FIRST_WEB_USER = 2000000
+FIRST_BOT_USER = 3000000
+# bot.ADMINS[0]
+ADMIN_ID = 5118163519
+BOT_DEPOSITS = (('💸 UAH', '500 UAH 💰', 500.0), ('💸 UAH', '1000 UAH 💰', 1000.0), ('💵 USD', '10 USD 💰', None))
+EPSILON = 1e-6
+# Protocol lines from the bot worker, so its log output can share stdout
+MARKER = '@@ '
+
+# === Ledger ===
+
+class Ledger:
+    """Client-side record of every confirmed operation, and per-op timings"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.deposits = defaultdict(float)
+        self.stakes = {}
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(lambda: defaultdict(int))
+
+    def record(self, op, seconds, outcome):
+        with self.lock:
+            self.latencies[op].append(seconds)
+            self.outcomes[op][outcome] += 1
+
+    def deposit(self, user_id, amount):
+        with self.lock:
+            self.deposits[user_id] += amount
+
+    def stake(self, user_id, team, amount):
+        with self.lock:
+            self.stakes[user_id] = (team, amount)
+
+# === Web clients ===
+
+def call(conn, method, path, body=None, headers=None):
+    payload = json.dumps(body) if body is not None else None
+    conn.request(method, path, body=payload, headers=dict({'Content-Type': 'application/json'}, **(headers or {})))
+    response = conn.getresponse()
+    data = response.read()
+    try:
+        return response.status, json.loads(data)
+    except ValueError:
+        return response.status, None
+
+def web_client(ports, users, deposits_per_user, coefficients, ledger, errors):
+    """Deposit, bet and poll for each user, spreading requests over all web processes"""
+    conns = {port: http.client.HTTPConnection('127.0.0.1', port, timeout=60) for port in ports}
+
+    def timed(op, method, path, body):
+        conn = conns[random.choice(ports)]
+        start = time.perf_counter()
+        try:
+            user_id = body['user_id']
+            status, data = call(conn, method, path, body, {'Idempotency-Key': f'{op}-{random.getrandbits(64):x}'})
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            ledger.record(op, time.perf_counter() - start, 'connection_error')
+            errors.append(f'{op} {user_id}: {e}')
+            return None, None
+        ledger.record(op, time.perf_counter() - start, str(status))
+        if status != 200 and len(errors) < 100:
+            errors.append(f"{op} {user_id} {status}: {(data or {}).get('error')}")
+        return status, data
+
+    for user_id in users:
+        for _ in range(deposits_per_user):
+            amount = float(random.randint(100, 2000))
+            status, data = timed('deposit', 'POST', '/api/deposit', {'user_id': user_id, 'amount': amount})
+            if status == 200 and data and data.get('success'):
+                ledger.deposit(user_id, amount)
+        team = random.choice(list(coefficients))
+        amount = float(random.randint(50, 300))
+        # The coefficient the WebApp shows, as the real client sends it
+        status, data = timed('place_bet', 'POST', '/api/place_bet',
+                             {'user_id': user_id, 'team': team, 'currency': 'UAH', 'amount': amount,
+                              'coef': coefficients[team]})
+        if status == 200 and data and data.get('success'):
+            ledger.stake(user_id, team, amount)
+        timed('check_result', 'POST', '/api/check_result', {'user_id': user_id})
+    for conn in conns.values():
+        conn.close()
+
+# === Bot worker (separate process) ===
+
+def emit(event, **fields):
+    print(MARKER + json.dumps(dict(fields, event=event)), flush=True)
+
+async def bot_worker(user_ids, seed):
+    """Run bot.main() against the stub, deposit for user_ids, then /win on request"""
+    from telegram_stub import StubTelegramServer
+
+    random.seed(seed)
+    stub = StubTelegramServer()
+    os.environ['TELEGRAM_API_URL'] = await stub.start()
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:STRESS')
+    os.environ['RATE_LIMIT_ENABLED'] = '0'
+    import bot
+    import bot_settings
+    import metrics
+
+    polling = asyncio.create_task(bot.main())
+    await stub.wait_for(lambda s: s.calls['getupdates'] > 0, 60)
+    emit('ready')
+    await asyncio.to_thread(sys.stdin.readline)
+
+    rates = bot_settings.get_exchange_rates()
+    deposits = []
+
+    async def walk(user_id):
+        currency, amount_text, amount_uah = random.choice(BOT_DEPOSITS)
+        if amount_uah is None:
+            amount_uah = float(amount_text.split()[0]) * rates[currency.split()[-1]]
+        start = time.perf_counter()
+        replied = sum(1 for r in stub.sent if r['chat_id'] == user_id)
+        for step, push in enumerate((lambda: stub.push_callback(user_id, 'deposit_balance'),
+                                     lambda: stub.push_message(user_id, currency),
+                                     lambda: stub.push_message(user_id, amount_text)), 1):
+            push()
+            await stub.wait_for(lambda s: sum(1 for r in s.sent if r['chat_id'] == user_id) >= replied + step, 60)
+        replies = [r['text'] for r in stub.sent if r['chat_id'] == user_id]
+        ok = bool(replies) and replies[-1].startswith('✅')
+        deposits.append({'user_id': str(user_id), 'amount': amount_uah, 'ok': ok,
+                         'seconds': time.perf_counter() - start})
+
+    # Each bot user deposits twice, one flow after the other
+    async def user_flows(user_id):
+        await walk(user_id)
+        await walk(user_id)
+
+    await asyncio.gather(*(user_flows(user_id) for user_id in user_ids))
+    emit('deposits', deposits=deposits)
+
+    winner = (await asyncio.to_thread(sys.stdin.readline)).strip()
+    start = time.perf_counter()
+    stub.push_message(ADMIN_ID, f'/win {winner}')
+    await stub.wait_for(lambda s: sum(metrics.BOT_UPDATES.get(handler='announce_winner', outcome=o)
+                                      for o in ('ok', 'error')) > 0, 120)
+    emit('settled', seconds=time.perf_counter() - start,
+         settled_bets=sum(metrics.SETTLEMENT_BETS.get(result=r) for r in ('win', 'lose')))
+
+    await bot.dp.stop_polling()
+    polling.cancel()
+    await stub.stop()
+
+class BotProcess:
+    """Parent-side handle of the bot worker"""
+
+    def __init__(self, directory, user_ids, seed):
+        env = dict(os.environ, PYTHONPATH=REPO_DIR, LOG_LEVEL='ERROR')
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--bot-worker', ','.join(map(str, user_ids)),
+             '--seed', str(seed)],
+            cwd=directory, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=open(os.path.join(directory, 'bot.log'), 'wb'), text=True)
+
+    def expect(self, event):
+        for line in self.process.stdout:
+            if line.startswith(MARKER):
+                message = json.loads(line[len(MARKER):])
+                if message['event'] == event:
+                    return message
+        raise RuntimeError(f"Bot worker exited before '{event}' (see bot.log)")
+
+    def send(self, line):
+        self.process.stdin.write(line + '\n')
+        self.process.stdin.flush()
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+# === Verification ===
+
+def verify(data, ledger, bot_deposits, coefficients, winner, settle_counts):
+    """Compare the final data file with the ledger; returns (violations, totals)"""
+    balances = {str(k): v for k, v in data.get('user_balances', {}).items()}
+    results = {str(k): v for k, v in data.get('user_results', {}).items()}
+
+    deposits = defaultdict(float, ledger.deposits)
+    for record in bot_deposits:
+        if record['ok']:
+            deposits[record['user_id']] += record['amount']
+    payouts = {user_id: amount * coefficients[team]
+               for user_id, (team, amount) in ledger.stakes.items() if team == winner}
+
+    expected = {}
+    for user_id in set(deposits) | set(ledger.stakes) | set(balances):
+        stake = ledger.stakes.get(user_id, (None, 0.0))[1]
+        expected[user_id] = deposits[user_id] - stake + payouts.get(user_id, 0.0)
+
+    under = {u: (balances.get(u, 0.0), e) for u, e in expected.items() if balances.get(u, 0.0) < e - EPSILON}
+    over = {u: (balances.get(u, 0.0), e) for u, e in expected.items() if balances.get(u, 0.0) > e + EPSILON}
+    lost_bets = [u for u, (team, _) in ledger.stakes.items()
+                 if u not in results or results[u].get('user_team') != team]
+    negative = [u for u, balance in balances.items() if balance < -EPSILON]
+
+    totals = {
+        'deposits': round(sum(deposits.values()), 2),
+        'stakes': round(sum(amount for _, amount in ledger.stakes.values()), 2),
+        'payouts': round(sum(payouts.values()), 2),
+        'balances': round(sum(balances.values()), 2),
+    }
+    totals['expected_balances'] = round(totals['deposits'] - totals['stakes'] + totals['payouts'], 2)
+    totals['difference'] = round(totals['balances'] - totals['expected_balances'], 2)
+
+    violations = {}
+    if abs(totals['difference']) > 0.01:
+        violations['conservation'] = f"sum of balances differs from the ledger by {totals['difference']:+.2f}"
+    if under:
+        violations['under_credited_users'] = _sample(under)
+    if over:
+        violations['over_credited_users'] = _sample(over)
+    if lost_bets:
+        violations['lost_bets'] = {'count': len(lost_bets), 'sample': lost_bets[:5]}
+    if negative:
+        violations['negative_balances'] = {'count': len(negative), 'sample': negative[:5]}
+    settlers = sum(1 for count in settle_counts if count)
+    if settlers > 1:
+        violations['double_settlement'] = f"{settlers} settlement calls each settled bets: {settle_counts}"
+    if data.get('match_result') != winner:
+        violations['match_result'] = f"match_result is {data.get('match_result')!r}, expected {winner!r}"
+    return violations, totals
+
+def _sample(users):
+    sample = dict(list(users.items())[:5])
+    return {'count': len(users),
+            'sample': {u: {'balance': round(a, 2), 'expected': round(e, 2)} for u, (a, e) in sample.items()}}
+
+def throughput(ledger, seconds):
+    report = {}
+    for op, latencies in ledger.latencies.items():
+        values = sorted(latencies)
+        report[op] = {
+            'requests': len(values),
+            'rps': round(len(values) / seconds, 2),
+            'p50_ms': round(1000 * percentile(values, 0.5), 2),
+            'p99_ms': round(1000 * percentile(values, 0.99), 2),
+            'outcomes': dict(ledger.outcomes[op]),
+        }
+    return report
+
+# === Driver ===
+
+def seed(directory):
+    import bot_settings
+
+    settings = json.loads(json.dumps(bot_settings.DEFAULT_SETTINGS))
+    with open(os.path.join(directory, 'bot_settings.json'), 'w', encoding='utf-8') as f:
+        json.dump(settings, f, ensure_ascii=False, indent=2)
+    with open(os.path.join(directory, 'betting_data.json'), 'w') as f:
+        json.dump({'user_balances': {}, 'user_bets': [], 'user_state': {},
+                   'match_result': None, 'user_results': {}}, f)
+    return settings
+
+def settle(ports, winner, settlers, bot):
+    """Fire all settlement calls at once; returns bets settled by each call"""
+    counts = [0] * settlers
+    barrier = threading.Barrier(settlers + (1 if bot else 0))
+
+    def web_settler(i):
+        conn = http.client.HTTPConnection('127.0.0.1', ports[i % len(ports)], timeout=120)
+        barrier.wait()
+        status, data = call(conn, 'POST', '/api/announce_winner', {'winning_team': winner})
+        if status == 200 and data:
+            counts[i] = len(data.get('results', []))
+        conn.close()
+
+    threads = [threading.Thread(target=web_settler, args=(i,)) for i in range(settlers)]
+    for thread in threads:
+        thread.start()
+    bot_result = None
+    if bot:
+        barrier.wait()
+        bot.send(winner)
+        bot_result = bot.expect('settled')
+    for thread in threads:
+        thread.join()
+    if bot_result is not None:
+        counts.append(bot_result['settled_bets'])
+    return counts
+
+def run(args):
+    random.seed(args.seed)
+    directory = tempfile.mkdtemp(prefix='stress-money-')
+    servers = []
+    bot = None
+    try:
+        settings = seed(directory)
+        coefficients = {settings['teams'][key]: settings['coefficients'][key] for key in ('team1', 'team2')}
+        winner = settings['teams']['team1']
+
+        ports = [free_port() for _ in range(args.web_procs)]
+        server_cmd = args.server_cmd.split() if args.server_cmd else DEFAULT_SERVER_CMD
+        for port in ports:
+            servers.append(start_server(directory, port, server_cmd))
+
+        bot_users = [FIRST_BOT_USER + i for i in range(args.bot_users)]
+        if bot_users:
+            bot = BotProcess(directory, bot_users, args.seed)
+            bot.expect('ready')
+
+        web_users = [str(FIRST_WEB_USER + i) for i in range(args.users)]
+        ledger = Ledger()
+        errors = []
+        slices = [web_users[i::args.threads] for i in range(args.threads)]
+        threads = [threading.Thread(target=web_client,
+                                    args=(ports, users, args.deposits_per_user, coefficients, ledger, errors))
+                   for users in slices]
+
+        print(f"Stress: {args.web_procs} web processes, {args.threads} client threads, {args.users} web users, "
+              f"{args.bot_users} bot users, {args.settlers} web settlers" + (" + bot /win" if bot else ""), flush=True)
+        start = time.monotonic()
+        if bot:
+            bot.send('go')
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        bot_deposits = bot.expect('deposits')['deposits'] if bot else []
+        load_seconds = time.monotonic() - start
+        for record in bot_deposits:
+            ledger.record('bot_deposit', record['seconds'], 'ok' if record['ok'] else 'rejected')
+
+        settle_start = time.monotonic()
+        settle_counts = settle(ports, winner, args.settlers, bot)
+        settle_seconds = time.monotonic() - settle_start
+
+        with open(os.path.join(directory, 'betting_data.json')) as f:
+            data = json.load(f)
+        violations, totals = verify(data, ledger, bot_deposits, coefficients, winner, settle_counts)
+        report = {
+            'meta': {
+                'benchmark': 'stress_money',
+                'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'git_revision': git_revision(),
+                'python': platform.python_version(),
+                'options': vars(args),
+            },
+            'load_seconds': round(load_seconds, 3),
+            'settle_seconds': round(settle_seconds, 3),
+            'throughput': throughput(ledger, load_seconds),
+            'settle_counts': settle_counts,
+            'totals': totals,
+            'rejected_sample': errors[:20],
+            'violations': violations,
+        }
+        if args.keep:
+            report['data_dir'] = directory
+        return report
+    finally:
+        if bot is not None:
+            bot.close()
+        for server in servers:
+            server.terminate()
+            server.wait(10)
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+
+def print_report(report):
+    print(f"\nLoad phase {report['load_seconds']:.2f}s, settlement {report['settle_seconds']:.2f}s")
+    print(f"{'operation':<14}{'requests':>10}{'rps':>10}{'p50 ms':>10}{'p99 ms':>10}  outcomes")
+    for op, r in report['throughput'].items():
+        print(f"{op:<14}{r['requests']:>10}{r['rps']:>10.1f}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}  {r['outcomes']}")
+    totals = report['totals']
+    print(f"\nDeposits {totals['deposits']:.2f} - stakes {totals['stakes']:.2f} + payouts {totals['payouts']:.2f} "
+          f"= {totals['expected_balances']:.2f}; balances {totals['balances']:.2f} ({totals['difference']:+.2f})")
+    print(f"Bets settled per settlement call: {report['settle_counts']}")
+    if report['violations']:
+        print("\nINVARIANTS VIOLATED:")
+        for name, detail in report['violations'].items():
+            print(f"  {name}: {json.dumps(detail, ensure_ascii=False)}")
+    else:
+        print("\nAll invariants hold")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--web-procs', type=int, default=2, help='web server processes over the same data')
+    parser.add_argument('--threads', type=int, default=8, help='web client threads')
+    parser.add_argument('--users', type=int, default=200, help='users driven through the web API')
+    parser.add_argument('--deposits-per-user', type=int, default=2, help='web deposits before each bet')
+    parser.add_argument('--bot-users', type=int, default=20, help='users depositing through the bot (0 = no bot)')
+    parser.add_argument('--settlers', type=int, default=2, help='concurrent /api/announce_winner calls')
+    parser.add_argument('--server-cmd', help='command that starts a web server on $PORT in the data directory')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    parser.add_argument('--keep', action='store_true', help='keep the data directory for inspection')
+    parser.add_argument('--output', help='results JSON path (default: benchmarks/results/stress-<time>.json)')
+    parser.add_argument('--bot-worker', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.bot_worker:
+        asyncio.run(bot_worker([int(u) for u in args.bot_worker.split(',')], args.seed))
+        return 0
+
+    report = run(args)
+    print_report(report)
+    output = args.output or os.path.join(RESULTS_DIR, f"stress-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\nResults saved to {output}")
+    return 1 if report['violations'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
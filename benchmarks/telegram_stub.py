@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Telegram Bot API, for benchmarking bot.py offline.
+
+The bot is pointed at it with TELEGRAM_API_URL=http://127.0.0.1:<port>. The
+stub serves getUpdates (long polling) from a queue of scripted updates,
+answers every other method with a plausible result, records outgoing
+messages, and can add latency and flood control like the real API: a global
+and a per-chat message rate above which send methods get a 429 with
+retry_after, plus an optional random 429 rate.
+
+Standalone:
+    python benchmarks/telegram_stub.py --port 8081 --rate-limit 30 --chat-rate-limit 1 \\
+        --script updates.jsonl --script-rate 50
+
+Script lines are {"user_id": 1, "text": "/balance"} or {"user_id": 1, "callback": "show_balance"}.
+In-process use: see bench_bot.py.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+# Methods that count against flood control
+SEND_METHODS = {'sendmessage', 'senddocument', 'sendphoto', 'copymessage', 'forwardmessage'}
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Stub Bot', 'username': 'stub_bot'}
+
+class RateBucket:
+    """Token bucket used to emulate Telegram flood control"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        """0 if a message may be sent now, else seconds until it may"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class StubTelegramServer:
+    """Scriptable fake Bot API server"""
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit=None, chat_rate_limit=None, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.global_bucket = RateBucket(rate_limit) if rate_limit else None
+        self.chat_rate_limit = chat_rate_limit
+        self.chat_buckets = {}
+
+        self.updates = []
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.new_updates = asyncio.Event()
+        # Every pushed update: {'update_id', 'chat_id', 'time'} (monotonic)
+        self.pushed = []
+        # Every successful send: {'time', 'method', 'chat_id', 'text'}
+        self.sent = []
+        self.calls = Counter()
+        self.throttled = Counter()
+        self.runner = None
+
+    # --- scripting ---
+
+    def _push(self, chat_id, update):
+        update_id = next(self.update_ids)
+        update['update_id'] = update_id
+        self.updates.append(update)
+        self.pushed.append({'update_id': update_id, 'chat_id': chat_id, 'time': time.monotonic()})
+        self.new_updates.set()
+        return update_id
+
+    def push_message(self, user_id, text):
+        """Queue a private message from a user; returns its update_id"""
+        message = self._message(user_id, text, _user(user_id))
+        if text.startswith('/'):
+            command = text.split()[0]
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        return self._push(user_id, {'message': message})
+
+    def push_callback(self, user_id, data):
+        """Queue an inline button press; returns its update_id"""
+        return self._push(user_id, {'callback_query': {
+            'id': str(next(self.message_ids)),
+            'from': _user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': self._message(user_id, 'menu', BOT_USER),
+        }})
+
+    def push(self, item):
+        """Queue one script item ({"user_id", "text"} or {"user_id", "callback"})"""
+        if 'callback' in item:
+            return self.push_callback(item['user_id'], item['callback'])
+        return self.push_message(item['user_id'], item['text'])
+
+    async def play(self, items, rate):
+        """Push script items at `rate` updates per second (0 = all at once)"""
+        start = time.monotonic()
+        for i, item in enumerate(items):
+            if rate:
+                delay = start + i / rate - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self.push(item)
+
+    async def wait_for(self, predicate, timeout=60.0):
+        """Wait until predicate(self) is true; returns False on timeout"""
+        deadline = time.monotonic() + timeout
+        while not predicate(self):
+            if time.monotonic() > deadline:
+                return False
+            await asyncio.sleep(0.005)
+        return True
+
+    def reply_latencies(self):
+        """Pair every chat's updates with the messages sent to it, in order; seconds each"""
+        pending = {}
+        for record in self.pushed:
+            pending.setdefault(record['chat_id'], []).append(record['time'])
+        latencies = []
+        for record in self.sent:
+            times = pending.get(record['chat_id'])
+            if times:
+                latencies.append(record['time'] - times.pop(0))
+        return latencies
+
+    def _message(self, chat_id, text, sender):
+        return {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': f'User {chat_id}'},
+            'from': sender,
+            'text': text,
+        }
+
+    # --- HTTP ---
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Start serving; returns the base URL for TELEGRAM_API_URL"""
+        app = web.Application()
+        app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f'http://{host}:{port}'
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    async def handle(self, request):
+        method = request.match_info['method'].lower()
+        self.calls[method] += 1
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+
+        if method == 'getupdates':
+            return _ok(await self._get_updates(params))
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+
+        if method in SEND_METHODS:
+            chat_id = _int(params.get('chat_id'))
+            wait = self._flood_wait(chat_id)
+            if wait:
+                self.throttled[method] += 1
+                retry_after = max(1, math.ceil(wait))
+                return web.json_response({
+                    'ok': False,
+                    'error_code': 429,
+                    'description': f'Too Many Requests: retry after {retry_after}',
+                    'parameters': {'retry_after': retry_after},
+                }, status=429)
+            text = params.get('text') or params.get('caption') or ''
+            self.sent.append({'time': time.monotonic(), 'method': method, 'chat_id': chat_id, 'text': text})
+            return _ok(self._message(chat_id, text, BOT_USER))
+
+        if method == 'getme':
+            return _ok(BOT_USER)
+        if method in ('editmessagetext', 'editmessagereplymarkup'):
+            chat_id = _int(params.get('chat_id'))
+            return _ok(self._message(chat_id, params.get('text', ''), BOT_USER))
+        if method == 'getchat':
+            chat_id = _int(params.get('chat_id'))
+            return _ok({'id': chat_id, 'type': 'private'})
+        # setMyCommands, setChatMenuButton, answerCallbackQuery, deleteWebhook, ...
+        return _ok(True)
+
+    async def _get_updates(self, params):
+        offset = _int(params.get('offset')) or 0
+        timeout = float(params.get('timeout') or 0)
+        limit = _int(params.get('limit')) or 100
+        # Updates before the offset are confirmed by the bot
+        if offset:
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        if not self.updates and timeout:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:limit]
+
+    def _flood_wait(self, chat_id):
+        if self.error_rate and random.random() < self.error_rate:
+            return 1.0
+        if self.chat_rate_limit:
+            bucket = self.chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self.chat_buckets[chat_id] = RateBucket(self.chat_rate_limit, burst=1.0)
+            wait = bucket.take()
+            if wait:
+                return wait
+        if self.global_bucket is not None:
+            return self.global_bucket.take()
+        return 0.0
+
+    def summary(self):
+        return {
+            'calls': dict(self.calls),
+            'sent': len(self.sent),
+            'throttled': dict(self.throttled),
+            'pending_updates': len(self.updates),
+        }
+
+def _user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}', 'language_code': 'ru'}
+
+def _ok(result):
+    return web.json_response({'ok': True, 'result': result})
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+async def serve(args):
+    stub = StubTelegramServer(args.latency, args.jitter, args.rate_limit, args.chat_rate_limit, args.error_rate)
+    url = await stub.start(args.host, args.port)
+    print(f"Stub Bot API on {url} - run the bot with TELEGRAM_API_URL={url}")
+    try:
+        if args.script:
+            with open(args.script) as f:
+                items = [json.loads(line) for line in f if line.strip()]
+            await stub.play(items, args.script_rate)
+            print(f"Pushed {len(items)} scripted updates")
+        while True:
+            await asyncio.sleep(10)
+            print(json.dumps(stub.summary()))
+    finally:
+        print(json.dumps(stub.summary()))
+        await stub.stop()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every method except getUpdates')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random latency up to this many seconds')
+    parser.add_argument('--rate-limit', type=float, help='messages per second across all chats before 429')
+    parser.add_argument('--chat-rate-limit', type=float, help='messages per second to one chat before 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of a random 429 on sends')
+    parser.add_argument('--script', help='JSON lines of updates to push once the server is up')
+    parser.add_argument('--script-rate', type=float, default=0.0, help='updates per second for --script (0 = all)')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,32 @@
 import logging
 import os
 from aiogram import Bot, Dispatcher, types
-from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup, WebAppInfo
+from aiogram.types import FSInputFile, InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup, WebAppInfo
 from aiogram.filters import Command
 from aiogram import F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
 import asyncio
+import html
+import time
+import log_setup
 from datetime import datetime
+from aiogram import BaseMiddleware
 
 # Get API token from environment variable with fallback
 API_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', '8337218457:AAGo9Jxfa3X1IYUtY3x80PtDoVBaAk9Ycwo')
+# Alternative Bot API server (a local telegram-bot-api or the benchmark stub)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+# Seconds to let running handlers and queued notifications finish on shutdown
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', 20))
 
-logging.basicConfig(level=logging.INFO)
-bot = Bot(token=API_TOKEN)
+log_setup.setup_logging()
+logger = logging.getLogger(__name__)
+if TELEGRAM_API_URL:
+    bot = Bot(token=API_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+else:
+    bot = Bot(token=API_TOKEN)
 dp = Dispatcher()
 
 # Available currencies for betting
@@ -45,11 +60,142 @@ ADMINS = [5118163519]  # Replace with actual Telegram user_id
 # Import shared data management
 import data_sync
 import bot_settings
+import changelog
+import events
+import export
+import history
+import leaderboard
 
-# Use shared data structures
-user_state = data_sync.user_state
-user_bets = data_sync.user_bets
-user_balances = data_sync.user_balances
+import rate_limit
+import metrics
+import profiling
+import memory_report
+import runtime_monitor
+import outbox
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+# Deposit dialogue per chat ({"action", "deposit_currency"}), local to this process.
+# Balances and bets live only in data_sync, which other processes write too.
+deposit_flows = {}
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Per-user token bucket and global concurrency cap for incoming updates"""
+    
+    # Warn a throttled user at most this often
+    WARN_INTERVAL = 10.0
+    
+    def __init__(self):
+        self.last_warned = {}
+    
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None or user.id in ADMINS or not rate_limit.ENABLED:
+            return await handler(event, data)
+        
+        if not rate_limit.bot_concurrency.try_acquire():
+            return None
+        try:
+            allowed, _ = rate_limit.limiter.allow("bot", user.id, *rate_limit.BOT_BUDGET)
+            if not allowed:
+                await self.warn(user.id, event)
+                return None
+            return await handler(event, data)
+        finally:
+            rate_limit.bot_concurrency.release()
+    
+    async def warn(self, user_id, update):
+        """Tell the user to slow down, without replying to every dropped update"""
+        now = time.monotonic()
+        if now - self.last_warned.get(user_id, 0.0) < self.WARN_INTERVAL:
+            return
+        if len(self.last_warned) > 10000:
+            self.last_warned.clear()
+        self.last_warned[user_id] = now
+        try:
+            if update.callback_query:
+                await update.callback_query.answer("⏳ Слишком много запросов, подождите немного")
+            elif update.message:
+                await update.message.answer("⏳ Слишком много запросов, подождите немного")
+        except Exception as e:
+            logger.warning("Could not send throttling notice to %s: %s", user_id, e)
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Count and time every handler call by handler name"""
+    
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else "unknown"
+        task = monitor.handler_started(name)
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await handler(event, data)
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            monitor.handler_finished(task)
+            metrics.BOT_LATENCY.observe(time.perf_counter() - start, handler=name)
+            metrics.BOT_UPDATES.inc(handler=name, outcome=outcome)
+
+class TelegramRequestMiddleware(BaseRequestMiddleware):
+    """Track in-flight Bot API requests and their latency"""
+    
+    async def __call__(self, make_request, bot, method):
+        monitor.request_started()
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            monitor.request_finished(type(method).__name__, time.perf_counter() - start)
+
+async def notify_admins(text):
+    """Send a service message to every admin"""
+    for admin_id in ADMINS:
+        try:
+            await bot.send_message(admin_id, text)
+        except Exception as e:
+            logger.warning("Could not notify admin %s: %s", admin_id, e)
+
+# Attempts for a message while Telegram or the network fails; flood limits do not count
+NOTIFICATION_ATTEMPTS = 5
+
+async def send_notification(message):
+    """Send one queued outbox message. A flood limit is waited out and the message
+    sent again, network and server errors are retried with a backoff; a message
+    Telegram refuses (blocked bot, bad chat) is counted, logged and dropped."""
+    attempt = 0
+    while True:
+        try:
+            await bot.send_message(message['chat_id'], message['text'], parse_mode=message.get('parse_mode'))
+            metrics.NOTIFICATIONS.inc(kind=message['kind'], outcome="ok")
+            return
+        except TelegramRetryAfter as e:
+            # The message stays at the head of the outbox while we wait
+            metrics.NOTIFICATIONS.inc(kind=message['kind'], outcome="retry")
+            logger.warning("Flood limit sending to %s, retrying in %ss", message['chat_id'], e.retry_after)
+            await asyncio.sleep(e.retry_after)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            attempt += 1
+            if attempt >= NOTIFICATION_ATTEMPTS:
+                metrics.NOTIFICATIONS.inc(kind=message['kind'], outcome="error")
+                logger.warning("Giving up on %s message to %s after %d attempts: %s",
+                               message['kind'], message['chat_id'], attempt, e)
+                return
+            metrics.NOTIFICATIONS.inc(kind=message['kind'], outcome="retry")
+            await asyncio.sleep(2 ** attempt)
+        except Exception as e:
+            metrics.NOTIFICATIONS.inc(kind=message['kind'], outcome="error")
+            logger.warning("Could not send %s message to %s: %s", message['kind'], message['chat_id'], e)
+            return
+
+monitor = runtime_monitor.RuntimeMonitor(alert=notify_admins)
+notifications = outbox.Outbox()
+bot.session.middleware(TelegramRequestMiddleware())
+
+dp.update.outer_middleware(ThrottlingMiddleware())
+for observer in (dp.message, dp.callback_query):
+    observer.middleware(HandlerMetricsMiddleware())
 
 def get_main_menu():
     """Create main menu with balance and bet info (betting only through WebApp)"""
@@ -91,6 +237,8 @@ async def show_help(message: types.Message):
         "/help — список команд\n"
         "/mybet — показать вашу ставку\n"
         "/balance — показать баланс\n"
+        "/history — история операций\n"
+        "/top — таблица лидеров\n"
     )
     
     # Add admin commands if user is admin
@@ -106,7 +254,7 @@ async def show_help(message: types.Message):
 @dp.message(Command("mybet"))
 async def show_my_bet(message: types.Message):
     """Handle /mybet command - show user's current bet"""
-    user_id = message.from_user.id
+    user_id = str(message.from_user.id)
     
     # Reload data to get latest state from file
     data_sync.reload_data()
@@ -132,7 +280,7 @@ async def show_my_bet(message: types.Message):
 @dp.message(Command("balance"))
 async def show_balance_command(message: types.Message):
     """Handle /balance command - show user's balance"""
-    user_id = message.from_user.id
+    user_id = str(message.from_user.id)
     # Reload data to get latest balance from file
     data_sync.reload_data()
     balance = data_sync.user_balances.get(user_id, 0.0)
@@ -163,7 +311,7 @@ async def new_match(message: types.Message):
 @dp.callback_query(F.data == "show_balance")
 async def show_balance_callback(callback: types.CallbackQuery):
     """Handle balance button click - show user's balance with deposit option"""
-    user_id = callback.from_user.id
+    user_id = str(callback.from_user.id)
     # Reload data to get latest balance from file
     data_sync.reload_data()
     balance = data_sync.user_balances.get(user_id, 0.0)
@@ -192,9 +340,9 @@ async def deposit_balance_callback(callback: types.CallbackQuery):
     user_id = callback.from_user.id
     
     # Store that user wants to deposit
-    if user_id not in user_state:
-        user_state[user_id] = {}
-    user_state[user_id]["action"] = "deposit"
+    if user_id not in deposit_flows:
+        deposit_flows[user_id] = {}
+    deposit_flows[user_id]["action"] = "deposit"
     
     # Create currency selection keyboard
     buttons = [KeyboardButton(text=currency) for currency in FAKE_CURRENCIES]
@@ -255,6 +403,87 @@ async def show_my_bet(callback: types.CallbackQuery):
     )
     await callback.answer()
 
+HISTORY_PAGE = 10
+HISTORY_LABELS = {'deposit': '💳 Пополнение', 'adjustment': '🛠 Корректировка', 'bet': '🎯 Ставка',
+                  'win': '🏆 Выигрыш', 'lose': '😔 Проигрыш'}
+
+def format_history_entry(entry):
+    """Одна строка истории: дата, что произошло, изменение и итоговый баланс"""
+    when = datetime.fromtimestamp(entry['ts']).strftime('%d.%m %H:%M')
+    label = HISTORY_LABELS.get(entry['kind'], entry['kind'])
+    if entry['kind'] == 'bet':
+        label += f" на {entry['team']} (коэф. {entry['coef']})"
+    elif entry['kind'] in ('win', 'lose'):
+        label += f" ({entry['team']})"
+    if entry['kind'] == 'lose':
+        change = f"ставка {entry['bet_uah']:.2f} UAH"
+    else:
+        change = f"{entry['amount_uah']:+.2f} UAH"
+    return f"{when} {label}: {change} → {entry['balance']:.2f} UAH"
+
+async def send_history_page(message: types.Message, user_id, cursor=None):
+    """Страница истории пользователя, от новых к старым, с кнопкой для предыдущих записей"""
+    entries, next_cursor = await asyncio.to_thread(history.page, str(user_id), HISTORY_PAGE, cursor)
+    if not entries:
+        await message.answer("📜 История пуста" if cursor is None else "📜 Более ранних записей нет")
+        return
+    markup = None
+    if next_cursor is not None:
+        markup = InlineKeyboardMarkup(
+            inline_keyboard=[[InlineKeyboardButton(text="⬅️ Ранее", callback_data=f"history:{next_cursor}")]]
+        )
+    title = "📜 *История операций*" if cursor is None else "📜 *Ранее*"
+    lines = "\n".join(format_history_entry(entry) for entry in entries)
+    await message.answer(f"{title}\n\n{lines}", reply_markup=markup, parse_mode="Markdown")
+
+@dp.message(Command("history"))
+async def history_command(message: types.Message):
+    """History command - deposits, bets and results, newest first"""
+    await send_history_page(message, message.from_user.id)
+
+@dp.callback_query(F.data.startswith("history:"))
+async def history_more_callback(callback: types.CallbackQuery):
+    """Next (older) page of the history"""
+    cursor = callback.data[len("history:"):]
+    try:
+        await send_history_page(callback.message, callback.from_user.id, cursor)
+    except ValueError:
+        await callback.message.answer("❌ Не удалось открыть эту страницу истории")
+    await callback.answer()
+
+LEADERBOARD_SIZE = 5
+
+def format_leaderboard(title, entries, key, user_id):
+    """Раздел таблицы лидеров; строка самого пользователя помечена"""
+    if not entries:
+        return f"*{title}*\nпока пусто"
+    lines = []
+    for place, entry in enumerate(entries, 1):
+        me = " ← вы" if entry['user_id'] == user_id else ""
+        lines.append(f"{place}. {leaderboard.mask_user(entry['user_id'])} — {entry[key]:.2f} UAH{me}")
+    return f"*{title}*\n" + "\n".join(lines)
+
+@dp.message(Command("top"))
+async def top_command(message: types.Message):
+    """Leaderboard: balances, winners and biggest payouts of the last match and all-time"""
+    boards = await asyncio.to_thread(leaderboard.board.top, LEADERBOARD_SIZE)
+    if boards is None:
+        await message.answer("❌ Таблица лидеров недоступна: история операций отключена")
+        return
+    user_id = str(message.from_user.id)
+    sections = [format_leaderboard("💰 Балансы", boards['balances'], 'balance', user_id)]
+    if boards['match'] is not None:
+        match = f"матч, победитель {boards['match']['winner']}"
+        sections.append(format_leaderboard(f"🏆 Выигрыш за {match}", boards['winners']['match'],
+                                           'winnings_uah', user_id))
+        sections.append(format_leaderboard(f"💸 Выплаты за {match}", boards['payouts']['match'],
+                                           'payout_uah', user_id))
+    sections.append(format_leaderboard("🏆 Выигрыш за всё время", boards['winners']['all_time'],
+                                       'winnings_uah', user_id))
+    sections.append(format_leaderboard("💸 Крупнейшие выплаты", boards['payouts']['all_time'],
+                                       'payout_uah', user_id))
+    await message.answer("🏅 *Таблица лидеров*\n\n" + "\n\n".join(sections), parse_mode="Markdown")
+
 @dp.message(Command("help"))
 async def help_command(message: types.Message):
     """Help command - show available commands"""
@@ -263,6 +492,8 @@ async def help_command(message: types.Message):
         "🎯 `/start` - Главное меню\n"
         "💰 `/balance` - Показать баланс (или кнопка БАЛАНС)\n"
         "📊 `/mybet` - Моя ставка (или кнопка МОЯ СТАВКА)\n"
+        "📜 `/history` - История пополнений, ставок и выигрышей\n"
+        "🏅 `/top` - Таблица лидеров\n"
         "❓ `/help` - Эта справка\n\n"
         "🎯 *Чтобы сделать ставку:*\n"
         "Нажмите кнопку *СТАВКИ* рядом с полем ввода\n\n"
@@ -335,9 +566,9 @@ async def currency_chosen(message: types.Message):
     currency = message.text
     
     # Check if user is in deposit mode
-    if user_id in user_state and user_state[user_id].get("action") == "deposit":
+    if user_id in deposit_flows and deposit_flows[user_id].get("action") == "deposit":
         # User is depositing - show amount selection
-        user_state[user_id]["deposit_currency"] = currency
+        deposit_flows[user_id]["deposit_currency"] = currency
         
         # Create amount selection based on currency
         if currency in ['💵 USD', '💶 EUR']:
@@ -378,7 +609,7 @@ async def process_deposit_amount_only(message: types.Message):
     user_id = message.from_user.id
     
     # Check if user is depositing
-    if user_id in user_state and user_state[user_id].get("action") == "deposit":
+    if user_id in deposit_flows and deposit_flows[user_id].get("action") == "deposit":
         await process_deposit_amount(message)
         return
     
@@ -394,11 +625,11 @@ async def process_deposit_amount(message: types.Message):
     user_id = message.from_user.id
     
     # Check if user has selected currency
-    if user_id not in user_state or "deposit_currency" not in user_state[user_id]:
+    if user_id not in deposit_flows or "deposit_currency" not in deposit_flows[user_id]:
         await message.answer("❌ Сначала выберите валюту для пополнения через /start → БАЛАНС → Пополнить баланс")
         return
     
-    currency = user_state[user_id]["deposit_currency"]
+    currency = deposit_flows[user_id]["deposit_currency"]
     
     # Parse deposit amount from message
     deposit_text = message.text.replace("💰", "").replace(" ", "").strip()
@@ -426,17 +657,27 @@ async def process_deposit_amount(message: types.Message):
         await message.answer(f"❌ Максимальная сумма пополнения: {max_in_currency:.2f} {get_currency_code(currency)} (50,000 UAH)")
         return
     
-    # Reload data to get latest balance
-    data_sync.reload_data()
-    
-    print(f"BOT DEPOSIT DEBUG: user_id={user_id}, amount={amount} {get_currency_code(currency)}, amount_uah={amount_uah}")
-    
-    # Get current balance BEFORE any operations
-    current_balance = data_sync.user_balances.get(user_id, 0.0)
-    print(f"BOT DEPOSIT DEBUG: current_balance before operations = {current_balance}")
-    
-    # Add deposit amount in UAH to existing balance (correct logic)
-    new_balance = current_balance + amount_uah
+    # Read, check and write the balance as one step: the web app may be changing it too
+    account_id = str(user_id)
+    try:
+        with data_sync.transaction():
+            # Get current balance BEFORE any operations
+            current_balance = data_sync.user_balances.get(account_id, 0.0)
+            
+            # Add deposit amount in UAH to existing balance (correct logic)
+            new_balance = current_balance + amount_uah
+            
+            if new_balance <= 500000:
+                # Set new balance (add UAH equivalent to existing)
+                data_sync.user_balances[account_id] = new_balance
+                # Clear any old match data for fresh start
+                data_sync.reset_user_after_match(account_id)
+                data_sync.save_data()
+                data_sync.emit(events.DepositMade(user_id=account_id, amount_uah=amount_uah,
+                                                  balance=new_balance, source='bot'))
+    except data_sync.SaveError:
+        await message.answer("❌ Не удалось сохранить пополнение, попробуйте ещё раз")
+        return
     
     # Check balance limit after adding deposit
     if new_balance > 500000:
@@ -451,19 +692,14 @@ async def process_deposit_amount(message: types.Message):
         )
         return
     
-    # Set new balance (add UAH equivalent to existing)
-    data_sync.user_balances[user_id] = new_balance
-    print(f"BOT DEPOSIT DEBUG: added {amount_uah} UAH to {current_balance}, new balance = {new_balance}")
-    
-    # Clear any old match data for fresh start
-    data_sync.reset_user_after_match(user_id)
-    data_sync.save_data()
+    logger.info("Bot deposit: user_id=%s amount=%s %s (%.2f UAH) balance %.2f -> %.2f",
+                user_id, amount, get_currency_code(currency), amount_uah, current_balance, new_balance)
     
     # Clear deposit state
-    if user_id in user_state and "action" in user_state[user_id]:
-        del user_state[user_id]["action"]
-        if "deposit_currency" in user_state[user_id]:
-            del user_state[user_id]["deposit_currency"]
+    if user_id in deposit_flows and "action" in deposit_flows[user_id]:
+        del deposit_flows[user_id]["action"]
+        if "deposit_currency" in deposit_flows[user_id]:
+            del deposit_flows[user_id]["deposit_currency"]
     
     currency_code = get_currency_code(currency)
     await message.answer(
@@ -474,6 +710,51 @@ async def process_deposit_amount(message: types.Message):
         parse_mode="Markdown"
     )
 
+async def queue_result_notifications(settled):
+    """Queue win/lose messages for settle_match() results in the persistent outbox,
+    then mark the job notified so a restart does not queue them again"""
+    if not settled:
+        return
+    messages = []
+    for bet_user_id, state, result in settled:
+        currency = state["currency"]
+        bet = state["bet"]
+        
+        if result['result'] == 'win':
+            win_sum = bet * state["coef"]  # total payout in bet currency
+            text = (
+                f"🎉 *Поздравляем! Ваша ставка сыграла!*\n\n"
+                f"🏆 Общий выигрыш: {win_sum:.2f} {currency}\n"
+                f"💰 Выплата: +{result['payout']:.2f} UAH\n"
+                f"💸 Ваш баланс: {result['balance']:.2f} UAH"
+            )
+        else:
+            # User lost - balance already deducted when bet was placed
+            text = (
+                f"😔 *К сожалению, ваша ставка не сыграла.*\n\n"
+                f"💸 Проигрышная ставка: {bet:.2f} {currency}\n"
+                f"📉 Списано с баланса: -{result['lost']:.2f} UAH\n"
+                f"💰 Ваш баланс: {result['balance']:.2f} UAH\n\n"
+                f"🍀 *Удачи в следующий раз!*"
+            )
+        messages.append({'chat_id': bet_user_id, 'text': text, 'kind': result['result'], 'parse_mode': 'Markdown'})
+    notifications.put(messages)
+    # Until this is saved, resume_settlement() returns the job's results again after a crash
+    await asyncio.to_thread(data_sync.mark_notified, settled[0][1]['settled_job'])
+
+async def resume_settlement():
+    """Finish an interrupted settlement job, waiting out its old owner's lease,
+    and queue notifications a crash kept from being queued"""
+    while True:
+        settled = await asyncio.to_thread(data_sync.resume_settlement, True)
+        if settled:
+            logger.info("Resumed settlement finished: %d bets", len(settled))
+            await queue_result_notifications(settled)
+        job = data_sync.get_settlement()
+        if job is None or job['status'] != 'running':
+            return
+        await asyncio.sleep(data_sync.SETTLEMENT_LEASE / 2)
+
 @dp.message(Command("win"))
 async def announce_winner(message: types.Message):
     """Admin command - announce match winner and distribute payouts"""
@@ -495,97 +776,14 @@ async def announce_winner(message: types.Message):
     winner = args[1]
     
     # Log admin action
-    logging.info(f"Admin {user_id} announcing winner: {winner}")
-    
-    # Load data FIRST to get latest state including web app bets
-    data_sync.reload_data()
+    logger.info("Admin %s announcing winner: %s", user_id, winner)
     
-    # Debug: Show current data state BEFORE processing
-    logging.info(f"Processing results - Current state: {len(data_sync.user_state)} users, {len(data_sync.user_bets)} bets")
-    logging.info(f"User states: {list(data_sync.user_state.keys())}")
-    logging.info(f"User bets: {list(data_sync.user_bets)}")
+    # Settle every bet (bot and web app) as a checkpointed job; a rerun resumes it.
+    # Large jobs take a while, so they run off the event loop
+    settled = await asyncio.to_thread(data_sync.settle_match, winner, True)
+    logger.info("Processing results - %d bets settled", len(settled))
     
-    # Store results for web app AFTER loading data but BEFORE processing
-    data_sync.set_match_result(winner)
-    
-    # Process all user bets from data_sync (includes both bot and web app bets)
-    for bet_user_id, state in data_sync.user_state.items():
-        team = state["team"]
-        currency = state["currency"]
-        coef = state["coef"]
-        bet = state.get("bet", None)
-        
-        # Skip if user didn't complete their bet
-        if bet is None:
-            continue
-        
-        try:
-            bet_uah = state.get("bet_uah", convert_to_uah(bet, currency))
-            
-            if team == winner:
-                # User won - calculate winnings (only profit, not bet amount)
-                win_sum = bet * coef  # total payout
-                win_uah = convert_to_uah(win_sum, currency)  # total payout in UAH
-                profit_uah = win_uah - bet_uah  # profit only (without bet amount)
-                
-                # Add full winnings to balance (bet was already deducted when betting)
-                if bet_user_id not in data_sync.user_balances:
-                    data_sync.user_balances[bet_user_id] = 0.0
-                data_sync.user_balances[bet_user_id] += win_uah
-                
-                # Store result for web app
-                data_sync.set_user_result(bet_user_id, {
-                    'result': 'win',
-                    'balance': data_sync.user_balances[bet_user_id],
-                    'winnings': profit_uah,  # Use profit_uah instead of full win_uah
-                    'winning_team': winner,
-                    'user_team': team
-                })
-                
-                currency_code = get_currency_code(currency)
-                rate = get_current_exchange_rates()[currency_code]
-                
-                try:
-                    await bot.send_message(
-                        bet_user_id,
-                        f"🎉 *Поздравляем! Ваша ставка сыграла!*\n\n"
-                        f"🏆 Общий выигрыш: {win_sum:.2f} {currency}\n"
-                        f"💰 Выплата: +{win_uah:.2f} UAH\n"
-                        f"💸 Ваш баланс: {data_sync.user_balances[bet_user_id]:.2f} UAH",
-                        parse_mode="Markdown"
-                    )
-                except Exception as e:
-                    logging.warning(f"Could not send win message to {bet_user_id}: {e}")
-            else:
-                # User lost - balance already deducted when bet was placed
-                # Do NOT deduct again - just store result and send notification
-                
-                # Store result for web app (balance already correct)
-                data_sync.set_user_result(bet_user_id, {
-                    'result': 'lose',
-                    'balance': data_sync.user_balances[bet_user_id],
-                    'lost': bet_uah,
-                    'winning_team': winner,
-                    'user_team': team
-                })
-                
-                try:
-                    await bot.send_message(
-                        bet_user_id,
-                        f"😔 *К сожалению, ваша ставка не сыграла.*\n\n"
-                        f"💸 Проигрышная ставка: {bet:.2f} {currency}\n"
-                        f"📉 Списано с баланса: -{bet_uah:.2f} UAH\n"
-                        f"💰 Ваш баланс: {data_sync.user_balances[bet_user_id]:.2f} UAH\n\n"
-                        f"🍀 *Удачи в следующий раз!*",
-                        parse_mode="Markdown"
-                    )
-                except Exception as e:
-                    logging.warning(f"Could not send lose message to {bet_user_id}: {e}")
-        except Exception as e:
-            logging.error(f"Failed to send message to user {bet_user_id}: {e}")
-    
-    # Save all balance changes to file for web app sync
-    data_sync.save_data()
+    await queue_result_notifications(settled)
     
     # Don't clear bets immediately - let web app process results first
     await message.answer(f"🏆 Результаты объявлены для победителя: {winner}!\n\n🔄 Ставки будут сброшены при начале нового матча. Используйте /resetbets для принудительного сброса.")
@@ -631,7 +829,12 @@ async def admin_panel(message: types.Message):
         f"`/setrate USD 42.5` - изменить курс валюты\n"
         f"`/settings` - показать все настройки\n"
         f"`/win Команда` - объявить победителя\n"
-        f"`/resetbets` - сбросить все ставки\n\n"
+        f"`/resetbets` - сбросить все ставки\n"
+        f"`/profile 30` - профилирование процесса\n"
+        f"`/memory` - отчёт о памяти\n"
+        f"`/asof 2026-10-01 18:00 [id]` - данные на момент времени\n"
+        f"`/balancelog id [с даты]` - история баланса\n"
+        f"`/export balances|bets|results [csv] [min_balance=100]` - выгрузка (gzip)\n\n"
         f"💡 *Примеры:*\n"
         f"`/setteams NAVI Astralis`\n"
         f"`/setcoef 1.75 2.35`\n"
@@ -659,7 +862,7 @@ async def set_teams(message: types.Message):
     # Обновляем настройки
     success1 = bot_settings.set_setting('teams', 'team1', team1)
     success2 = bot_settings.set_setting('teams', 'team2', team2)
-    print(f"DEBUG setteams: set team1={team1} success={success1}, set team2={team2} success={success2}")
+    logger.info("Admin %s set teams: %s (saved=%s), %s (saved=%s)", user_id, team1, success1, team2, success2)
     
     # Обновляем глобальные переменные
     global COEFFICIENTS
@@ -703,7 +906,7 @@ async def set_coefficients(message: types.Message):
         # Обновляем настройки
         success1 = bot_settings.set_setting('coefficients', 'team1', coef1)
         success2 = bot_settings.set_setting('coefficients', 'team2', coef2)
-        print(f"DEBUG setcoef: set coef1={coef1} success={success1}, set coef2={coef2} success={success2}")
+        logger.info("Admin %s set coefficients: %s (saved=%s), %s (saved=%s)", user_id, coef1, success1, coef2, success2)
         
         # Обновляем глобальные переменные
         global COEFFICIENTS
@@ -753,7 +956,7 @@ async def set_exchange_rate(message: types.Message):
         
         # Обновляем настройки
         success = bot_settings.set_setting('exchange_rates', currency, rate)
-        print(f"DEBUG setrate: set {currency}={rate} success={success}")
+        logger.info("Admin %s set rate: %s=%s (saved=%s)", user_id, currency, rate, success)
         
         # Обновляем глобальные переменные
         global EXCHANGE_RATES
@@ -796,7 +999,8 @@ async def set_limits(message: types.Message):
         # Обновляем настройки
         success1 = bot_settings.set_setting('max_bet_uah', None, max_bet)
         success2 = bot_settings.set_setting('max_balance_uah', None, max_balance)
-        print(f"DEBUG setlimits: set max_bet={max_bet} success={success1}, max_balance={max_balance} success={success2}")
+        logger.info("Admin %s set limits: max_bet=%s (saved=%s), max_balance=%s (saved=%s)",
+                    user_id, max_bet, success1, max_balance, success2)
         
         await message.answer(
             f"✅ *Лимиты обновлены!*\n\n"
@@ -833,7 +1037,8 @@ async def set_emoji(message: types.Message):
     # Обновляем настройки
     success1 = bot_settings.set_setting('team_emojis', 'team1', emoji1)
     success2 = bot_settings.set_setting('team_emojis', 'team2', emoji2)
-    print(f"DEBUG setemoji: set emoji1={emoji1} success={success1}, emoji2={emoji2} success={success2}")
+    logger.info("Admin %s set emojis: %s (saved=%s), %s (saved=%s)",
+                message.from_user.id, emoji1, success1, emoji2, success2)
     
     # Получаем названия команд для отображения
     team1, team2 = bot_settings.get_team_names()
@@ -880,14 +1085,175 @@ async def show_all_settings(message: types.Message):
         parse_mode="Markdown"
     )
 
-async def uptime_monitor():
-    """Anti-sleep monitoring task - logs uptime status every 4 minutes"""
-    while True:
-        await asyncio.sleep(240)  # 4 minutes
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        active_users = len(user_state)
-        total_bets = len(user_bets)
-        logging.info(f"🟢 UptimeBot: Bot is active [{current_time}] | Users: {active_users} | Bets: {total_bets}")
+@dp.message(Command("profile"))
+async def profile_process(message: types.Message):
+    """Профилирование процесса сэмплированием стеков: /profile [секунды].
+    Режима cProfile в боте нет: обработчики выполняются вперемешку на одном event loop,
+    и cProfile приписал бы обработчику всё, что выполнялось во время его await."""
+    if message.from_user.id not in ADMINS:
+        await message.answer("⛔ Эта команда только для админов.")
+        return
+    
+    args = message.text.split()[1:]
+    if len(args) > 1 and args[1] != "sample":
+        await message.answer("❌ В боте доступно только сэмплирование (`sample`): cProfile на event loop "
+                             "смешивает обработчики. cProfile для веб-запросов: `POST /admin/profile?mode=cprofile`",
+                             parse_mode="Markdown")
+        return
+    try:
+        seconds = int(args[0]) if args else 10
+        session = profiling.start(seconds, "sample")
+    except ValueError:
+        await message.answer("❌ Формат: `/profile [секунды]`\nПример: `/profile 30`", parse_mode="Markdown")
+        return
+    except RuntimeError:
+        await message.answer("⏳ Профилирование уже запущено")
+        return
+    
+    await message.answer(f"⏱ Профилирование ({session.mode}) на {session.seconds} с...")
+    await profiling.wait_async(session)
+    
+    report = session.report()
+    # Telegram limits messages to 4096 characters
+    await message.answer(f"<pre>{html.escape(report[:3800])}</pre>", parse_mode="HTML")
+
+@dp.message(Command("memory"))
+async def memory_usage(message: types.Message):
+    """Отчёт о памяти процесса: размеры структур данных и топ мест аллокаций"""
+    if message.from_user.id not in ADMINS:
+        await message.answer("⛔ Эта команда только для админов.")
+        return
+    
+    # Deep sizes walk every entry, keep that off the event loop
+    report = await asyncio.to_thread(memory_report.build_report)
+    text = memory_report.format_report(report)
+    await message.answer(f"<pre>{html.escape(text[:3800])}</pre>", parse_mode="HTML")
+
+def parse_time_args(args):
+    """Время из аргументов команды (unix, 2026-10-01T18:00 или 2026-10-01 18:00) и оставшиеся аргументы"""
+    if len(args) > 1 and ':' in args[1]:
+        return changelog.parse_time(f"{args[0]} {args[1]}"), args[2:]
+    return changelog.parse_time(args[0]), args[1:]
+
+@dp.message(Command("asof"))
+async def state_as_of(message: types.Message):
+    """Состояние данных на момент времени из журнала изменений: /asof 2026-10-01 18:00 [user_id]"""
+    if message.from_user.id not in ADMINS:
+        await message.answer("⛔ Эта команда только для админов.")
+        return
+    
+    try:
+        at, rest = parse_time_args(message.text.split()[1:])
+    except (IndexError, ValueError):
+        await message.answer("❌ Формат: `/asof 2026-10-01 18:00 [user_id]`", parse_mode="Markdown")
+        return
+    
+    # Reads a checkpoint and replays the log after it, keep that off the event loop
+    state = await asyncio.to_thread(changelog.state_at, at)
+    if state is None:
+        await message.answer("📭 Журнал изменений начинается позже этого времени")
+        return
+    
+    when = changelog.format_time(at)
+    if rest:
+        account_id = rest[0]
+        balance = state['user_balances'].get(account_id)
+        bet = state['user_state'].get(account_id)
+        result = state['user_results'].get(account_id)
+        lines = [f"🕰 Пользователь {account_id} на {when}", ""]
+        lines.append(f"💰 Баланс: {balance:.2f} UAH" if balance is not None else "💰 Баланса нет")
+        if bet and 'team' in bet:
+            lines.append(f"🎯 Ставка: {bet['bet']} {bet['currency']} на {bet['team']} (коэф. {bet['coef']})")
+        if result:
+            lines.append(f"🏁 Результат: {result['result']}")
+        await message.answer("\n".join(lines))
+        return
+    
+    await message.answer(
+        f"🕰 Данные на {when}\n\n"
+        f"👥 Пользователей: {len(state['user_balances'])}\n"
+        f"💰 Сумма балансов: {sum(state['user_balances'].values()):.2f} UAH\n"
+        f"🎯 Активных ставок: {len(state['user_bets'])}\n"
+        f"🏆 Результат матча: {state['match_result'] or 'нет'}"
+    )
+
+@dp.message(Command("balancelog"))
+async def balance_log(message: types.Message):
+    """История баланса пользователя из журнала изменений: /balancelog user_id [с какого времени]"""
+    if message.from_user.id not in ADMINS:
+        await message.answer("⛔ Эта команда только для админов.")
+        return
+    
+    args = message.text.split()[1:]
+    try:
+        account_id = args[0]
+        since = parse_time_args(args[1:])[0] if len(args) > 1 else None
+    except (IndexError, ValueError):
+        await message.answer("❌ Формат: `/balancelog user_id [2026-10-01 18:00]`", parse_mode="Markdown")
+        return
+    
+    points = await asyncio.to_thread(changelog.balance_history, account_id, since)
+    if points is None:
+        await message.answer("📭 Журнал изменений начинается позже этого времени")
+        return
+    
+    lines = [f"{changelog.format_time(ts)}  {'-' if balance is None else f'{balance:.2f}'}" for ts, balance in points]
+    if len(lines) > 60:
+        # Telegram limits messages to 4096 characters: keep the start and the latest changes
+        lines = lines[:1] + [f"... ещё {len(lines) - 50} изменений ..."] + lines[-49:]
+    text = "\n".join(lines)
+    await message.answer(f"<b>Баланс {html.escape(account_id)}</b>\n<pre>{html.escape(text)}</pre>", parse_mode="HTML")
+
+def write_export(kind, fmt, filters):
+    """Выгрузка во временный файл (сжатый gzip) по частям; возвращает путь к файлу"""
+    import tempfile
+    fd, path = tempfile.mkstemp(prefix='export-', suffix='.gz')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in export.stream(kind, fmt, True, **filters):
+                f.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+@dp.message(Command("export"))
+async def export_data(message: types.Message):
+    """Выгрузка для сверки: /export balances|bets|results [csv] [min_balance=100] [match=...] [since=...] [until=...]"""
+    if message.from_user.id not in ADMINS:
+        await message.answer("⛔ Эта команда только для админов.")
+        return
+    
+    args = message.text.split()[1:]
+    usage = ("❌ Формат: `/export balances|bets|results [csv] [фильтры]`\n"
+             "Фильтры: `min_balance=100` (balances), `min_bet=500` (bets), "
+             "`match=<job_id> since=2026-10-01 until=2026-10-02T18:00` (results)")
+    if not args or args[0] not in export.KINDS:
+        await message.answer(usage, parse_mode="Markdown")
+        return
+    kind, fmt, raw = args[0], 'ndjson', {}
+    for arg in args[1:]:
+        if arg in export.FORMATS:
+            fmt = arg
+        elif '=' in arg:
+            name, value = arg.split('=', 1)
+            raw[name] = value
+        else:
+            await message.answer(usage, parse_mode="Markdown")
+            return
+    try:
+        filters = export.parse_filters(kind, raw)
+    except ValueError as e:
+        await message.answer(f"❌ {e}")
+        return
+    
+    # The file is written in chunks off the event loop, however many users there are
+    path = await asyncio.to_thread(write_export, kind, fmt, filters)
+    try:
+        name = export.filename(kind, fmt, True, datetime.now())
+        await message.answer_document(FSInputFile(path, filename=name), caption=f"📤 {kind} ({fmt}, gzip)")
+    finally:
+        os.unlink(path)
 
 async def set_bot_commands():
     """Set bot commands and menu button"""
@@ -898,6 +1264,8 @@ async def set_bot_commands():
         BotCommand(command="start", description="🎯 Главное меню"),
         BotCommand(command="balance", description="💰 Показать баланс"),
         BotCommand(command="mybet", description="📊 Моя ставка"),
+        BotCommand(command="history", description="📜 История операций"),
+        BotCommand(command="top", description="🏅 Таблица лидеров"),
         BotCommand(command="admin", description="🔧 Админ-панель"),
         BotCommand(command="settings", description="⚙️ Настройки"),
         BotCommand(command="setemoji", description="😀 Установить эмодзи команд"),
@@ -911,29 +1279,60 @@ async def set_bot_commands():
     menu_button = MenuButtonWebApp(text="СТАВКИ", web_app=WebAppInfo(url=web_app_url))
     await bot.set_chat_menu_button(menu_button=menu_button)
     
-    logging.info(f"✅ Bot commands and menu button set (Web App: {web_app_url})")
+    logger.info("✅ Bot commands and menu button set (Web App: %s)", web_app_url)
 
-async def main():
-    """Main function to start the bot"""
-    logging.info("Starting CS2 Betting Bot...")
+@dp.shutdown()
+async def on_shutdown():
+    """Polling has stopped: let running handlers finish, then send or persist queued notifications"""
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+    handlers = [task for task in monitor.task_handlers if not task.done()]
+    if handlers:
+        logger.info("Waiting for %d running handlers: %s", len(handlers), sorted(set(monitor.task_handlers.values())))
+        _, pending = await asyncio.wait(handlers, timeout=SHUTDOWN_TIMEOUT)
+        for task in pending:
+            logger.warning("Handler %s did not finish in %.0fs, cancelling", monitor.task_handlers.get(task), SHUTDOWN_TIMEOUT)
+            task.cancel()
+    left = await notifications.close(max(0.0, deadline - time.monotonic()))
+    if left:
+        logger.warning("🛑 Bot stopped, %d notifications saved to %s for the next start", left, notifications.path)
+    else:
+        logger.info("🛑 Bot stopped, all notifications sent")
+
+async def main(handle_signals=True):
+    """Main function to start the bot.
+
+    Pass handle_signals=False when running outside the main thread.
+    """
+    logger.info("Starting CS2 Betting Bot...")
     try:
         # Initialize settings after all imports are done
         global COEFFICIENTS, EXCHANGE_RATES
         COEFFICIENTS = get_current_coefficients()
         EXCHANGE_RATES = get_current_exchange_rates()
-        logging.info(f"Settings loaded: Teams={list(COEFFICIENTS.keys())}, Coeffs={COEFFICIENTS}")
+        logger.info("Settings loaded: Teams=%s, Coeffs=%s", list(COEFFICIENTS.keys()), COEFFICIENTS)
         
         # Set bot commands and menu button
         await set_bot_commands()
         
-        # Start uptime monitoring task
-        asyncio.create_task(uptime_monitor())
-        logging.info("🟢 UptimeBot: Anti-sleep monitoring started (4 min intervals)")
+        # Start runtime monitoring (loop lag, blocking handlers, in-flight requests)
+        asyncio.create_task(monitor.run())
+        logger.info("🟢 Runtime monitor started (lag SLO %.2fs)", runtime_monitor.LAG_SLO)
+        
+        # Resume notifications a previous run did not get to send
+        pending = notifications.load()
+        if pending:
+            logger.info("📨 Resuming %d queued notifications", pending)
+        notifications.start(send_notification)
+        
+        # Finish a settlement a previous run died in the middle of
+        asyncio.create_task(resume_settlement())
         
-        await dp.start_polling(bot)
+        await dp.start_polling(bot, handle_signals=handle_signals)
     except Exception as e:
-        logging.error(f"Bot failed to start: {e}")
+        logger.error("Bot failed to start: %s", e)
         raise
 
 if __name__ == "__main__":
     asyncio.run(main())
+    # Once, after every handler has finished
+    data_sync.close()
@@ -2,13 +2,23 @@
 Настройки бота, которые можно изменять через админские команды
 """
 
+import hashlib
 import json
+import logging
 import os
+import tempfile
 from threading import Lock
 
+import events
+
+logger = logging.getLogger(__name__)
+
 SETTINGS_FILE = 'bot_settings.json'
 LOCK = Lock()
 
+# Кэш снимка настроек: (метка файла, версия, настройки)
+_snapshot = None
+
 # Дефолтные настройки
 DEFAULT_SETTINGS = {
     "teams": {
@@ -48,21 +58,52 @@ def load_settings():
                         settings[key] = DEFAULT_SETTINGS[key]
                 return settings
     except Exception as e:
-        print(f"Ошибка загрузки настроек: {e}")
+        logger.error("Ошибка загрузки настроек: %s", e)
     return DEFAULT_SETTINGS.copy()
 
 def save_settings(settings):
     """Сохранить настройки в файл"""
     try:
         with LOCK:
-            with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(settings, f, ensure_ascii=False, indent=2)
-            print(f"Настройки сохранены: {settings}")
+            # Пишем во временный файл и подменяем, чтобы другие процессы не прочитали половину файла
+            directory = os.path.dirname(os.path.abspath(SETTINGS_FILE))
+            fd, tmp_path = tempfile.mkstemp(prefix='.bot_settings.', suffix='.tmp', dir=directory)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(settings, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, SETTINGS_FILE)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            logger.debug("Настройки сохранены: %s", settings)
             return True
     except Exception as e:
-        print(f"Ошибка сохранения настроек: {e}")
+        logger.error("Ошибка сохранения настроек: %s", e)
         return False
 
+def _file_stamp():
+    """Дешёвая метка изменения файла настроек"""
+    try:
+        st = os.stat(SETTINGS_FILE)
+    except OSError:
+        return None
+    # Файл подменяется при каждом сохранении, поэтому inode меняется всегда
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def get_snapshot():
+    """Получить (версия, настройки), перечитывая файл только при его изменении.
+
+    Версия - хэш содержимого файла, поэтому она одинакова во всех процессах
+    и годится как ETag. Возвращаемый словарь нельзя изменять.
+    """
+    global _snapshot
+    stamp = _file_stamp()
+    if _snapshot is None or _snapshot[0] != stamp:
+        settings = load_settings()
+        raw = json.dumps(settings, ensure_ascii=False, sort_keys=True).encode('utf-8')
+        _snapshot = (stamp, hashlib.sha1(raw).hexdigest()[:16], settings)
+    return _snapshot[1], _snapshot[2]
+
 def get_setting(key, subkey=None):
     """Получить конкретную настройку"""
     settings = load_settings()
@@ -73,19 +114,25 @@ def get_setting(key, subkey=None):
 def set_setting(key, subkey, value):
     """Установить конкретную настройку"""
     settings = load_settings()
-    print(f"DEBUG set_setting: key={key}, subkey={subkey}, value={value}")
+    previous = settings.get(key, {}).get(subkey) if subkey else settings.get(key)
     
     if subkey:
         if key not in settings:
             settings[key] = {}
         settings[key][subkey] = value
-        print(f"DEBUG set_setting: updated {key}.{subkey} = {value}")
+        logger.info("Настройка изменена: %s.%s = %s", key, subkey, value)
     else:
         settings[key] = value
-        print(f"DEBUG set_setting: updated {key} = {value}")
+        logger.info("Настройка изменена: %s = %s", key, value)
     
     success = save_settings(settings)
-    print(f"DEBUG set_setting: save_settings returned {success}")
+    if success:
+        if key == 'coefficients':
+            teams = settings['teams']
+            coefficients = {teams[slot]: settings['coefficients'][slot] for slot in ('team1', 'team2')}
+            events.publish(events.OddsChanged(slot=subkey, coef=value, previous=previous, coefficients=coefficients))
+        else:
+            events.publish(events.SettingsChanged(key=key, subkey=subkey, value=value, previous=previous))
     return success
 
 def get_team_names():
@@ -0,0 +1,289 @@
+"""
+Change log and checkpoints of the shared data, for point-in-time queries.
+
+Every save of DATA_FILE appends one JSON line to CHANGELOG_DIR/changes.ndjson.
+The line holds the entries that changed: {'seq', 'ts', 'origin', 'changes'}.
+Once that file reaches CHECKPOINT_BYTES, the full state is written as a
+compact gzip checkpoint. The log then continues in a fresh file, so each
+checkpoint is followed by its own segment:
+
+    checkpoint-<seq>-<ts_ms>.json.gz   state after change <seq>
+    changes-<seq>.ndjson               changes after that checkpoint
+    changes.ndjson                     changes after the latest checkpoint
+
+A query loads the latest checkpoint at or before the requested time and
+replays only the changes that follow it, so its cost does not grow with the
+length of the history. Writes happen under the data file lock, so the log is
+in commit order across processes.
+
+    python changelog.py state 2026-10-01T18:00 [--user ID]
+    python changelog.py balance ID [--since 2026-10-01] [--until ...]
+"""
+
+import glob
+import gzip
+import json
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CHANGELOG_DIR = os.getenv('CHANGELOG_DIR', 'changelog')
+# Size of the change log segment after which a checkpoint is written
+CHECKPOINT_BYTES = int(os.getenv('CHECKPOINT_BYTES', 4 * 1024 * 1024))
+ACTIVE_LOG = 'changes.ndjson'
+
+# Dict sections are logged per entry, the rest as whole values
+DICT_SECTIONS = ('user_balances', 'user_state', 'user_results')
+VALUE_SECTIONS = ('match_result', 'settlement', 'import_batches')
+
+CHANGES = metrics.Counter('changelog_records_total', 'Change log records and checkpoints written', ('kind',))
+
+# A checkpoint exists in CHANGELOG_DIR (checked once per process)
+_started = False
+
+def enabled():
+    return bool(CHANGELOG_DIR)
+
+def diff(old, new):
+    """What changed from one snapshot to the next; {} if nothing"""
+    changes = {}
+    for section in DICT_SECTIONS:
+        before, after = old[section], new[section]
+        changed = {key: value for key, value in after.items() if key not in before or before[key] != value}
+        added = sum(1 for key in changed if key not in before)
+        # Every key of `before` is still there unless the counts say otherwise
+        removed = [key for key in before if key not in after] if len(after) - added < len(before) else []
+        if changed or removed:
+            changes[section] = {'set': changed, 'del': removed}
+    before, after = set(old['user_bets']), set(new['user_bets'])
+    if before != after:
+        changes['user_bets'] = {'add': sorted(after - before), 'del': sorted(before - after)}
+    for section in VALUE_SECTIONS:
+        if old.get(section) != new.get(section):
+            changes[section] = new.get(section)
+    return changes
+
+def apply(state, changes):
+    """Apply a diff() result to a snapshot in place"""
+    for section in DICT_SECTIONS:
+        if section in changes:
+            state[section].update(changes[section]['set'])
+            for key in changes[section]['del']:
+                state[section].pop(key, None)
+    if 'user_bets' in changes:
+        bets = (set(state['user_bets']) | set(changes['user_bets']['add'])) - set(changes['user_bets']['del'])
+        state['user_bets'] = sorted(bets)
+    for section in VALUE_SECTIONS:
+        if section in changes:
+            state[section] = changes[section]
+    return state
+
+def record(old, new, seq):
+    """Log the change from `old` to `new` as change number `seq`.
+
+    Called by data_sync after every successful save, under the data file lock.
+    The first call ever also checkpoints `old`, the state the log starts from.
+    """
+    global _started
+    if not enabled():
+        return
+    try:
+        if not _started:
+            os.makedirs(CHANGELOG_DIR, exist_ok=True)
+            if not _checkpoints():
+                _write_checkpoint(old, seq - 1)
+            _started = True
+        changes = diff(old, new)
+        if not changes:
+            return
+        line = json.dumps({'seq': seq, 'ts': time.time(), 'origin': os.getpid(), 'changes': changes},
+                          ensure_ascii=False, separators=(',', ':'))
+        path = os.path.join(CHANGELOG_DIR, ACTIVE_LOG)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+            size = f.tell()
+        CHANGES.inc(kind='change')
+        if size >= CHECKPOINT_BYTES:
+            checkpoint(new, seq)
+    except Exception as e:
+        # The data itself is saved; only its history has a gap
+        CHANGES.inc(kind='error')
+        logger.error("Error writing change log %s: %s", CHANGELOG_DIR, e)
+
+def checkpoint(state, seq):
+    """Write a checkpoint of `state` (after change `seq`) and start a new log segment"""
+    previous = _checkpoints()
+    _write_checkpoint(state, seq)
+    if previous:
+        # Changes since the previous checkpoint become that checkpoint's segment
+        os.replace(os.path.join(CHANGELOG_DIR, ACTIVE_LOG),
+                   os.path.join(CHANGELOG_DIR, f'changes-{previous[-1][0]:012d}.ndjson'))
+    logger.info("Change log checkpoint at change %d", seq)
+
+def _write_checkpoint(state, seq):
+    ts = time.time()
+    path = os.path.join(CHANGELOG_DIR, f'checkpoint-{seq:012d}-{int(ts * 1000)}.json.gz')
+    fd, tmp_path = tempfile.mkstemp(prefix='.checkpoint.', suffix='.tmp', dir=CHANGELOG_DIR)
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=5) as f:
+            f.write(json.dumps({'seq': seq, 'ts': ts, 'state': state},
+                               ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    CHANGES.inc(kind='checkpoint')
+
+def _checkpoints(directory=None):
+    """[(seq, ts, path)] of all checkpoints, oldest first"""
+    found = []
+    for path in glob.glob(os.path.join(directory or CHANGELOG_DIR, 'checkpoint-*.json.gz')):
+        seq, ts_ms = os.path.basename(path)[len('checkpoint-'):-len('.json.gz')].split('-')
+        found.append((int(seq), int(ts_ms) / 1000, path))
+    return sorted(found)
+
+def _segments(directory, after_seq):
+    """Log files that may hold changes after `after_seq`, in order"""
+    segments = []
+    for path in glob.glob(os.path.join(directory, 'changes-*.ndjson')):
+        seq = int(os.path.basename(path)[len('changes-'):-len('.ndjson')])
+        segments.append((seq, path))
+    segments.sort()
+    # A segment starts at its checkpoint, so the one before `after_seq` may hold later changes too
+    start = 0
+    for index, (seq, _) in enumerate(segments):
+        if seq <= after_seq:
+            start = index
+    paths = [path for _, path in segments[start:]]
+    paths.append(os.path.join(directory, ACTIVE_LOG))
+    return paths
+
+def _changes(directory, after_seq, until):
+    """Yield log records with seq > after_seq and ts <= until, oldest first"""
+    for path in _segments(directory, after_seq):
+        try:
+            f = open(path, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            continue
+        with f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash
+                    continue
+                if entry['seq'] <= after_seq:
+                    continue
+                if entry['ts'] > until:
+                    return
+                yield entry
+
+def _load_checkpoint(at, directory):
+    """(seq, ts, state) of the latest checkpoint taken at or before `at`, or None"""
+    candidates = [c for c in _checkpoints(directory) if c[1] <= at]
+    if not candidates:
+        return None
+    seq, ts, path = candidates[-1]
+    with gzip.open(path, 'rb') as f:
+        data = json.loads(f.read())
+    return seq, data['ts'], data['state']
+
+def state_at(at, directory=None):
+    """Full data snapshot as of unix time `at`, or None if the history starts later"""
+    directory = directory or CHANGELOG_DIR
+    start = _load_checkpoint(at, directory)
+    if start is None:
+        return None
+    seq, _, state = start
+    for entry in _changes(directory, seq, at):
+        apply(state, entry['changes'])
+    return state
+
+def balance_history(user_id, since=None, until=None, directory=None):
+    """[(ts, balance)] for one user: the balance at `since` (at the earliest, the
+    start of the history), then every change up to `until`. None if the history
+    starts after `until`."""
+    directory = directory or CHANGELOG_DIR
+    until = time.time() if until is None else until
+    checkpoints = _checkpoints(directory)
+    if not checkpoints or checkpoints[0][1] > until:
+        return None
+    # Nothing is known before the first checkpoint
+    since = checkpoints[0][1] if since is None else max(since, checkpoints[0][1])
+    start = _load_checkpoint(since, directory)
+    seq, _, state = start
+    user_id = str(user_id)
+    balance = state['user_balances'].get(user_id)
+    points = []
+    for entry in _changes(directory, seq, until):
+        balances = entry['changes'].get('user_balances')
+        if balances is None:
+            continue
+        if user_id in balances['set']:
+            new_balance = balances['set'][user_id]
+        elif user_id in balances['del']:
+            new_balance = None
+        else:
+            continue
+        if entry['ts'] < since:
+            # Between the checkpoint and the window: only the starting balance moves
+            balance = new_balance
+            continue
+        points.append((entry['ts'], new_balance))
+    return [(since, balance)] + points
+
+def parse_time(value):
+    """Unix time from a number or an ISO 8601 date/time (local time unless it has an offset)"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def format_time(ts):
+    return datetime.fromtimestamp(ts).isoformat(sep=' ', timespec='seconds')
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Rebuild past data from the change log')
+    parser.add_argument('--dir', default=CHANGELOG_DIR, help='change log directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+    state_parser = commands.add_parser('state', help='full state (or one user) as of a time')
+    state_parser.add_argument('at', help='unix time or ISO 8601, e.g. 2026-10-01T18:00')
+    state_parser.add_argument('--user', help='print only this user')
+    balance_parser = commands.add_parser('balance', help="a user's balance changes")
+    balance_parser.add_argument('user')
+    balance_parser.add_argument('--since', help='start of the window (default: the start of the history)')
+    balance_parser.add_argument('--until', help='end of the window (default: now)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'state':
+        state = state_at(parse_time(args.at), args.dir)
+        if state is None:
+            parser.exit(1, f"No history before {args.at}\n")
+        if args.user:
+            user = str(args.user)
+            state = {
+                'balance': state['user_balances'].get(user),
+                'bet': state['user_state'].get(user),
+                'result': state['user_results'].get(user),
+                'match_result': state['match_result'],
+            }
+        print(json.dumps(state, ensure_ascii=False, indent=2))
+    else:
+        history = balance_history(args.user,
+                                  parse_time(args.since) if args.since else None,
+                                  parse_time(args.until) if args.until else None,
+                                  args.dir)
+        if history is None:
+            parser.exit(1, "No history for that window\n")
+        for ts, balance in history:
+            print(f"{format_time(ts)}  {'-' if balance is None else f'{balance:.2f}'}")
+
+if __name__ == '__main__':
+    main()
@@ -2,72 +2,334 @@
 Shared data synchronization module for CS2 betting bot and web server.
 This module provides shared data structures and utilities for both the Telegram bot and Flask web server.
 Uses JSON files for cross-process synchronization.
+
+Any number of processes (web workers, the bot) may share DATA_FILE:
+  * writes go to a temporary file that atomically replaces DATA_FILE, so a
+    reader never sees a partial file;
+  * read-modify-write code runs inside `with transaction():`, which holds an
+    exclusive lock on DATA_FILE + '.lock' (fcntl, where available), reloads
+    whatever other processes wrote, and saves once at the end.
+The data is loaded on first use, not at import.
 """
 
 import json
+import logging
 import os
-from threading import Lock
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from threading import Lock, RLock
+
+import changelog
+import events
+import history
+import metrics
+
+try:
+    import fcntl
+except ImportError:
+    # Without fcntl (Windows) transactions only exclude threads of one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
 
 # File paths for data persistence
 DATA_FILE = 'betting_data.json'
 LOCK = Lock()
+# Held by the thread inside a transaction or reload, so globals never change under it
+TRANSACTION_LOCK = RLock()
+# Per-thread transaction depth and whether save_data() was called in it
+_local = threading.local()
+
+# (inode, mtime_ns, size) of DATA_FILE as of our last load/save, used to skip redundant reloads
+_data_stamp = None
+_loaded = False
+# The last write failed, so memory holds changes the file does not
+_unsaved = False
+_closed = False
+# Stamp that never matches the file, forcing the next refresh_data() to reload
+_INVALID = object()
+# How many times a reload found the file rewritten by another process
+external_changes = 0
+# Copy of the data as last loaded or saved, that the change log diffs against,
+# and the file stamp it belongs to
+_baseline = None
+_baseline_stamp = _INVALID
+
+def _file_stamp():
+    """Return a cheap change marker for DATA_FILE"""
+    try:
+        st = os.stat(DATA_FILE)
+    except OSError:
+        return None
+    return _stat_stamp(st)
+
+def _stat_stamp(st):
+    # Every save replaces the file, so the inode changes even when mtime and size do not
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
 
 def load_data():
     """Load data from JSON file"""
+    start = time.perf_counter()
     try:
         if os.path.exists(DATA_FILE):
             with open(DATA_FILE, 'r') as f:
                 data = json.load(f)
+                metrics.STORAGE_BYTES.inc(os.fstat(f.fileno()).st_size, operation='load')
                 # Convert user_bets back to set and keep user_id keys as strings for web compatibility
                 data['user_bets'] = set(str(uid) for uid in data.get('user_bets', []))
                 data['user_balances'] = {str(k): v for k, v in data.get('user_balances', {}).items()}
                 data['user_state'] = {str(k): v for k, v in data.get('user_state', {}).items()}
                 data['user_results'] = {str(k): v for k, v in data.get('user_results', {}).items()}
+                metrics.STORAGE_OPS.inc(operation='load', outcome='ok')
+                metrics.STORAGE_LATENCY.observe(time.perf_counter() - start, operation='load')
                 return data
     except Exception as e:
-        print(f"Error loading data: {e}")
+        metrics.STORAGE_OPS.inc(operation='load', outcome='error')
+        logger.error("Error loading data: %s", e)
     return {
         'user_balances': {},
         'user_bets': set(),
         'user_state': {},
         'match_result': None,
-        'user_results': {}
+        'user_results': {},
+        'settlement': None,
+        'import_batches': {},
+        'change_seq': 0
     }
 
 def save_data():
-    """Save current data to JSON file"""
+    """Save current data to JSON file.
+
+    Inside a transaction the write is deferred to the end of the transaction,
+    so several saves in one operation cost one write.
+    """
+    if getattr(_local, 'depth', 0):
+        _local.dirty = True
+        return
+    with _file_lock():
+        _write()
+
+class SaveError(RuntimeError):
+    """A transaction's changes could not be written; none of them took effect"""
+
+def _write():
+    """Write the data to DATA_FILE; returns False if that failed"""
+    global _data_stamp, _loaded, _unsaved, change_seq, _baseline, _baseline_stamp
+    if not _loaded and os.path.exists(DATA_FILE):
+        # Saving data that was never loaded would wipe the file
+        logger.error("Refusing to save: %s exists but was never loaded in this process", DATA_FILE)
+        return False
+    start = time.perf_counter()
     try:
         with LOCK:
-            data_to_save = {
-                'user_balances': {str(k): v for k, v in user_balances.items()},
-                'user_bets': list(user_bets),
-                'user_state': {str(k): v for k, v in user_state.items()},
-                'match_result': match_result,
-                'user_results': {str(k): v for k, v in user_results.items()}
-            }
-            with open(DATA_FILE, 'w') as f:
-                json.dump(data_to_save, f, indent=2)
-            print(f"Data saved: {len(user_balances)} balances, {len(user_bets)} bets, match_result={match_result}")
+            baseline = _baseline
+            if changelog.enabled() and _baseline_stamp != _file_stamp():
+                # Saved without a transaction: diff against what is being replaced
+                baseline = load_data()
+                baseline['user_bets'] = list(baseline['user_bets'])
+                change_seq = max(change_seq, baseline.get('change_seq', 0))
+            data_to_save = _snapshot()
+            data_to_save['change_seq'] = change_seq + 1
+            directory = os.path.dirname(os.path.abspath(DATA_FILE))
+            fd, tmp_path = tempfile.mkstemp(prefix='.betting_data.', suffix='.tmp', dir=directory)
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(data_to_save, f, indent=2)
+                    f.flush()
+                    metrics.STORAGE_BYTES.inc(f.tell(), operation='save')
+                    stamp = _stat_stamp(os.fstat(f.fileno()))
+                os.replace(tmp_path, DATA_FILE)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            # What is in memory is now what is on disk
+            _data_stamp = stamp
+            _loaded = True
+            _unsaved = False
+            change_seq += 1
+            if changelog.enabled():
+                changelog.record(baseline, data_to_save, change_seq)
+                _baseline, _baseline_stamp = data_to_save, stamp
+            metrics.STORAGE_OPS.inc(operation='save', outcome='ok')
+            metrics.STORAGE_LATENCY.observe(time.perf_counter() - start, operation='save')
+            logger.debug("Data saved: %d balances, %d bets, match_result=%s",
+                         len(user_balances), len(user_bets), match_result)
+        return True
     except Exception as e:
-        print(f"Error saving data: {e}")
+        _unsaved = True
+        metrics.STORAGE_OPS.inc(operation='save', outcome='error')
+        logger.error("Error saving data: %s", e)
+        return False
+
+def _snapshot():
+    # Entries are copied, so the snapshot can serve as the change log's baseline
+    return {
+        'user_balances': {str(k): v for k, v in user_balances.items()},
+        'user_bets': list(user_bets),
+        'user_state': {str(k): dict(v) for k, v in user_state.items()},
+        'match_result': match_result,
+        'user_results': {str(k): dict(v) for k, v in user_results.items()},
+        'settlement': dict(settlement) if settlement is not None else None,
+        'import_batches': dict(import_batches),
+        'change_seq': change_seq
+    }
+
+@contextmanager
+def _file_lock():
+    """Exclusive lock shared by all processes using DATA_FILE"""
+    if fcntl is None:
+        yield
+        return
+    start = time.perf_counter()
+    with open(DATA_FILE + '.lock', 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        metrics.STORAGE_LATENCY.observe(time.perf_counter() - start, operation='lock')
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+@contextmanager
+def transaction():
+    """Run a read-modify-write of the shared data atomically.
+
+    Excludes other threads and processes, starts from the latest data on disk
+    and writes once at the end if save_data() was called. Nested transactions
+    join the outer one. If the block raises, nothing is written, events
+    emitted in it are dropped and the in-memory data is reloaded on next use.
+    If the write fails, the same happens and SaveError is raised.
+    """
+    global _data_stamp, _unsaved
+    with TRANSACTION_LOCK:
+        depth = getattr(_local, 'depth', 0)
+        if depth:
+            _local.depth = depth + 1
+            try:
+                yield
+            finally:
+                _local.depth = depth
+            return
+
+        with _file_lock():
+            refresh_data()
+            _capture_baseline()
+            _local.depth = 1
+            _local.dirty = False
+            _local.events = []
+            try:
+                yield
+            except BaseException:
+                # Whatever the block changed in memory is dropped by the next refresh
+                _data_stamp = _INVALID
+                raise
+            finally:
+                _local.depth = 0
+            if _local.dirty and not _write():
+                # Rejected as a whole: no events or history rows for changes that are not on disk
+                _data_stamp = _INVALID
+                _unsaved = False
+                raise SaveError(f"Could not save {DATA_FILE}")
+            pending = _local.events
+            # Spooled and recorded under the lock, so both list changes in the order they were saved;
+            # only reached once the write above succeeded
+            events.spool(pending)
+            history.record(pending)
+        events.dispatch(pending)
+
+def _capture_baseline():
+    """Copy the data before a transaction changes it, unless the copy from the last save still matches"""
+    global _baseline, _baseline_stamp
+    if changelog.enabled() and _baseline_stamp != _data_stamp:
+        _baseline = _snapshot()
+        _baseline_stamp = _data_stamp
+
+def emit(event):
+    """Publish a domain event once the current transaction is saved (at once outside one)"""
+    if getattr(_local, 'depth', 0):
+        _local.events.append(event)
+    else:
+        events.publish(event)
 
 def reload_data():
     """Reload data from file"""
-    global user_balances, user_bets, user_state, match_result, user_results
-    data = load_data()
-    user_balances = data['user_balances']
-    user_bets = data['user_bets']  
-    user_state = data['user_state']
-    match_result = data['match_result']
-    user_results = data['user_results']
-
-# Load initial data
-data = load_data()
-user_balances = data['user_balances']
-user_bets = data['user_bets']
-user_state = data['user_state']
-match_result = data['match_result']
-user_results = data['user_results']
+    global user_balances, user_bets, user_state, match_result, user_results, settlement, change_seq
+    global import_batches
+    global _data_stamp, _loaded, _unsaved, external_changes
+    with TRANSACTION_LOCK:
+        if _unsaved:
+            logger.warning("Reloading %s drops changes whose save failed", DATA_FILE)
+            _unsaved = False
+        stamp = _file_stamp()
+        if _loaded and _data_stamp is not _INVALID and stamp != _data_stamp:
+            external_changes += 1
+        _loaded = True
+        _data_stamp = stamp
+        data = load_data()
+        user_balances = data['user_balances']
+        user_bets = data['user_bets']
+        user_state = data['user_state']
+        match_result = data['match_result']
+        user_results = data['user_results']
+        settlement = data.get('settlement')
+        import_batches = data.get('import_batches', {})
+        change_seq = data.get('change_seq', 0)
+
+def refresh_data():
+    """Reload data only if the file changed since our last load or save"""
+    if _file_stamp() != _data_stamp:
+        reload_data()
+
+def close():
+    """Flush storage once on shutdown; later calls do nothing.
+
+    Waits for a transaction running in another thread. Saves are written when
+    each transaction ends, so there is normally nothing left to write; only a
+    failed last save is retried, and only if no other process has written the
+    file since (otherwise the changes go to a side file instead of
+    overwriting newer data). Returns False if already closed.
+    """
+    global _closed
+    with TRANSACTION_LOCK:
+        if _closed:
+            return False
+        _closed = True
+        if not _unsaved:
+            logger.info("Storage closed, nothing left to save")
+            return True
+        with _file_lock():
+            if _file_stamp() == _data_stamp:
+                _write()
+                logger.info("Storage closed, unsaved changes written to %s", DATA_FILE)
+            else:
+                side_file = f"{DATA_FILE}.unsaved-{os.getpid()}"
+                logger.error("%s changed since the failed save, writing unsaved changes to %s", DATA_FILE, side_file)
+                with open(side_file, 'w') as f:
+                    json.dump(_snapshot(), f, indent=2)
+    return True
+
+# Empty until the first refresh_data()/reload_data()/transaction() loads the file
+user_balances = {}
+user_bets = set()
+user_state = {}
+match_result = None
+user_results = {}
+# Current settlement job, see settle_match()
+settlement = None
+# Applied bulk imports by batch id, so a retry from any process is not applied twice (see balance_import.py)
+import_batches = {}
+# Number of the last save, as recorded in the change log (see changelog.py)
+change_seq = 0
+
+# Number of bets credited per settlement checkpoint (at least; see settle_match)
+SETTLEMENT_BATCH = int(os.getenv('SETTLEMENT_BATCH', 500))
+# Every checkpoint rewrites the whole file, so large jobs use bigger batches
+SETTLEMENT_MAX_CHECKPOINTS = 10
+# A job whose owner has not checkpointed for this many seconds may be taken over
+SETTLEMENT_LEASE = float(os.getenv('SETTLEMENT_LEASE', 60))
 
 # Exchange rates and coefficients (same for both bot and web server)
 EXCHANGE_RATES = {
@@ -97,12 +359,15 @@ def get_currency_code(currency_with_emoji):
 
 def clear_all_bets():
     """Clear all user bets (for new matches)"""
-    global user_bets, user_state, match_result, user_results
-    user_bets.clear()
-    user_state.clear()
-    match_result = None
-    user_results.clear()
-    save_data()
+    global match_result, settlement
+    with transaction():
+        emit(events.BetsCleared(bets=len(user_bets), reason='new_match'))
+        user_bets.clear()
+        user_state.clear()
+        match_result = None
+        user_results.clear()
+        settlement = None
+        save_data()
 
 def get_user_balance(user_id):
     """Get user balance safely"""
@@ -110,28 +375,36 @@ def get_user_balance(user_id):
 
 def update_user_balance(user_id, amount):
     """Update user balance"""
-    if user_id not in user_balances:
-        user_balances[user_id] = 0.0
-    user_balances[user_id] += amount
-    
-    # Ensure balance doesn't go negative
-    if user_balances[user_id] < 0:
-        user_balances[user_id] = 0.0
-    
-    save_data()
-    return user_balances[user_id]
+    with transaction():
+        if user_id not in user_balances:
+            user_balances[user_id] = 0.0
+        previous = user_balances[user_id]
+        user_balances[user_id] += amount
+        
+        # Ensure balance doesn't go negative
+        if user_balances[user_id] < 0:
+            user_balances[user_id] = 0.0
+        
+        save_data()
+        emit(events.BalanceAdjusted(user_id=user_id, amount_uah=user_balances[user_id] - previous,
+                                    balance=user_balances[user_id], reason='update'))
+        return user_balances[user_id]
 
 def set_user_balance(user_id, amount):
     """Set user balance to specific amount"""
-    user_balances[user_id] = max(0.0, amount)
-    save_data()
-    return user_balances[user_id]
+    with transaction():
+        previous = user_balances.get(user_id, 0.0)
+        user_balances[user_id] = max(0.0, amount)
+        save_data()
+        emit(events.BalanceAdjusted(user_id=user_id, amount_uah=user_balances[user_id] - previous,
+                                    balance=user_balances[user_id], reason='set'))
+        return user_balances[user_id]
 
 def set_match_result(winner):
     """Set match result for web app (without saving to avoid data loss)"""
     global match_result
     match_result = winner
-    print(f"Match result set to: {winner}")
+    logger.info("Match result set to: %s", winner)
 
 def get_match_result():
     """Get current match result"""
@@ -140,57 +413,262 @@ def get_match_result():
 
 def set_user_result(user_id, result_data):
     """Set user's match result"""
-    global user_results
-    user_results[user_id] = result_data
-    save_data()
-    print(f"User result set for {user_id}: {result_data}")
+    with transaction():
+        user_results[user_id] = result_data
+        save_data()
+    logger.debug("User result set for %s: %s", user_id, result_data)
 
 def get_user_result(user_id):
     """Get user's match result"""
     reload_data()  # Always reload to get latest data
     return user_results.get(user_id, None)
 
+def _is_bet(state):
+    # Skip deposit-only states and incomplete bets
+    return 'team' in state and state.get('bet') is not None
+
+def _settle_bet(user_id, state, winner, job_id):
+    """Credit one bet and mark it settled by job_id; caller holds a transaction"""
+    bet_uah = state.get('bet_uah', convert_to_uah(state['bet'], state['currency']))
+    balance = user_balances.get(user_id, 0.0)
+    if state['team'] == winner:
+        # Bet was deducted when placed, so credit the full payout
+        payout = bet_uah * state['coef']
+        balance += payout
+        user_balances[user_id] = balance
+        result = {
+            'result': 'win',
+            'balance': balance,
+            'winnings': payout - bet_uah,
+            'payout': payout,
+            'winning_team': winner,
+            'user_team': state['team']
+        }
+    else:
+        # Money already deducted when bet was placed, no change needed
+        result = {
+            'result': 'lose',
+            'balance': balance,
+            'lost': bet_uah,
+            'winning_team': winner,
+            'user_team': state['team']
+        }
+    user_results[user_id] = result
+    # Written in the same save as the credit, so a bet is never credited twice
+    state['settled_job'] = job_id
+    metrics.SETTLEMENT_BETS.inc(result=result['result'])
+    emit(events.BetSettled(user_id=user_id, job_id=job_id, team=state['team'], winner=winner,
+                           result=result['result'], bet_uah=bet_uah, payout_uah=result.get('payout', 0.0),
+                           balance=balance))
+
+def _lease_active(job):
+    """True if the job's owner is presumably still working on it"""
+    if time.time() - job.get('heartbeat', 0) >= SETTLEMENT_LEASE:
+        return False
+    host, pid = job.get('owner', ':0').split(':')[:2]
+    if host == socket.gethostname() and os.name == 'posix':
+        # An owner on this machine can be checked directly
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except (PermissionError, ValueError):
+            pass
+    return True
+
+def get_settlement():
+    """Current settlement job: {'job_id', 'winner', 'status', 'total', 'settled', 'owner', 'heartbeat', ...} or None"""
+    refresh_data()
+    return settlement
+
+def settle_match(winner, notify=False):
+    """Settle all active bets against the winner and store every user's result.
+
+    Runs as a durable job recorded in the data file: the job's progress and a
+    per-bet settled marker are saved together with the credits, one batch per
+    transaction. If the process dies halfway, calling settle_match()
+    again with the same winner (or resume_settlement()) continues from the
+    last checkpoint, and a finished job is never run twice. While the job's
+    owner keeps checkpointing, other calls leave it alone; one that died (or
+    stalled for SETTLEMENT_LEASE seconds) is taken over. Readers (the web
+    app's check_result) only ever look results up and never settle lazily.
+    Returns a list of (user_id, state, result) tuples for notifications,
+    covering every bet of the job, from the call that finishes the job only;
+    other calls get [].
+
+    With notify=True the caller sends those notifications: the finished job
+    is saved with notified=False until mark_notified(), so a crash in between
+    leaves resume_settlement(notify=True) to return the list again.
+    """
+    global match_result, settlement
+    start = time.perf_counter()
+    with transaction():  # Latest data including web app bets
+        job = settlement
+        if (job is not None and job['status'] == 'done') or (job is None and match_result is not None):
+            # Another process (or an earlier /win) settled this match already
+            logger.warning("Match already settled for %s, ignoring result %s", match_result, winner)
+            return []
+        if job is not None and job['winner'] != winner:
+            logger.warning("Settlement %s for %s is in progress, ignoring result %s",
+                           job['job_id'], job['winner'], winner)
+            return []
+        if job is not None and _lease_active(job):
+            logger.info("Settlement %s is being run by %s", job['job_id'], job['owner'])
+            return []
+        owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        if job is None:
+            job = settlement = {
+                'job_id': uuid.uuid4().hex[:12],
+                'winner': winner,
+                'status': 'running',
+                'started_at': time.time(),
+                'total': sum(1 for state in user_state.values() if _is_bet(state)),
+                'settled': 0,
+                'notify': notify,
+            }
+            # Bets placed after settlement would never get a result, so betting closes here
+            match_result = winner
+            logger.info("Settlement %s started for %s: %d bets", job['job_id'], winner, job['total'])
+        else:
+            logger.info("Settlement %s resumed for %s at %d/%d bets (was %s)",
+                        job['job_id'], winner, job['settled'], job['total'], job.get('owner'))
+        job['owner'] = owner
+        job['heartbeat'] = time.time()
+        # Whoever sends notifications for the job, the first run or a resuming one
+        job['notify'] = job.get('notify') or notify
+        save_data()
+        job_id = job['job_id']
+        # No bets can be added now, so this list only shrinks as batches settle it
+        pending = sorted(user_id for user_id, state in user_state.items()
+                         if _is_bet(state) and state.get('settled_job') != job_id)
+    batch = max(SETTLEMENT_BATCH, -(-job['total'] // SETTLEMENT_MAX_CHECKPOINTS))
+
+    for offset in range(0, len(pending), batch):
+        with transaction():
+            if settlement is None or settlement['job_id'] != job_id:
+                logger.warning("Settlement %s was cancelled (match reset)", job_id)
+                return []
+            if settlement.get('owner') != owner:
+                logger.warning("Settlement %s was taken over by %s", job_id, settlement.get('owner'))
+                return []
+            credited = 0
+            for user_id in pending[offset:offset + batch]:
+                state = user_state.get(user_id)
+                # Settled meanwhile by a concurrent run of the same job
+                if state is None or state.get('settled_job') == job_id or not _is_bet(state):
+                    continue
+                _settle_bet(user_id, state, winner, job_id)
+                credited += 1
+            settlement['settled'] += credited
+            settlement['heartbeat'] = time.time()
+            # One checkpoint: credits, results, markers and progress in a single write
+            save_data()
+        logger.debug("Settlement %s checkpoint: %d/%d", job_id, settlement['settled'], settlement['total'])
+
+    with transaction():
+        if settlement is None or settlement['job_id'] != job_id or settlement.get('owner') != owner:
+            return []
+        settled = _settled_bets(job_id)
+        if settlement['status'] != 'done':
+            settlement['status'] = 'done'
+            settlement['finished_at'] = time.time()
+            if settlement.get('notify') and settled:
+                settlement['notified'] = False
+            save_data()
+            emit(events.MatchSettled(
+                job_id=job_id, winner=winner, bets=len(settled),
+                winners=sum(1 for _, _, result in settled if result['result'] == 'win'),
+                stakes_uah=sum(state.get('bet_uah', 0.0) for _, state, _ in settled),
+                payout_uah=sum(result.get('payout', 0.0) for _, _, result in settled)))
+    metrics.SETTLEMENT_LATENCY.observe(time.perf_counter() - start)
+    logger.info("Match settled for %s: %d bets (job %s)", winner, len(settled), job_id)
+    return settled
+
+def _settled_bets(job_id):
+    # Caller holds a transaction
+    return [(user_id, state, user_results[user_id]) for user_id, state in sorted(user_state.items())
+            if state.get('settled_job') == job_id and user_id in user_results]
+
+def resume_settlement(notify=False):
+    """Finish a settlement job a crashed process left running; returns settle_match()'s list
+    ([] also while the job's owner still holds its lease). With notify=True, a finished job
+    whose notifications were never marked sent returns its list again."""
+    job = get_settlement()
+    if job is None:
+        return []
+    if job['status'] == 'done':
+        if not notify or job.get('notified') is not False:
+            return []
+        with transaction():
+            if settlement is None or settlement['job_id'] != job['job_id']:
+                return []
+            return _settled_bets(job['job_id'])
+    return settle_match(job['winner'], notify)
+
+def mark_notified(job_id):
+    """Record that the notifications of a finished settlement are queued (see settle_match)"""
+    with transaction():
+        if settlement is not None and settlement['job_id'] == job_id and settlement.get('notified') is False:
+            settlement['notified'] = True
+            save_data()
+
 def reset_user_after_match(user_id):
     """Reset user data after match completion"""
-    global user_balances, user_state, user_bets, user_results
-    
-    # Remove user from active bets
-    if user_id in user_bets:
-        user_bets.discard(user_id)
-    
-    # Clear user state
-    if user_id in user_state:
-        del user_state[user_id]
-    
-    # Clear user results 
-    if user_id in user_results:
-        del user_results[user_id]
-    
-    # Reset balance to 0 if they lost (will be handled by deposit logic)
-    save_data()
-    print(f"Reset user {user_id} data after match completion")
+    with transaction():
+        state = user_state.get(user_id)
+        if (settlement is not None and settlement['status'] == 'running'
+                and state is not None and _is_bet(state) and state.get('settled_job') != settlement['job_id']):
+            # The running settlement still has to credit this bet
+            logger.info("Keeping %s's bet until settlement %s credits it", user_id, settlement['job_id'])
+            return
+        # Remove user from active bets
+        if user_id in user_bets:
+            user_bets.discard(user_id)
+            if state is not None and _is_bet(state) and 'settled_job' not in state:
+                # An open bet goes without a result; consumers drop it from their books
+                emit(events.BetCancelled(user_id=user_id, team=state['team'],
+                                         bet_uah=state.get('bet_uah'), reason='reset_user'))
+        
+        # Clear user state
+        if user_id in user_state:
+            del user_state[user_id]
+        
+        # Clear user results 
+        if user_id in user_results:
+            del user_results[user_id]
+        
+        # Reset balance to 0 if they lost (will be handled by deposit logic)
+        save_data()
+    logger.debug("Reset user %s data after match completion", user_id)
+
+def _zero_balances(reason):
+    # Only balances that change get an event (and a history row)
+    for user_id, balance in user_balances.items():
+        if balance:
+            emit(events.BalanceAdjusted(user_id=user_id, amount_uah=-balance, balance=0.0, reason=reason))
+            user_balances[user_id] = 0.0
 
 def reset_all_balances():
     """Reset all user balances to 0"""
-    global user_balances
-    for user_id in user_balances:
-        user_balances[user_id] = 0.0
-    save_data()
-    print(f"All user balances reset to 0 for {len(user_balances)} users")
+    with transaction():
+        _zero_balances('reset_balances')
+        save_data()
+    logger.info("All user balances reset to 0 for %d users", len(user_balances))
 
 def reset_everything():
     """Reset all balances to 0 and clear all bets for fresh start"""
-    global user_balances, user_bets, user_state, match_result, user_results
-    
-    # Reset all balances to 0
-    for user_id in user_balances:
-        user_balances[user_id] = 0.0
-    
-    # Clear all bets and game state
-    user_bets.clear()
-    user_state.clear()
-    match_result = None
-    user_results.clear()
-    
-    save_data()
-    print(f"Complete reset: {len(user_balances)} balances set to 0, all bets cleared")
\ No newline at end of file
+    global match_result, settlement
+    with transaction():
+        # Reset all balances to 0
+        _zero_balances('reset_everything')
+        
+        # Clear all bets and game state
+        emit(events.BetsCleared(bets=len(user_bets), reason='reset'))
+        user_bets.clear()
+        user_state.clear()
+        match_result = None
+        user_results.clear()
+        settlement = None
+        
+        save_data()
+    logger.info("Complete reset: %d balances set to 0, all bets cleared", len(user_balances))
@@ -0,0 +1,328 @@
+"""
+Domain events: typed records of state changes, published in-process.
+Mutation points emit DepositMade, BalanceAdjusted, BetPlaced, BetSettled,
+BetCancelled, MatchSettled, BetsCleared, OddsChanged and SettingsChanged once the change is saved (data_sync.emit()
+holds them until the transaction commits), and consumers keep their own
+state up to date from them instead of rescanning the data.
+
+Every consumer has a bounded queue and its own thread, so a slow consumer
+never slows a request down: when its queue is full the event is dropped for
+that consumer (or, with block=N, after waiting N seconds) and counted in
+/metrics.
+
+With EVENT_SPOOL set, every event is also appended to that file as one JSON
+line (an audit log shared by all processes, in commit order), and consumers
+that subscribe with remote=True also receive the events other processes
+append there.
+"""
+
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+EVENT_SPOOL = os.getenv('EVENT_SPOOL', '')
+# Events a consumer may fall behind by before new ones are dropped for it
+QUEUE_SIZE = int(os.getenv('EVENT_QUEUE_SIZE', 10000))
+# How often other processes' events are picked up from the spool
+SPOOL_POLL_INTERVAL = 0.2
+
+HOSTNAME = socket.gethostname()
+
+EVENTS = metrics.Counter('domain_events_total', 'Domain events published by type and origin',
+                         ('type', 'origin'))
+EVENTS_DROPPED = metrics.Counter('domain_events_dropped_total', 'Events dropped because a consumer queue was full',
+                                 ('consumer',))
+SPOOL_ERRORS = metrics.Counter('event_spool_errors_total', 'Failed event spool writes and unreadable lines',
+                               ('operation',))
+
+def process_origin():
+    """Identifies this process in events, also after fork()"""
+    return f"{HOSTNAME}:{os.getpid()}"
+
+class Event:
+    """Base class: subclasses list their payload in `fields`"""
+
+    fields = ()
+
+    def __init__(self, ts=None, origin=None, **values):
+        missing = set(self.fields) - set(values)
+        if missing:
+            raise TypeError(f"{type(self).__name__} missing fields: {', '.join(sorted(missing))}")
+        for name in self.fields:
+            setattr(self, name, values[name])
+        self.ts = ts if ts is not None else time.time()
+        self.origin = origin if origin is not None else process_origin()
+
+    @property
+    def type(self):
+        return type(self).__name__
+
+    def to_dict(self):
+        data = {'type': self.type, 'ts': self.ts, 'origin': self.origin}
+        data.update((name, getattr(self, name)) for name in self.fields)
+        return data
+
+    @staticmethod
+    def from_dict(data):
+        """Rebuild an event from to_dict() output; None for unknown types"""
+        cls = EVENT_TYPES.get(data.get('type'))
+        if cls is None:
+            return None
+        return cls(ts=data.get('ts'), origin=data.get('origin'),
+                   **{name: data.get(name) for name in cls.fields})
+
+    def __repr__(self):
+        payload = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.fields)
+        return f'{self.type}({payload})'
+
+class DepositMade(Event):
+    fields = ('user_id', 'amount_uah', 'balance', 'source')
+
+class BalanceAdjusted(Event):
+    """A balance changed outside deposits and bets (admin correction, reset); amount_uah is signed"""
+    fields = ('user_id', 'amount_uah', 'balance', 'reason')
+
+class BetPlaced(Event):
+    fields = ('user_id', 'team', 'currency', 'amount', 'coef', 'bet_uah', 'balance', 'source')
+
+class BetSettled(Event):
+    """One bet credited by a settlement job; result is 'win' or 'lose', payout_uah 0 for a loss"""
+    fields = ('user_id', 'job_id', 'team', 'winner', 'result', 'bet_uah', 'payout_uah', 'balance')
+
+class BetCancelled(Event):
+    """One user's open bet was dropped without a result (the user's data was reset)"""
+    fields = ('user_id', 'team', 'bet_uah', 'reason')
+
+class MatchSettled(Event):
+    """A settlement job finished; totals are in UAH"""
+    fields = ('job_id', 'winner', 'bets', 'winners', 'stakes_uah', 'payout_uah')
+
+class BetsCleared(Event):
+    """All bets and results were dropped (new match or full reset)"""
+    fields = ('bets', 'reason')
+
+class OddsChanged(Event):
+    """slot is 'team1' or 'team2'; coefficients maps team names to odds after the change"""
+    fields = ('slot', 'coef', 'previous', 'coefficients')
+
+class SettingsChanged(Event):
+    fields = ('key', 'subkey', 'value', 'previous')
+
+EVENT_TYPES = {cls.__name__: cls for cls in
+               (DepositMade, BalanceAdjusted, BetPlaced, BetSettled, BetCancelled, MatchSettled, BetsCleared,
+                OddsChanged, SettingsChanged)}
+
+# Queue sentinel telling a consumer thread to exit
+_STOP = object()
+
+class Consumer:
+    """Calls handler(event) for the subscribed types on a thread of its own"""
+
+    def __init__(self, name, handler, types=None, remote=False, queue_size=QUEUE_SIZE, block=0.0):
+        self.name = name
+        self.handler = handler
+        self.types = None if types is None else frozenset(cls.__name__ for cls in types)
+        self.remote = remote
+        self.queue_size = queue_size
+        self.block = block
+        self.queue = queue.Queue(queue_size)
+        self.thread = None
+
+    def accepts(self, event, remote):
+        return (self.remote or not remote) and (self.types is None or event.type in self.types)
+
+    def offer(self, event):
+        """Queue the event; returns False if it was dropped"""
+        try:
+            if self.block:
+                self.queue.put(event, timeout=self.block)
+            else:
+                self.queue.put_nowait(event)
+        except queue.Full:
+            EVENTS_DROPPED.inc(consumer=self.name)
+            logger.warning("Event consumer %s is full, dropped %s", self.name, event.type,
+                           extra={'sample_rate': 100})
+            return False
+        return True
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name=f'events-{self.name}', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """Let the thread finish the queued events, then exit"""
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+
+    def _run(self):
+        while True:
+            event = self.queue.get()
+            if event is _STOP:
+                return
+            try:
+                self.handler(event)
+            except Exception:
+                logger.exception("Event consumer %s failed on %r", self.name, event)
+
+_consumers = []
+_lock = threading.Lock()
+_follower = None
+
+def subscribe(name, handler, types=None, remote=False, queue_size=QUEUE_SIZE, block=0.0):
+    """Start a consumer and return it.
+
+    types limits it to the given Event subclasses; remote=True adds events
+    other processes wrote to the spool (when EVENT_SPOOL is set).
+    """
+    consumer = Consumer(name, handler, types, remote, queue_size, block)
+    consumer.start()
+    with _lock:
+        _consumers.append(consumer)
+    if remote and EVENT_SPOOL:
+        follow_spool()
+    return consumer
+
+def unsubscribe(consumer, timeout=None):
+    with _lock:
+        if consumer in _consumers:
+            _consumers.remove(consumer)
+    consumer.stop(timeout)
+
+def following_spool():
+    """True if this process receives other processes' events"""
+    return _follower is not None
+
+def publish(*events):
+    """Spool and deliver events right away (data changes go through data_sync.emit())"""
+    spool(events)
+    dispatch(events)
+
+def dispatch(events, remote=False):
+    """Hand events to the consumers of this process"""
+    with _lock:
+        consumers = list(_consumers)
+    for event in events:
+        EVENTS.inc(type=event.type, origin='remote' if remote else 'local')
+        for consumer in consumers:
+            if consumer.accepts(event, remote):
+                consumer.offer(event)
+
+def spool(events):
+    """Append events to EVENT_SPOOL, if set, in a single write"""
+    if not EVENT_SPOOL or not events:
+        return
+    lines = ''.join(json.dumps(event.to_dict(), ensure_ascii=False) + '\n' for event in events)
+    try:
+        # O_APPEND keeps concurrent writers from overwriting each other's lines
+        fd = os.open(EVENT_SPOOL, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, lines.encode('utf-8'))
+        finally:
+            os.close(fd)
+    except OSError as e:
+        SPOOL_ERRORS.inc(operation='write')
+        logger.error("Error writing event spool %s: %s", EVENT_SPOOL, e)
+
+def read_spool(path=None):
+    """Yield every event in the spool file, oldest first"""
+    with open(path or EVENT_SPOOL, 'rb') as f:
+        for line in f:
+            event = _parse(line)
+            if event is not None:
+                yield event
+
+def _parse(line):
+    try:
+        return Event.from_dict(json.loads(line))
+    except (ValueError, TypeError) as e:
+        SPOOL_ERRORS.inc(operation='read')
+        logger.warning("Skipping unreadable spool line: %s", e)
+        return None
+
+def follow_spool():
+    """Start delivering other processes' spooled events (once per process)"""
+    global _follower
+    with _lock:
+        if _follower is not None:
+            return
+        _follower = threading.Thread(target=_follow, name='events-spool', daemon=True)
+        _follower.start()
+
+def _follow():
+    path = EVENT_SPOOL
+    try:
+        # Only events from now on: consumers seed themselves from the data
+        offset = os.path.getsize(path)
+    except OSError:
+        offset = 0
+    pending = b''
+    while True:
+        time.sleep(SPOOL_POLL_INTERVAL)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            offset, pending = 0, b''
+            continue
+        if size < offset:
+            # Truncated: start over from the beginning
+            offset, pending = 0, b''
+        if size == offset:
+            continue
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                chunk = f.read(size - offset)
+        except OSError as e:
+            SPOOL_ERRORS.inc(operation='read')
+            logger.error("Error reading event spool %s: %s", path, e)
+            continue
+        offset += len(chunk)
+        # The last line may still be half-written
+        *lines, pending = (pending + chunk).split(b'\n')
+        me = process_origin()
+        events = [event for event in map(_parse, filter(None, lines))
+                  if event is not None and event.origin != me]
+        if events:
+            dispatch(events, remote=True)
+
+def _restart_after_fork():
+    """Consumer threads do not survive fork(); give the child its own"""
+    global _lock, _follower
+    _lock = threading.Lock()
+    for consumer in _consumers:
+        consumer.queue = queue.Queue(consumer.queue_size)
+        consumer.start()
+    if _follower is not None:
+        _follower = None
+        follow_spool()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+metrics.CallbackGauge('event_consumer_queue_depth', 'Events waiting in each consumer queue',
+                      lambda: {(consumer.name,): consumer.queue.qsize() for consumer in list(_consumers)},
+                      ('consumer',))
+
+# === Stats counters: money flows of this process (Prometheus sums the processes) ===
+
+MONEY_FLOW = metrics.Counter('money_flow_uah_total', 'UAH moved by deposits, stakes and payouts', ('flow',))
+BETS_PLACED = metrics.Counter('bets_placed_total', 'Bets placed by team and source', ('team', 'source'))
+
+def _count(event):
+    if isinstance(event, DepositMade):
+        MONEY_FLOW.inc(event.amount_uah, flow='deposit')
+    elif isinstance(event, BetPlaced):
+        MONEY_FLOW.inc(event.bet_uah, flow='stake')
+        BETS_PLACED.inc(team=event.team, source=event.source)
+    elif isinstance(event, MatchSettled):
+        MONEY_FLOW.inc(event.payout_uah, flow='payout')
+
+subscribe('stats', _count, (DepositMade, BetPlaced, MatchSettled))
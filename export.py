@@ -0,0 +1,285 @@
+"""
+Streaming exports of balances, open bets and settled results, as NDJSON or CSV.
+
+Everything is a generator: rows are read one at a time and encoded in chunks
+of about CHUNK_BYTES, optionally gzip-compressed on the fly, so an export
+takes the same memory for a hundred users or a million. Balances and open
+bets are decoded member by member from DATA_FILE itself. The file is replaced
+atomically on save, so an export reads a single version of the data and does
+not hold the data lock while the client downloads. Results come from the
+history store (history.py), which also has the time of each settlement.
+
+    python export.py balances [--format csv] [--gzip] [--min-balance 100] > balances.csv
+    python export.py results --match <job_id> --since 2026-10-01 --until 2026-10-02
+
+Filters per kind:
+    balances  min_balance
+    bets      min_bet (stake in UAH)
+    results   match (settlement job id), since, until
+"""
+
+import csv
+import io
+import json
+import re
+import sys
+import zlib
+
+import changelog
+import data_sync
+import history
+import metrics
+
+CHUNK_BYTES = 64 * 1024
+FORMATS = ('ndjson', 'csv')
+
+# kind -> (columns, accepted filters)
+KINDS = {
+    'balances': (('user_id', 'balance'), ('min_balance',)),
+    'bets': (('user_id', 'team', 'amount', 'currency', 'coef', 'bet_uah', 'settled_job'), ('min_bet',)),
+    'results': (('ts', 'user_id', 'job_id', 'team', 'winner', 'result', 'bet_uah', 'payout_uah', 'balance'),
+                ('match', 'since', 'until')),
+}
+
+EXPORT_ROWS = metrics.Counter('export_rows_total', 'Rows written by admin exports', ('kind',))
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+# An object key without escapes and its colon, and what follows a member
+_KEY = re.compile(r'[ \t\n\r]*"([^"\\]*)"[ \t\n\r]*:[ \t\n\r]*')
+_SEPARATOR = re.compile(r'[ \t\n\r]*([,}])')
+# Characters that may continue a JSON number
+_NUMBER_CHARS = frozenset('0123456789.eE+-')
+
+class _JsonReader:
+    """Decodes a JSON document from a text file one value at a time.
+
+    members() walks an object without decoding the values; the caller reads
+    or skips each member's value before asking for the next one.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        data = self.f.read(CHUNK_BYTES)
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next non-whitespace character ('' at the end)"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos} of {self.f.name}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+                # A number cut by the end of the buffer ('12' of '12.5e-3') decodes too early
+                if self.eof or (end < len(self.buf) and self.buf[end] not in _NUMBER_CHARS):
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def members(self):
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            # Fast path for a plain key that is whole in the buffer
+            match = _KEY.match(self.buf, self.pos)
+            if match is not None and match.end() < len(self.buf):
+                key = match.group(1)
+                self.pos = match.end()
+            else:
+                key = self.value()
+                self.expect(':')
+            yield key
+            match = _SEPARATOR.match(self.buf, self.pos)
+            if match is not None:
+                separator = match.group(1)
+                self.pos = match.end()
+            else:
+                separator = self.peek()
+                self.expect(separator if separator in (',', '}') else ',')
+            if separator == '}':
+                return
+
+    def items(self):
+        """Like members(), for the elements of an array"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect(']')
+                return
+
+    def skip(self):
+        """Pass over a value; objects and arrays are skipped one element at a time"""
+        if self.peek() == '{':
+            for _ in self.members():
+                self.skip()
+        elif self.peek() == '[':
+            for _ in self.items():
+                self.skip()
+        else:
+            self.value()
+
+def _section(name):
+    """Yield (key, value) of one top-level object of DATA_FILE, without loading the file"""
+    try:
+        f = open(data_sync.DATA_FILE, 'r')
+    except FileNotFoundError:
+        return
+    with f:
+        reader = _JsonReader(f)
+        for section in reader.members():
+            if section != name:
+                reader.skip()
+                continue
+            if reader.peek() != '{':
+                # null or a scalar: nothing to list
+                reader.skip()
+                return
+            for key in reader.members():
+                yield key, reader.value()
+            return
+
+def _balance_rows(min_balance=None):
+    for user_id, balance in _section('user_balances'):
+        if min_balance is None or balance >= min_balance:
+            yield {'user_id': user_id, 'balance': balance}
+
+def _bet_rows(min_bet=None):
+    for user_id, state in _section('user_state'):
+        if 'team' not in state or state.get('bet') is None:
+            continue
+        bet_uah = state.get('bet_uah')
+        if min_bet is not None and (bet_uah is None or bet_uah < min_bet):
+            continue
+        yield {'user_id': user_id, 'team': state['team'], 'amount': state['bet'],
+               'currency': state.get('currency'), 'coef': state.get('coef'), 'bet_uah': bet_uah,
+               'settled_job': state.get('settled_job')}
+
+def _result_rows(match=None, since=None, until=None):
+    for ts, user_id, kind, amount, balance, details in history.iter_rows(('win', 'lose'), since, until, match):
+        yield {'ts': ts, 'user_id': user_id, 'job_id': details.get('job_id'), 'team': details.get('team'),
+               'winner': details.get('winner'), 'result': kind, 'bet_uah': details.get('bet_uah'),
+               'payout_uah': amount, 'balance': balance}
+
+_ROWS = {'balances': _balance_rows, 'bets': _bet_rows, 'results': _result_rows}
+
+def _encode(rows, columns, fmt, kind):
+    """Text chunks of about CHUNK_BYTES"""
+    buf = io.StringIO()
+    writer = None
+    if fmt == 'csv':
+        writer = csv.writer(buf, lineterminator='\n')
+        writer.writerow(columns)
+    count = 0
+    for row in rows:
+        if writer is None:
+            buf.write(json.dumps(row, ensure_ascii=False, separators=(',', ':')))
+            buf.write('\n')
+        else:
+            writer.writerow(['' if row[column] is None else row[column] for column in columns])
+        count += 1
+        if buf.tell() >= CHUNK_BYTES:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+    EXPORT_ROWS.inc(count, kind=kind)
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def parse_filters(kind, raw):
+    """Typed filters from string values (query args, command arguments); ValueError if invalid"""
+    allowed = KINDS[kind][1]
+    filters = {}
+    for name, value in raw.items():
+        if value in (None, ''):
+            continue
+        if name not in allowed:
+            raise ValueError(f"Filter {name!r} does not apply to {kind} (allowed: {', '.join(allowed)})")
+        if name in ('min_balance', 'min_bet'):
+            filters[name] = float(value)
+        elif name in ('since', 'until'):
+            filters[name] = changelog.parse_time(value)
+        else:
+            filters[name] = value
+    return filters
+
+def stream(kind, fmt='ndjson', compress=False, **filters):
+    """Chunks (bytes) of the export; raises ValueError for an unknown kind or format right away"""
+    if kind not in KINDS:
+        raise ValueError(f"Unknown export {kind!r} (one of: {', '.join(KINDS)})")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r} (one of: {', '.join(FORMATS)})")
+    columns, allowed = KINDS[kind]
+    unknown = set(filters) - set(allowed)
+    if unknown:
+        raise ValueError(f"Filters {', '.join(sorted(unknown))} do not apply to {kind}")
+    chunks = (chunk.encode('utf-8') for chunk in _encode(_ROWS[kind](**filters), columns, fmt, kind))
+    return _gzip(chunks) if compress else chunks
+
+def filename(kind, fmt, compress, ts):
+    return f"{kind}-{ts:%Y%m%d-%H%M%S}.{fmt}" + ('.gz' if compress else '')
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Export balances, open bets or settled results')
+    parser.add_argument('kind', choices=list(KINDS))
+    parser.add_argument('--format', choices=FORMATS, default='ndjson')
+    parser.add_argument('--gzip', action='store_true', help='gzip the output')
+    parser.add_argument('--min-balance', help='balances: at least this balance (UAH)')
+    parser.add_argument('--min-bet', help='bets: at least this stake (UAH)')
+    parser.add_argument('--match', help='results: settlement job id')
+    parser.add_argument('--since', help='results: from this time (unix or ISO 8601)')
+    parser.add_argument('--until', help='results: up to this time')
+    args = parser.parse_args(argv)
+    try:
+        filters = parse_filters(args.kind, {'min_balance': args.min_balance, 'min_bet': args.min_bet,
+                                            'match': args.match, 'since': args.since, 'until': args.until})
+    except ValueError as e:
+        parser.error(str(e))
+    out = sys.stdout.buffer
+    for chunk in stream(args.kind, args.format, args.gzip, **filters):
+        out.write(chunk)
+    out.flush()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Exposure book: open bets per team for the current match and what the house
+pays if that team wins. Built once from the data, then kept up to date from
+domain events (events.py) instead of scanning user_state on every read.
+
+Events reach this process only from itself, plus from the others when
+EVENT_SPOOL is set. Without the spool, a change written by another process
+is noticed through data_sync.external_changes and the book is rebuilt.
+"""
+
+import logging
+from threading import Lock
+
+import data_sync
+import events
+import metrics
+
+logger = logging.getLogger(__name__)
+
+class ExposureBook:
+    """Open bets keyed by user, with per-team totals kept alongside"""
+
+    def __init__(self):
+        self.lock = Lock()
+        # user_id -> (team, stake in UAH, payout in UAH if the team wins)
+        self.bets = {}
+        # team -> [bets, stakes, payout]
+        self.teams = {}
+        # data_sync.external_changes as of the last rebuild (None: never built)
+        self.built_at = None
+
+    def _add(self, user_id, team, stake, payout):
+        # Replacing the user's entry makes a repeated event harmless
+        self._remove(user_id)
+        self.bets[user_id] = (team, stake, payout)
+        totals = self.teams.setdefault(team, [0, 0.0, 0.0])
+        totals[0] += 1
+        totals[1] += stake
+        totals[2] += payout
+
+    def _remove(self, user_id):
+        entry = self.bets.pop(user_id, None)
+        if entry is None:
+            return
+        team, stake, payout = entry
+        totals = self.teams[team]
+        totals[0] -= 1
+        totals[1] -= stake
+        totals[2] -= payout
+        if not totals[0]:
+            del self.teams[team]
+
+    def _clear(self):
+        self.bets.clear()
+        self.teams.clear()
+
+    def rebuild(self):
+        """Scan the data once; the events keep the book current from here"""
+        with data_sync.TRANSACTION_LOCK:
+            data_sync.refresh_data()
+            changes = data_sync.external_changes
+            open_bets = [] if data_sync.match_result is not None else [
+                (user_id, state) for user_id, state in data_sync.user_state.items()
+                if user_id in data_sync.user_bets and 'team' in state and 'bet_uah' in state]
+        with self.lock:
+            self._clear()
+            for user_id, state in open_bets:
+                self._add(user_id, state['team'], state['bet_uah'], state['bet_uah'] * float(state['coef']))
+            self.built_at = changes
+        logger.debug("Exposure book rebuilt: %d open bets", len(open_bets))
+
+    def apply(self, event):
+        with self.lock:
+            if isinstance(event, events.BetPlaced):
+                self._add(event.user_id, event.team, event.bet_uah, event.bet_uah * float(event.coef))
+            elif isinstance(event, events.BetCancelled):
+                self._remove(event.user_id)
+            elif isinstance(event, (events.MatchSettled, events.BetsCleared)):
+                # Settled bets are paid out; cleared ones are gone
+                self._clear()
+
+    def snapshot(self):
+        """{team: {'bets', 'stakes_uah', 'payout_uah', 'house_net_uah'}} for the open bets"""
+        if self.built_at is None:
+            self.rebuild()
+        elif not events.following_spool():
+            data_sync.refresh_data()
+            if data_sync.external_changes != self.built_at:
+                self.rebuild()
+        with self.lock:
+            stakes_total = sum(totals[1] for totals in self.teams.values())
+            return {team: {'bets': bets,
+                           'stakes_uah': round(stakes, 2),
+                           'payout_uah': round(payout, 2),
+                           # House result if this team wins: every stake kept, this team's bets paid
+                           'house_net_uah': round(stakes_total - payout, 2)}
+                    for team, (bets, stakes, payout) in self.teams.items()}
+
+book = ExposureBook()
+events.subscribe('exposure', book.apply,
+                 (events.BetPlaced, events.BetCancelled, events.MatchSettled, events.BetsCleared), remote=True)
+
+metrics.CallbackGauge('exposure_payout_uah', 'Payout owed on open bets if the team wins',
+                      lambda: {(team,): totals['payout_uah'] for team, totals in book.snapshot().items()},
+                      ('team',))
@@ -0,0 +1,71 @@
+"""
+Конфигурация gunicorn - production-режим веб-приложения.
+
+    gunicorn -c gunicorn_config.py
+    python main_render.py --server gunicorn     # то же, с ролями main_render
+
+Несколько процессов-воркеров (pre-fork), в каждом пул потоков (gthread).
+Все параметры задаются переменными окружения. Приложение загружается в
+каждом воркере отдельно (без preload), поэтому `kill -HUP <master>` плавно
+заменяет воркеры новыми с новым кодом: старые дообслуживают начатые запросы.
+При ROLE=all мастер дополнительно запускает бота отдельным процессом.
+По SIGTERM воркеры доделывают начатые запросы (graceful_timeout) и один раз
+сохраняют данные, бот - обработчики и очередь уведомлений.
+"""
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+wsgi_app = 'main_render:create_render_app()'
+# Данные лежат в текущем каталоге, код - рядом с этим файлом
+pythonpath = ROOT
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+# По умолчанию один воркер. Каждый держит в памяти свою копию данных, книги рисков, таблицы лидеров
+# и кэшей (на бесплатном плане Render 512 МБ), а кэш ключей идемпотентности (/api/deposit,
+# /api/place_bet) и счётчики лимита запросов у каждого воркера свои: повтор пополнения, попавший
+# в другой воркер, зачислится второй раз, а лимит умножится на число воркеров. Поднимать
+# WEB_WORKERS можно, только перенеся это состояние в общее хранилище.
+workers = int(os.getenv('WEB_WORKERS', 1))
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', 8))
+# Секунды, которые соединение keep-alive ждёт следующего запроса
+keepalive = int(os.getenv('WEB_KEEPALIVE', 5))
+# Воркер, не ответивший мастеру столько секунд, перезапускается
+timeout = int(os.getenv('WEB_TIMEOUT', 30))
+# Сколько ждать завершения начатых запросов при остановке и перезагрузке
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 20))
+# Перезапуск воркера после N запросов (0 - никогда), с разбросом, чтобы не все сразу
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+backlog = 2048
+preload_app = False
+
+accesslog = os.getenv('WEB_ACCESS_LOG') or None
+loglevel = os.getenv('LOG_LEVEL', 'info').lower()
+
+def when_ready(server):
+    """Мастер открыл порт: при ROLE=all запускаем бота рядом с воркерами"""
+    if os.getenv('ROLE', 'web') != 'all':
+        return
+    server.bot_process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'main_render.py'), '--role', 'bot'])
+    server.log.info("Бот запущен (pid %s)", server.bot_process.pid)
+
+def worker_exit(server, worker):
+    """Воркер доделал начатые запросы: сохраняем данные один раз"""
+    data_sync = sys.modules.get('data_sync')
+    if data_sync is not None:
+        data_sync.close()
+
+def on_exit(server):
+    bot_process = getattr(server, 'bot_process', None)
+    if bot_process is None:
+        return
+    bot_process.terminate()
+    try:
+        bot_process.wait(graceful_timeout)
+    except subprocess.TimeoutExpired:
+        bot_process.kill()
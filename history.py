@@ -0,0 +1,220 @@
+"""
+Per-user history of deposits, bets, settlements and balance adjustments.
+
+Rows come from the domain events of each data transaction (see events.py)
+and are written when the transaction commits, under the data file lock, so
+they are in the same order as the changes. A transaction whose write of
+DATA_FILE fails records no rows (data_sync.SaveError), so the history never
+shows a balance that was not stored. The history outlives
+reset_user_after_match() and clear_all_bets(), which drop the live bet state.
+
+The store is SQLite (standard library) with an index on (user_id, ts, id).
+A page is read with a keyset cursor, not an offset, so any page costs
+O(page size) however long the history is. HISTORY_DB='' turns it off.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+import events
+import metrics
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DB = os.getenv('HISTORY_DB', 'history.sqlite3')
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    kind TEXT NOT NULL,
+    amount_uah REAL NOT NULL,
+    balance REAL,
+    details TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_user_ts ON history (user_id, ts, id);
+'''
+
+HISTORY_ROWS = metrics.Counter('history_rows_total', 'History rows written by kind', ('kind',))
+
+# One connection per thread; sqlite3 connections must not be shared across threads
+_local = threading.local()
+
+def enabled():
+    return bool(HISTORY_DB)
+
+def _connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(HISTORY_DB, timeout=30)
+        # Readers in other processes don't block the writer and vice versa
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+    return conn
+
+def _row(event):
+    """(user_id, ts, kind, signed amount, balance, details) for a history-worthy event, else None"""
+    if isinstance(event, events.DepositMade):
+        return (event.user_id, event.ts, 'deposit', event.amount_uah, event.balance,
+                {'source': event.source})
+    if isinstance(event, events.BalanceAdjusted):
+        return (event.user_id, event.ts, 'adjustment', event.amount_uah, event.balance,
+                {'reason': event.reason})
+    if isinstance(event, events.BetPlaced):
+        return (event.user_id, event.ts, 'bet', -event.bet_uah, event.balance,
+                {'team': event.team, 'amount': event.amount, 'currency': event.currency,
+                 'coef': event.coef, 'source': event.source})
+    if isinstance(event, events.BetSettled):
+        return (event.user_id, event.ts, event.result, event.payout_uah, event.balance,
+                {'team': event.team, 'winner': event.winner, 'bet_uah': event.bet_uah, 'job_id': event.job_id})
+    return None
+
+def record(batch):
+    """Store the history rows of a committed transaction's events, in one SQLite transaction.
+    Only for a transaction whose data was saved: data_sync.transaction() calls it after the write."""
+    if not enabled():
+        return
+    rows = [row for row in map(_row, batch) if row is not None]
+    if not rows:
+        return
+    try:
+        conn = _connection()
+        with conn:
+            conn.executemany(
+                'INSERT INTO history (user_id, ts, kind, amount_uah, balance, details) VALUES (?, ?, ?, ?, ?, ?)',
+                [(str(user_id), ts, kind, amount, balance, json.dumps(details, ensure_ascii=False))
+                 for user_id, ts, kind, amount, balance, details in rows])
+        for row in rows:
+            HISTORY_ROWS.inc(kind=row[2])
+    except sqlite3.Error as e:
+        # The data change itself is saved; only its history row is missing
+        HISTORY_ROWS.inc(len(rows), kind='error')
+        logger.error("Error writing %d history rows: %s", len(rows), e)
+
+def rows_after(last_id, limit=10000):
+    """Rows with id > last_id in commit order: [(id, user_id, ts, kind, amount_uah, balance, details)].
+    For consumers that follow the history (see leaderboard.py)."""
+    if not enabled():
+        return []
+    rows = _connection().execute(
+        'SELECT id, user_id, ts, kind, amount_uah, balance, details FROM history WHERE id > ? ORDER BY id LIMIT ?',
+        (last_id, limit)).fetchall()
+    return [(row_id, user_id, ts, kind, amount, balance, json.loads(details))
+            for row_id, user_id, ts, kind, amount, balance, details in rows]
+
+def last_id():
+    """Id of the newest row (0 if none)"""
+    if not enabled():
+        return 0
+    return _connection().execute('SELECT COALESCE(MAX(id), 0) FROM history').fetchone()[0]
+
+def win_totals(upto):
+    """{user_id: total winnings (payout - stake over won bets)} from rows with id <= upto"""
+    if not enabled():
+        return {}
+    return dict(_connection().execute(
+        "SELECT user_id, SUM(amount_uah - json_extract(details, '$.bet_uah')) FROM history "
+        "WHERE kind = 'win' AND id <= ? GROUP BY user_id", (upto,)))
+
+def top_wins(upto, limit, job_id=None, by_winnings=False):
+    """[(payout, ts, user_id, stake)] of the largest wins with id <= upto, optionally of one
+    settlement, by payout or by winnings (payout - stake)"""
+    if not enabled():
+        return []
+    query = ("SELECT amount_uah, ts, user_id, json_extract(details, '$.bet_uah') FROM history "
+             "WHERE kind = 'win' AND id <= ?")
+    params = [upto]
+    if job_id is not None:
+        query += " AND json_extract(details, '$.job_id') = ?"
+        params.append(job_id)
+    # Ties broken newest first, like the leaderboard's (value, ts, user_id) heaps
+    query += (" ORDER BY amount_uah - json_extract(details, '$.bet_uah') DESC" if by_winnings
+              else ' ORDER BY amount_uah DESC') + ', ts DESC, user_id DESC LIMIT ?'
+    params.append(limit)
+    return _connection().execute(query, params).fetchall()
+
+def last_settlement(upto):
+    """(job_id, winner) of the newest settled bet with id <= upto, or None"""
+    if not enabled():
+        return None
+    return _connection().execute(
+        "SELECT json_extract(details, '$.job_id'), json_extract(details, '$.winner') FROM history "
+        "WHERE kind IN ('win', 'lose') AND id <= ? ORDER BY id DESC LIMIT 1", (upto,)).fetchone()
+
+def iter_rows(kinds=None, since=None, until=None, job_id=None):
+    """Yield (ts, user_id, kind, amount_uah, balance, details) oldest first, one row at a time.
+    Reads on its own connection, so the whole export sees one snapshot of the store."""
+    if not enabled():
+        return
+    query = 'SELECT ts, user_id, kind, amount_uah, balance, details FROM history WHERE 1'
+    params = []
+    if kinds:
+        query += f" AND kind IN ({', '.join('?' * len(kinds))})"
+        params += kinds
+    if since is not None:
+        query += ' AND ts >= ?'
+        params.append(since)
+    if until is not None:
+        query += ' AND ts <= ?'
+        params.append(until)
+    if job_id is not None:
+        query += " AND json_extract(details, '$.job_id') = ?"
+        params.append(job_id)
+    _connection()  # creates the table if needed
+    conn = sqlite3.connect(HISTORY_DB, timeout=30)
+    try:
+        for ts, user_id, kind, amount, balance, details in conn.execute(query + ' ORDER BY id', params):
+            yield ts, user_id, kind, amount, balance, json.loads(details)
+    finally:
+        conn.close()
+
+def encode_cursor(ts, row_id):
+    return f'{ts!r}:{row_id}'
+
+def decode_cursor(cursor):
+    ts, row_id = cursor.rsplit(':', 1)
+    return float(ts), int(row_id)
+
+def page(user_id, limit=PAGE_SIZE, cursor=None):
+    """Newest-first entries older than `cursor`: (entries, next cursor or None).
+
+    Each entry is {'id', 'ts', 'kind', 'amount_uah', 'balance', ...details};
+    kind is deposit, adjustment, bet, win or lose. Raises ValueError for a bad cursor.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    if not enabled():
+        return [], None
+    query = 'SELECT id, ts, kind, amount_uah, balance, details FROM history WHERE user_id = ?'
+    params = [str(user_id)]
+    if cursor:
+        ts, row_id = decode_cursor(cursor)
+        # A row value comparison, so SQLite seeks in the index instead of skipping newer rows
+        query += ' AND (ts, id) < (?, ?)'
+        params += [ts, row_id]
+    query += ' ORDER BY ts DESC, id DESC LIMIT ?'
+    # One row more than asked tells whether there is a next page
+    params.append(limit + 1)
+    rows = _connection().execute(query, params).fetchall()
+    entries = []
+    for row_id, ts, kind, amount, balance, details in rows[:limit]:
+        entry = {'id': row_id, 'ts': ts, 'kind': kind, 'amount_uah': amount, 'balance': balance}
+        entry.update(json.loads(details))
+        entries.append(entry)
+    next_cursor = encode_cursor(rows[limit - 1][1], rows[limit - 1][0]) if len(rows) > limit else None
+    return entries, next_cursor
+
+def _reset_after_fork():
+    """A child must not reuse the parent's SQLite connections"""
+    global _local
+    _local = threading.local()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
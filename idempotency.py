@@ -0,0 +1,109 @@
+"""
+Idempotency keys for retried POST requests.
+A client sends the same `Idempotency-Key` header on every retry of one logical
+request; the first response is kept in a bounded, TTL-evicted in-memory index
+and replayed for duplicates without running the view again.
+"""
+
+import hashlib
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+
+from flask import current_app, jsonify, request
+
+HEADER = 'Idempotency-Key'
+TTL_SECONDS = 3600
+MAX_ENTRIES = 10000
+MAX_KEY_LENGTH = 255
+
+# Placeholder stored while the first request with a key is still running
+_IN_FLIGHT = object()
+
+class IdempotencyCache:
+    """Bounded key -> response index; entries expire TTL seconds after insertion"""
+
+    def __init__(self, ttl=TTL_SECONDS, max_entries=MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = Lock()
+        # key -> (expires_at, fingerprint, stored response or _IN_FLIGHT)
+        self.entries = OrderedDict()
+
+    def _evict(self, now):
+        """Drop expired entries from the front, then the oldest ones over capacity"""
+        while self.entries:
+            expires_at = next(iter(self.entries.values()))[0]
+            if expires_at > now and len(self.entries) <= self.max_entries:
+                break
+            self.entries.popitem(last=False)
+
+    def begin(self, key, fingerprint):
+        """Reserve a key. Returns None if the caller should run the request,
+        otherwise the existing (fingerprint, stored) entry"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1], entry[2]
+            self.entries.pop(key, None)
+            self.entries[key] = (now + self.ttl, fingerprint, _IN_FLIGHT)
+            self._evict(now)
+            return None
+
+    def finish(self, key, fingerprint, stored):
+        """Store the response for a reserved key"""
+        now = time.monotonic()
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (now + self.ttl, fingerprint, stored)
+            self._evict(now)
+
+    def release(self, key):
+        """Forget a reserved key so the client can retry it"""
+        with self.lock:
+            self.entries.pop(key, None)
+
+cache = IdempotencyCache()
+
+def idempotent(view):
+    """Replay the first response for requests that repeat an Idempotency-Key.
+
+    Keys are scoped by route. Server errors (5xx) are not stored, so a retry
+    after a failure runs the request again.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({'success': False, 'error': 'Idempotency-Key is too long'}), 400
+
+        scoped_key = (request.path, key)
+        fingerprint = hashlib.sha1(request.get_data()).hexdigest()
+        existing = cache.begin(scoped_key, fingerprint)
+        if existing is not None:
+            stored_fingerprint, stored = existing
+            if stored_fingerprint != fingerprint:
+                return jsonify({'success': False, 'error': 'Idempotency-Key reused with a different request'}), 422
+            if stored is _IN_FLIGHT:
+                return jsonify({'success': False, 'error': 'Request with this Idempotency-Key is in progress'}), 409
+            body, status, mimetype = stored
+            response = current_app.response_class(body, status=status, mimetype=mimetype)
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except Exception:
+            cache.release(scoped_key)
+            raise
+        if response.status_code >= 500:
+            cache.release(scoped_key)
+        else:
+            cache.finish(scoped_key, fingerprint,
+                         (response.get_data(), response.status_code, response.mimetype))
+        return response
+    return wrapper
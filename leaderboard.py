@@ -0,0 +1,204 @@
+"""
+Leaderboards: top balances, top winners and biggest single payouts, for the
+latest settled match and all-time.
+
+The boards follow the history store (history.py) instead of sorting
+user_balances on every request. Each read first applies the history rows
+written since the previous read: deposits, adjustments, bets and settlements,
+from any process, in commit order. Then it takes the top of each board.
+Balances and all-time winnings are kept in a bucketed sorted list (O(sqrt n)
+update, O(k) top-k). Payouts and the per-match boards only ever need the top
+TOP_LIMIT, so they are bounded min-heaps.
+
+On first use, balances come from the data and the rest from aggregates of
+the history, both at the same point (read inside a data transaction).
+"Winnings" are payout minus stake, summed over won bets. Needs the history
+store: with HISTORY_DB='' there is no leaderboard.
+"""
+
+import heapq
+import logging
+import time
+from bisect import bisect_left, insort
+from threading import Lock
+
+import data_sync
+import history
+
+logger = logging.getLogger(__name__)
+
+TOP_LIMIT = 100
+DEFAULT_LIMIT = 10
+# History rows fetched per query while catching up
+BATCH_ROWS = 10000
+
+class SortedScores:
+    """A score per key, kept ordered by (score, key): set O(sqrt n), top(k) O(k)"""
+
+    # Buckets are split when they reach twice this size
+    LOAD = 1000
+
+    def __init__(self, scores=None):
+        self.scores = dict(scores or {})
+        items = sorted((score, key) for key, score in self.scores.items())
+        self.buckets = [items[i:i + self.LOAD] for i in range(0, len(items), self.LOAD)]
+        self.maxes = [bucket[-1] for bucket in self.buckets]
+
+    def __len__(self):
+        return len(self.scores)
+
+    def get(self, key, default=None):
+        return self.scores.get(key, default)
+
+    def set(self, key, score):
+        old = self.scores.get(key)
+        if old is not None:
+            if old == score:
+                return
+            self._remove((old, key))
+        self.scores[key] = score
+        self._insert((score, key))
+
+    def _insert(self, item):
+        if not self.buckets:
+            self.buckets.append([item])
+            self.maxes.append(item)
+            return
+        index = min(bisect_left(self.maxes, item), len(self.buckets) - 1)
+        bucket = self.buckets[index]
+        insort(bucket, item)
+        self.maxes[index] = bucket[-1]
+        if len(bucket) >= 2 * self.LOAD:
+            self.buckets.insert(index + 1, bucket[self.LOAD:])
+            del bucket[self.LOAD:]
+            self.maxes[index] = bucket[-1]
+            self.maxes.insert(index + 1, self.buckets[index + 1][-1])
+
+    def _remove(self, item):
+        index = bisect_left(self.maxes, item)
+        bucket = self.buckets[index]
+        del bucket[bisect_left(bucket, item)]
+        if bucket:
+            self.maxes[index] = bucket[-1]
+        else:
+            del self.buckets[index]
+            del self.maxes[index]
+
+    def top(self, k):
+        """[(key, score)] of the k highest scores, highest first"""
+        result = []
+        for bucket in reversed(self.buckets):
+            for score, key in reversed(bucket):
+                if len(result) >= k:
+                    return result
+                result.append((key, score))
+        return result
+
+def _push(heap, entry):
+    """Keep the TOP_LIMIT largest entries in a min-heap"""
+    if len(heap) < TOP_LIMIT:
+        heapq.heappush(heap, entry)
+    elif entry > heap[0]:
+        heapq.heapreplace(heap, entry)
+
+def mask_user(user_id):
+    """Public form of a user id: the last four digits only"""
+    return '•••' + str(user_id)[-4:]
+
+class Leaderboard:
+    """Boards kept current from the history rows after last_id"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.balances = SortedScores()
+        self.winnings = SortedScores()
+        # (payout, ts, user_id) of the biggest single payouts ever
+        self.payouts = []
+        # (job_id, winner) of the latest settlement and its top (winnings | payout, ts, user_id)
+        self.match = None
+        self.match_winnings = []
+        self.match_payouts = []
+        # Newest history row applied (None: never built)
+        self.last_id = None
+
+    def rebuild(self):
+        """Load every board from the data and the history; caller holds self.lock"""
+        started = time.perf_counter()
+        # Nothing commits while the transaction runs, so the balances match history row `upto`
+        with data_sync.transaction():
+            balances = dict(data_sync.user_balances)
+            upto = history.last_id()
+        self.balances = SortedScores(balances)
+        self.winnings = SortedScores(history.win_totals(upto))
+        self.payouts = [(payout, ts, user_id) for payout, ts, user_id, _ in history.top_wins(upto, TOP_LIMIT)]
+        heapq.heapify(self.payouts)
+        self.match = history.last_settlement(upto)
+        self.match_winnings, self.match_payouts = [], []
+        if self.match is not None:
+            job_id = self.match[0]
+            self.match_winnings = [(payout - stake, ts, user_id) for payout, ts, user_id, stake
+                                   in history.top_wins(upto, TOP_LIMIT, job_id, by_winnings=True)]
+            self.match_payouts = [(payout, ts, user_id) for payout, ts, user_id, _
+                                  in history.top_wins(upto, TOP_LIMIT, job_id)]
+            heapq.heapify(self.match_winnings)
+            heapq.heapify(self.match_payouts)
+        self.last_id = upto
+        logger.info("Leaderboard built: %d balances, %d winners in %.2fs",
+                    len(self.balances), len(self.winnings), time.perf_counter() - started)
+
+    def _apply(self, row):
+        _, user_id, ts, kind, amount, balance, details = row
+        if balance is not None:
+            self.balances.set(user_id, balance)
+        if kind not in ('win', 'lose'):
+            return
+        if self.match is None or self.match[0] != details['job_id']:
+            # The first settled bet of a new match replaces the per-match boards
+            self.match = (details['job_id'], details['winner'])
+            self.match_winnings, self.match_payouts = [], []
+        if kind == 'win':
+            won = amount - details['bet_uah']
+            self.winnings.set(user_id, self.winnings.get(user_id, 0.0) + won)
+            _push(self.payouts, (amount, ts, user_id))
+            _push(self.match_payouts, (amount, ts, user_id))
+            _push(self.match_winnings, (won, ts, user_id))
+
+    def refresh(self):
+        """Apply the history rows committed since the last call; caller holds self.lock"""
+        if self.last_id is None:
+            self.rebuild()
+        while True:
+            rows = history.rows_after(self.last_id, BATCH_ROWS)
+            for row in rows:
+                self._apply(row)
+            if rows:
+                self.last_id = rows[-1][0]
+            if len(rows) < BATCH_ROWS:
+                return
+
+    def top(self, limit=DEFAULT_LIMIT):
+        """The top `limit` (at most TOP_LIMIT) of every board, or None without the history store"""
+        if not history.enabled():
+            return None
+        limit = max(1, min(int(limit), TOP_LIMIT))
+        with self.lock:
+            self.refresh()
+            return {
+                'balances': [{'user_id': user_id, 'balance': round(balance, 2)}
+                             for user_id, balance in self.balances.top(limit)],
+                'winners': {
+                    'match': [{'user_id': user_id, 'winnings_uah': round(won, 2)}
+                              for won, _, user_id in heapq.nlargest(limit, self.match_winnings)],
+                    'all_time': [{'user_id': user_id, 'winnings_uah': round(won, 2)}
+                                 for user_id, won in self.winnings.top(limit)],
+                },
+                'payouts': {
+                    'match': [{'user_id': user_id, 'payout_uah': round(payout, 2), 'ts': ts}
+                              for payout, ts, user_id in heapq.nlargest(limit, self.match_payouts)],
+                    'all_time': [{'user_id': user_id, 'payout_uah': round(payout, 2), 'ts': ts}
+                                 for payout, ts, user_id in heapq.nlargest(limit, self.payouts)],
+                },
+                'match': None if self.match is None else {'job_id': self.match[0], 'winner': self.match[1]},
+            }
+
+board = Leaderboard()
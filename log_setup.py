@@ -0,0 +1,96 @@
+"""
+Logging setup shared by the bot, the web server and the data modules.
+Records go through a QueueHandler so request threads and the bot's event loop
+never block on stdout; a single listener thread does the I/O.
+Use lazy %-style arguments (logger.debug("x=%s", x)) so disabled levels cost
+nothing, and pass extra={'sample_rate': N} to keep only 1 in N of a hot event.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from threading import Lock
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+# Records are dropped (and counted) instead of blocking when the queue is full
+QUEUE_SIZE = 10000
+
+_listener = None
+_lock = Lock()
+dropped_records = 0
+
+class SamplingFilter(logging.Filter):
+    """Pass only every Nth record of a call site that sets extra={'sample_rate': N}"""
+
+    def __init__(self):
+        super().__init__()
+        self.counts = {}
+
+    def filter(self, record):
+        rate = getattr(record, 'sample_rate', 1)
+        if rate <= 1:
+            return True
+        key = (record.name, record.msg)
+        count = self.counts.get(key, 0)
+        self.counts[key] = count + 1
+        return count % rate == 0
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records when the queue is full"""
+
+    def enqueue(self, record):
+        global dropped_records
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_records += 1
+
+def setup_logging(level=None):
+    """Route all logging through a background queue listener (safe to call twice)"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        log_queue = queue.Queue(QUEUE_SIZE)
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        queue_handler = NonBlockingQueueHandler(log_queue)
+        queue_handler.addFilter(SamplingFilter())
+
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(level or LOG_LEVEL)
+
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+def _restart_after_fork():
+    """The listener thread does not survive fork(); give the child its own"""
+    global _listener, _lock
+    _lock = Lock()
+    if _listener is None:
+        return
+    log_queue = queue.Queue(QUEUE_SIZE)
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, NonBlockingQueueHandler):
+            handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, *_listener.handlers)
+    _listener.start()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
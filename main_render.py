@@ -2,101 +2,467 @@
 """
 CS2 Betting Bot - Специальная версия для Render.com
 Автоматически настраивается для работы на Render хостинге
+
+Порт открывается сразу при запуске, а тяжёлые модули (данные, веб-сервер,
+aiogram) загружаются в фоне. Пока загрузка идёт, /health отвечает 503 со
+списком этапов, после неё — 200. Длительность каждого этапа пишется в лог.
+
+Роли (--role или ROLE):
+  web - только веб-приложение,
+  bot - только Telegram бот, без порта,
+  all - оба (по умолчанию).
+Веб-воркеров может быть несколько (--workers или WEB_WORKERS): порт
+открывается один раз, воркеры создаются через fork и принимают соединения
+с общего сокета, а главный процесс перезапускает упавшие. Все процессы
+работают с одним файлом данных через data_sync.transaction().
+
+--server gunicorn (или WEB_SERVER=gunicorn) обслуживает веб через gunicorn
+с настройками из gunicorn_config.py вместо встроенного сервера werkzeug.
+
+По SIGTERM/SIGINT процесс останавливается плавно: порт закрывается, /health
+отвечает 503 stopping, начатые запросы и обработчики бота доделываются (не
+дольше SHUTDOWN_TIMEOUT секунд), неотправленные уведомления сохраняются до
+следующего запуска, данные сохраняются один раз в самом конце.
 """
 
+import argparse
+import json
+import logging
 import os
-import asyncio
+import signal
+import sys
 import threading
 import time
-from flask import Flask
-from bot import main as bot_main
-from web_server import create_app
+from contextlib import contextmanager
+
+import log_setup
+
+logger = logging.getLogger(__name__)
+
+# Время запуска процесса, от него считаются этапы
+STARTED = time.monotonic()
+# Сколько секунд при остановке ждать начатые запросы и обработчики бота
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', 20))
 
 def get_render_config():
     """Получает конфигурацию для Render"""
     port = int(os.getenv('PORT', 5000))
-    
+
     # Автоматически определяем URL для Render
     service_name = os.getenv('RENDER_SERVICE_NAME', 'cs2-betting-bot')
     host_url = os.getenv('HOST_URL', f"{service_name}.onrender.com")
-    
+
     return {
         'port': port,
         'host_url': host_url,
         'host': '0.0.0.0'  # Render требует 0.0.0.0
     }
 
-def run_telegram_bot():
-    """Запускает Telegram бота в отдельном потоке"""
+class Startup:
+    """Этапы запуска, их длительность и готовность сервиса"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (этап, начало от запуска, длительность) в секундах
+        self.phases = []
+        self.web_app = None
+        # starting | running | failed | disabled (не запускается в этом процессе)
+        self.web = 'starting'
+        self.bot = 'starting'
+        self.errors = {}
+        # Цикл событий бота, если бот запущен в этом процессе
+        self.bot_loop = None
+        self.stopping = False
+
+    def record(self, name, start):
+        """Записать этап, начавшийся в момент start"""
+        with self.lock:
+            self.phases.append((name, round(start - STARTED, 3), round(time.monotonic() - start, 3)))
+
+    @contextmanager
+    def phase(self, name):
+        """Замерить этап запуска"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, start)
+
+    def fail(self, component, error):
+        with self.lock:
+            setattr(self, component, 'failed')
+            self.errors[component] = str(error)
+        self.log_summary()
+
+    @property
+    def finished(self):
+        return self.web != 'starting' and self.bot != 'starting'
+
+    def probe(self):
+        """(готов ли сервис, поля для ответа /health)"""
+        with self.lock:
+            details = {
+                'startup': {
+                    'web': self.web,
+                    'bot': self.bot,
+                    'phases': {name: duration for name, _, duration in self.phases},
+                    'seconds_since_start': round(time.monotonic() - STARTED, 3),
+                },
+            }
+            if self.errors:
+                details['startup']['errors'] = dict(self.errors)
+        if not self.finished:
+            details['status'] = 'starting'
+        elif self.bot == 'failed':
+            # Веб работает и без бота, поэтому сервис готов, но деградирован
+            details['status'] = 'degraded'
+        return self.web == 'running' and self.finished, details
+
+    def log_summary(self):
+        if not self.finished:
+            return
+        with self.lock:
+            phases = ', '.join(f"{name} {duration:.3f}s (+{offset:.3f}s)" for name, offset, duration in self.phases)
+        logger.info("⏱ Запуск завершён за %.3fs: %s | web=%s bot=%s",
+                    time.monotonic() - STARTED, phases, self.web, self.bot)
+
+startup = Startup()
+
+class InFlight:
+    """Число запросов в обработке, чтобы при остановке дождаться их"""
+
+    def __init__(self):
+        self.count = 0
+        self.condition = threading.Condition()
+
+    def started(self):
+        with self.condition:
+            self.count += 1
+
+    def finished(self):
+        with self.condition:
+            self.count -= 1
+            if not self.count:
+                self.condition.notify_all()
+
+    def wait(self, timeout):
+        """True, если все запросы завершились за timeout секунд"""
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.count, timeout)
+
+requests_in_flight = InFlight()
+
+class TrackedBody:
+    """Тело ответа, по закрытию которого запрос считается завершённым"""
+
+    def __init__(self, body):
+        self.body = body
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            requests_in_flight.finished()
+
+def lazy_app(environ, start_response):
+    """WSGI-приложение: считает запросы в обработке и не принимает новые при остановке"""
+    if startup.stopping:
+        return _json_response(start_response, '503 Service Unavailable', {'status': 'stopping'},
+                              [('Connection', 'close')])
+    requests_in_flight.started()
+    try:
+        body = _serve(environ, start_response)
+    except BaseException:
+        requests_in_flight.finished()
+        raise
+    return TrackedBody(body)
+
+def _serve(environ, start_response):
+    """Отвечает на проверки, пока настоящее приложение загружается"""
+    app = startup.web_app
+    if app is not None:
+        return app(environ, start_response)
+
+    path = environ.get('PATH_INFO', '')
+    if path == '/ping':
+        # Процесс жив, хоть ещё и не готов
+        return _json_response(start_response, '200 OK', {'status': 'alive'})
+    _, body = startup.probe()
+    return _json_response(start_response, '503 Service Unavailable', body)
+
+def _json_response(start_response, status, body, headers=()):
+    payload = json.dumps(body, ensure_ascii=False).encode()
+    start_response(status, [
+        ('Content-Type', 'application/json'),
+        ('Content-Length', str(len(payload))),
+        ('Retry-After', '1'),
+        ('Cache-Control', 'no-store'),
+        *headers,
+    ])
+    return [payload]
+
+def load_web():
+    """Загрузить данные, настройки и веб-приложение"""
+    try:
+        with startup.phase('storage'):
+            import data_sync
+            import bot_settings
+            # data_sync загружает данные лениво, загружаем их до первого запроса
+            data_sync.refresh_data()
+            bot_settings.get_snapshot()
+        with startup.phase('web_import'):
+            import web_server
+        web_server.readiness_probe = startup.probe
+        startup.web_app = web_server.app
+        startup.web = 'running'
+        logger.info("🌐 Веб-приложение готово (%d пользователей)", len(data_sync.user_balances))
+    except Exception as e:
+        logger.exception("❌ Ошибка загрузки веб-приложения")
+        startup.fail('web', e)
+
+def run_telegram_bot(handle_signals=False):
+    """Запускает Telegram бота (в отдельном потоке или в главном)"""
+    import asyncio
+
+    bot_start = None
     try:
+        with startup.phase('bot_import'):
+            import bot
+
+        async def on_startup():
+            # Вызывается aiogram прямо перед началом polling
+            startup.record('bot_start', bot_start)
+            startup.bot = 'running'
+            startup.log_summary()
+
+        bot.dp.startup.register(on_startup)
+        bot_start = time.monotonic()
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
-        loop.run_until_complete(bot_main())
+        startup.bot_loop = loop
+        # Сигналы обрабатывает только главный поток
+        loop.run_until_complete(bot.main(handle_signals=handle_signals))
     except Exception as e:
-        print(f"❌ Ошибка бота: {e}")
+        logger.exception("❌ Ошибка бота")
+        startup.fail('bot', e)
+
+def load_services(with_bot):
+    """Фоновая загрузка: сначала веб (он нужен пользователям сразу), потом бот"""
+    load_web()
+    if with_bot:
+        run_telegram_bot()
+    else:
+        startup.log_summary()
+
+def interrupt(signum, frame):
+    """SIGTERM прерывает serve_forever так же, как Ctrl+C"""
+    raise KeyboardInterrupt
+
+def stop_bot(thread, timeout):
+    """Остановить бота, запущенного в потоке thread этого процесса.
+    Его on_shutdown дожидается обработчиков и сохраняет очередь уведомлений."""
+    bot = sys.modules.get('bot')
+    loop = startup.bot_loop
+    if bot is None or loop is None or loop.is_closed():
+        return
+    import asyncio
+
+    # Результат не ждём: цикл бота останавливается вместе с polling
+    asyncio.run_coroutine_threadsafe(bot.dp.stop_polling(), loop)
+    thread.join(timeout)
+    if thread.is_alive():
+        logger.warning("⚠️ Бот не остановился за %.0fs", timeout)
+
+def close_storage():
+    """Сохранить данные один раз, после всех запросов и обработчиков"""
+    data_sync = sys.modules.get('data_sync')
+    if data_sync is not None:
+        data_sync.close()
+
+def graceful_shutdown(server, services):
+    """Закрыть порт, дождаться начатых запросов и бота, затем сохранить данные"""
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    start = time.monotonic()
+    startup.stopping = True
+    server.server_close()
+    logger.info("🛑 Остановка: порт закрыт, в обработке %d запросов", requests_in_flight.count)
+    if not requests_in_flight.wait(SHUTDOWN_TIMEOUT):
+        logger.warning("⚠️ %d запросов не завершились за %.0fs", requests_in_flight.count, SHUTDOWN_TIMEOUT)
+    # Бот сам ограничивает ожидание своим SHUTDOWN_TIMEOUT
+    stop_bot(services, SHUTDOWN_TIMEOUT + 5)
+    close_storage()
+    logger.info("👋 Остановлено за %.2fs", time.monotonic() - start)
+
+def serve_web(server, with_bot):
+    """Загрузить сервисы в фоне и обслуживать запросы до остановки"""
+    if not with_bot:
+        startup.bot = 'disabled'
+    signal.signal(signal.SIGTERM, interrupt)
+    services = threading.Thread(target=load_services, args=(with_bot,), name='services', daemon=True)
+    services.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        logger.error("❌ Ошибка веб-сервера: %s", e)
+    graceful_shutdown(server, services)
 
 def create_render_app():
-    """Создает Flask приложение для Render"""
-    app = create_app()
-    
-    @app.route('/health')
-    def health_check():
-        return {'status': 'healthy', 'service': 'cs2-betting-bot'}, 200
-    
-    @app.route('/')
-    def render_info():
-        return {
-            'service': 'CS2 Betting Bot',
-            'status': 'running',
-            'platform': 'Render',
-            'endpoints': {
-                'health': '/health',
-                'webapp': '/static/index.html',
-                'api': '/api/*'
-            }
-        }
-    
-    return app
+    """WSGI-приложение для gunicorn: данные и веб загружаются сразу, в каждом воркере"""
+    log_setup.setup_logging()
+    startup.bot = 'disabled'
+    load_web()
+    if startup.web != 'running':
+        raise RuntimeError(f"Веб-приложение не загрузилось: {startup.errors.get('web')}")
+    return startup.web_app
+
+def run_gunicorn():
+    """Production-режим: gunicorn с настройками из gunicorn_config.py"""
+    from gunicorn.app.base import BaseApplication
+    import gunicorn_config
+
+    class RenderServer(BaseApplication):
+        def load_config(self):
+            for key, value in vars(gunicorn_config).items():
+                if key in self.cfg.settings and value is not None:
+                    self.cfg.set(key, value)
+
+        def load(self):
+            return create_render_app()
+
+    RenderServer().run()
+
+def run_bot_only():
+    """Только бот, в главном потоке (он сам обрабатывает SIGTERM/SIGINT)"""
+    startup.web = 'disabled'
+    run_telegram_bot(handle_signals=True)
+    close_storage()
+
+def spawn(children, name, target):
+    """Запустить target в дочернем процессе"""
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        code = 0
+        try:
+            target()
+        except BaseException:
+            logger.exception("❌ Процесс %s завершился с ошибкой", name)
+            code = 1
+        finally:
+            log_setup.shutdown_logging()
+            os._exit(code)
+    logger.info("👷 %s запущен (pid %s)", name, pid)
+    children[pid] = (name, target)
 
-def main():
+def supervise(children):
+    """Ждать дочерние процессы и перезапускать упавшие, пока не придёт сигнал"""
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        name, target = children.pop(pid, (None, None))
+        if name is None or stopping:
+            continue
+        logger.warning("⚠️ %s (pid %s) завершился с кодом %s, перезапуск",
+                       name, pid, os.waitstatus_to_exitcode(status))
+        # Не перезапускаем в цикле без паузы, если процесс падает сразу
+        time.sleep(1)
+        if not stopping:
+            spawn(children, name, target)
+    logger.info("👋 Все процессы остановлены")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='CS2 Betting Bot для Render.com')
+    parser.add_argument('--role', choices=('web', 'bot', 'all'), default=os.getenv('ROLE', 'all'),
+                        help='что запускать в этом сервисе (по умолчанию ROLE или all)')
+    parser.add_argument('--workers', type=int,
+                        help='число веб-процессов (по умолчанию WEB_WORKERS или 1; больше 1 - см. RENDER_GUIDE)')
+    parser.add_argument('--server', choices=('dev', 'gunicorn'), default=os.getenv('WEB_SERVER', 'dev'),
+                        help='встроенный сервер werkzeug или gunicorn (по умолчанию WEB_SERVER или dev)')
+    return parser.parse_args(argv)
+
+def main(argv=None):
     """Главная функция для Render"""
-    print("🚀 Запуск CS2 Betting Bot на Render.com")
-    
-    config = get_render_config()
-    print(f"🌐 Порт: {config['port']}")
-    print(f"🔗 URL: https://{config['host_url']}")
-    
+    args = parse_args(argv)
+    log_setup.setup_logging()
+    logger.info("🚀 Запуск CS2 Betting Bot на Render.com (роль %s)", args.role)
+
     # Проверяем токен бота
-    if not os.getenv('TELEGRAM_BOT_TOKEN'):
-        print("❌ TELEGRAM_BOT_TOKEN не установлен!")
-        print("Добавьте переменную окружения в настройках Render:")
-        print("TELEGRAM_BOT_TOKEN=ваш_токен_бота")
+    if args.role != 'web' and not os.getenv('TELEGRAM_BOT_TOKEN'):
+        logger.error("❌ TELEGRAM_BOT_TOKEN не установлен! Добавьте переменную окружения в настройках Render: "
+                     "TELEGRAM_BOT_TOKEN=ваш_токен_бота")
+        return
+
+    if args.role == 'bot':
+        run_bot_only()
         return
-    
+
+    config = get_render_config()
+    logger.info("🌐 Порт: %s", config['port'])
+    logger.info("🔗 URL: https://%s", config['host_url'])
+
     # Устанавливаем HOST_URL для антисон системы
     os.environ['HOST_URL'] = config['host_url']
-    
-    # Запускаем Telegram бота в отдельном потоке
-    print("🤖 Запуск Telegram бота...")
-    bot_thread = threading.Thread(target=run_telegram_bot, daemon=True)
-    bot_thread.start()
-    
-    # Небольшая задержка для инициализации бота
-    time.sleep(3)
-    
-    # Создаем и запускаем Flask приложение
-    print("🌐 Запуск веб-сервера...")
-    app = create_render_app()
-    
-    try:
-        app.run(
-            host=config['host'],
-            port=config['port'],
-            debug=False,
-            threaded=True
-        )
-    except Exception as e:
-        print(f"❌ Ошибка веб-сервера: {e}")
+
+    if args.server == 'gunicorn':
+        try:
+            import gunicorn
+        except ImportError:
+            logger.error("❌ gunicorn не установлен (pip install gunicorn), используем встроенный сервер")
+        else:
+            # gunicorn_config.py читает настройки из окружения
+            os.environ['ROLE'] = args.role
+            if args.workers:
+                os.environ['WEB_WORKERS'] = str(args.workers)
+            run_gunicorn()
+            return
+
+    workers = max(1, args.workers or int(os.getenv('WEB_WORKERS', 1)))
+    if workers > 1 and not hasattr(os, 'fork'):
+        logger.warning("⚠️ fork недоступен на этой платформе, запускаем один веб-процесс")
+        workers = 1
+
+    # Открываем порт до загрузки тяжёлых модулей
+    with startup.phase('bind'):
+        from werkzeug.serving import make_server
+        server = make_server(config['host'], config['port'], lazy_app, threaded=True)
+    logger.info("🌐 Порт открыт через %.3fs, загрузка сервисов...", time.monotonic() - STARTED)
+
+    with_bot = args.role == 'all'
+    if workers == 1:
+        serve_web(server, with_bot)
+        return
+
+    # Воркеры создаются до импорта тяжёлых модулей и запуска потоков;
+    # бот в режиме all - отдельный процесс, чтобы он не дублировался в воркерах
+    children = {}
+    for number in range(1, workers + 1):
+        spawn(children, f'web-{number}', lambda: serve_web(server, with_bot=False))
+    if with_bot:
+        spawn(children, 'bot', run_bot_only)
+    supervise(children)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
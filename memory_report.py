@@ -0,0 +1,167 @@
+"""
+Memory accounting for the in-process data structures.
+Reports the deep size of every data_sync structure and the settings snapshot,
+the top allocation sites from tracemalloc, and the growth of both since the
+previous report. Set TRACEMALLOC=1 to trace allocations from startup;
+otherwise tracing starts with the first report.
+"""
+
+import os
+import sys
+import tracemalloc
+from threading import Lock
+
+import bot_settings
+import data_sync
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+TRACE_FRAMES = 1
+TOP_SITES = 15
+
+if os.getenv('TRACEMALLOC') == '1':
+    tracemalloc.start(TRACE_FRAMES)
+
+# Previous report, for growth: (tracemalloc snapshot or None, {name: (entries, bytes)})
+_previous = (None, {})
+LOCK = Lock()
+
+def deep_sizeof(obj):
+    """Size of an object and everything it references (containers only), in bytes"""
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+    return total
+
+def _data_structures():
+    # Read under data_sync.TRANSACTION_LOCK: a reload rebinds these names
+    return {
+        'user_balances': data_sync.user_balances,
+        'user_state': data_sync.user_state,
+        'user_results': data_sync.user_results,
+        'user_bets': data_sync.user_bets,
+    }
+
+def _measure(structures):
+    """name -> (entries, bytes)"""
+    return {name: (len(obj), deep_sizeof(obj)) for name, obj in structures.items()}
+
+def _sizes():
+    """name -> (entries, bytes) for everything we account for. Each structure is
+    walked under the lock its writers hold, so no request or settlement changes
+    it mid-walk (a dict resized under the walk would raise or miscount)."""
+    with data_sync.TRANSACTION_LOCK:
+        sizes = _measure(_data_structures())
+    # An immutable snapshot, replaced as a whole on change
+    sizes.update(_measure({'settings_snapshot': bot_settings.get_snapshot()[1]}))
+    # Caches of the web side, only when that side is loaded in this process
+    idempotency = sys.modules.get('idempotency')
+    if idempotency is not None:
+        with idempotency.cache.lock:
+            sizes.update(_measure({'idempotency_cache': idempotency.cache.entries}))
+    rate_limit = sys.modules.get('rate_limit')
+    if rate_limit is not None:
+        with rate_limit.limiter.lock:
+            sizes.update(_measure({'rate_limit_buckets': rate_limit.limiter.buckets}))
+    return sizes
+
+def _peak_rss_bytes():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def build_report(limit=TOP_SITES):
+    """Collect the report and remember it as the baseline for the next one"""
+    global _previous
+    with LOCK:
+        previous_snapshot, previous_sizes = _previous
+
+        sizes = _sizes()
+        structures = {}
+        for name, (entries, size) in sizes.items():
+            old_entries, old_size = previous_sizes.get(name, (entries, size))
+            structures[name] = {
+                'entries': entries,
+                'bytes': size,
+                'entries_growth': entries - old_entries,
+                'bytes_growth': size - old_size,
+            }
+
+        report = {
+            'pid': os.getpid(),
+            'peak_rss_bytes': _peak_rss_bytes(),
+            'structures': structures,
+            'tracing': tracemalloc.is_tracing(),
+            'top_sites': [],
+        }
+
+        snapshot = None
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ))
+            current, peak = tracemalloc.get_traced_memory()
+            report['traced_bytes'] = current
+            report['traced_peak_bytes'] = peak
+            if previous_snapshot is not None:
+                stats = snapshot.compare_to(previous_snapshot, 'lineno')
+            else:
+                stats = snapshot.statistics('lineno')
+            for stat in stats[:limit]:
+                frame = stat.traceback[0]
+                report['top_sites'].append({
+                    'site': f'{frame.filename}:{frame.lineno}',
+                    'bytes': stat.size,
+                    'count': stat.count,
+                    'bytes_growth': getattr(stat, 'size_diff', 0),
+                    'count_growth': getattr(stat, 'count_diff', 0),
+                })
+        else:
+            tracemalloc.start(TRACE_FRAMES)
+            report['note'] = 'tracemalloc started now; allocation sites appear from the next report'
+
+        _previous = (snapshot, sizes)
+        return report
+
+def _mb(size):
+    return f'{size / 1048576:.2f} MB'
+
+def format_report(report):
+    """Plain-text rendering for the bot"""
+    lines = [f"PID {report['pid']}"]
+    if report['peak_rss_bytes'] is not None:
+        lines.append(f"Peak RSS: {_mb(report['peak_rss_bytes'])}")
+    if 'traced_bytes' in report:
+        lines.append(f"Traced: {_mb(report['traced_bytes'])} (peak {_mb(report['traced_peak_bytes'])})")
+    lines.append('')
+    lines.append('Structures (entries, size, growth):')
+    for name, info in report['structures'].items():
+        lines.append(f"  {name}: {info['entries']} ({info['entries_growth']:+d}), "
+                     f"{_mb(info['bytes'])} ({info['bytes_growth'] / 1024:+.1f} KB)")
+    if report['top_sites']:
+        lines.append('')
+        lines.append('Top allocation sites (size, growth):')
+        for site in report['top_sites']:
+            lines.append(f"  {os.path.basename(site['site'])}: {site['bytes'] / 1024:.1f} KB "
+                         f"({site['bytes_growth'] / 1024:+.1f} KB), {site['count']} blocks")
+    if 'note' in report:
+        lines.append('')
+        lines.append(report['note'])
+    return '\n'.join(lines)
@@ -0,0 +1,208 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+Counters and histograms are plain dicts keyed by label values behind one lock,
+cheap enough to update on every request, storage call and bot update.
+"""
+
+import bisect
+import time
+from threading import Lock
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1024, 10240, 102400, 1048576, 10485760, 104857600)
+
+REGISTRY = []
+LOCK = Lock()
+
+def _format_labels(labelnames, labelvalues, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with LOCK:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(tuple(labels[name] for name in self.labelnames), 0)
+
+    def collect(self):
+        with LOCK:
+            items = list(self.values.items())
+        for key, value in items:
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with LOCK:
+            self.values[key] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class CallbackGauge:
+    """Gauge (or counter) whose values are read from a function at scrape time.
+
+    The function returns {label values tuple: value}.
+    """
+
+    def __init__(self, name, documentation, fn, labelnames=(), type='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+        self.type = type
+        REGISTRY.append(self)
+
+    def collect(self):
+        for key, value in self.fn().items():
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+class Histogram:
+    """Cumulative histogram with fixed buckets"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # key -> [per-bucket counts (+Inf last), sum, count]
+        self.values = {}
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with LOCK:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, **labels):
+        """Context manager that observes the elapsed time of its block"""
+        return _Timer(self, labels)
+
+    def quantile(self, q, **labels):
+        """Approximate quantile (upper bucket bound), or None without samples"""
+        entry = self.values.get(tuple(labels[name] for name in self.labelnames))
+        if not entry or not entry[2]:
+            return None
+        rank = q * entry[2]
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), entry[0]):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def collect(self):
+        with LOCK:
+            items = [(key, (list(counts), total, count)) for key, (counts, total, count) in self.values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound))}"'
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, key)} {count}'
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+def render():
+    """All registered metrics in Prometheus text format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+# === Metrics shared by the bot, the web server and storage ===
+
+HTTP_REQUESTS = Counter('http_requests_total', 'HTTP requests by route, method and status',
+                        ('route', 'method', 'status'))
+HTTP_LATENCY = Histogram('http_request_duration_seconds', 'HTTP request latency by route',
+                         ('route', 'method'))
+
+BOT_UPDATES = Counter('bot_handler_calls_total', 'aiogram handler calls by handler and outcome',
+                      ('handler', 'outcome'))
+BOT_LATENCY = Histogram('bot_handler_duration_seconds', 'aiogram handler latency by handler',
+                        ('handler',))
+
+STORAGE_OPS = Counter('storage_operations_total', 'Data file loads and saves', ('operation', 'outcome'))
+STORAGE_LATENCY = Histogram('storage_operation_duration_seconds', 'Data file load/save duration',
+                            ('operation',))
+STORAGE_BYTES = Counter('storage_bytes_total', 'Bytes read from and written to the data file',
+                        ('operation',))
+
+SETTLEMENT_LATENCY = Histogram('settlement_duration_seconds', 'Time to settle all bets of a match')
+SETTLEMENT_BETS = Counter('settled_bets_total', 'Bets settled by outcome', ('result',))
+
+NOTIFICATIONS = Counter('notifications_sent_total', 'Telegram notifications by kind and outcome',
+                        ('kind', 'outcome'))
+
+LOOP_LAG = Histogram('event_loop_lag_seconds', 'Bot event loop scheduling lag',
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+
+def init_app(app):
+    """Record per-route request counts and latency for a Flask app"""
+    from flask import g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_LATENCY.observe(time.perf_counter() - start, route=route, method=request.method)
+            HTTP_REQUESTS.inc(route=route, method=request.method, status=str(response.status_code))
+        return response
@@ -0,0 +1,107 @@
+"""
+Persistent outbox for Telegram notifications.
+Handlers queue messages here instead of sending them inline, and a background
+task sends them in order. The queue is written to OUTBOX_FILE when messages
+are added, every CHECKPOINT_EVERY sends and on shutdown, and loaded again at
+startup, so a restart resumes where it stopped. A crash between checkpoints
+may resend a few messages. A message leaves the queue only once the send
+callback returns: the bot's callback waits out flood limits and retries
+network errors, and drops (counts and logs) only what Telegram refuses.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_FILE = 'notifications_outbox.json'
+CHECKPOINT_EVERY = 50
+
+class Outbox:
+    """FIFO of {'chat_id', 'text', 'kind', 'parse_mode'} messages backed by a file"""
+
+    def __init__(self, path=OUTBOX_FILE):
+        self.path = path
+        self.queue = deque()
+        self.wakeup = asyncio.Event()
+        self.sent_since_checkpoint = 0
+        self.task = None
+
+    def load(self):
+        """Load messages left by the previous run; returns how many"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.queue.extend(json.load(f))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error("Error loading outbox %s: %s", self.path, e)
+        return len(self.queue)
+
+    def save(self):
+        """Write the pending messages (or remove the file when there are none)"""
+        self.sent_since_checkpoint = 0
+        try:
+            if not self.queue:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                return
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp_path = tempfile.mkstemp(prefix='.outbox.', suffix='.tmp', dir=directory)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(list(self.queue), f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except Exception as e:
+            logger.error("Error saving outbox %s: %s", self.path, e)
+
+    def put(self, messages):
+        """Queue messages and persist them before they are sent"""
+        if not messages:
+            return
+        self.queue.extend(messages)
+        self.save()
+        self.wakeup.set()
+
+    def start(self, send):
+        """Start sending with `await send(message)` on the running loop"""
+        self.task = asyncio.create_task(self._run(send))
+        return self.task
+
+    async def _run(self, send):
+        while True:
+            while self.queue:
+                # Removed only once the attempt is over, so a cancelled send is kept
+                await send(self.queue[0])
+                self.queue.popleft()
+                self.sent_since_checkpoint += 1
+                if self.sent_since_checkpoint >= CHECKPOINT_EVERY or not self.queue:
+                    self.save()
+            self.wakeup.clear()
+            await self.wakeup.wait()
+
+    async def close(self, timeout):
+        """Keep sending for up to `timeout` seconds, then stop and persist the rest.
+        Returns the number of messages left for the next start."""
+        deadline = time.monotonic() + timeout
+        while self.queue and self.task is not None and not self.task.done() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.error("Outbox sender failed: %s", e)
+            self.task = None
+        self.save()
+        return len(self.queue)
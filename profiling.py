@@ -0,0 +1,246 @@
+"""
+On-demand profiling of the live process.
+An admin starts a session for N seconds in one of two modes:
+  * "sample"   - a background thread samples the stacks of all threads every
+                 few milliseconds (statistical, negligible overhead; samples
+                 land where threads release the GIL, so blocking calls are
+                 over-represented);
+  * "cprofile" - a fraction of Flask requests run under cProfile, one at a
+                 time (requests that overlap a profiled one are skipped), and
+                 are merged into one pstats report. Not for the bot: an aiogram
+                 handler awaits, and cProfile on the event loop thread would
+                 charge it with every other coroutine that runs meanwhile.
+Only one session can run at a time. The web route starts a session and
+returns its id; the result is fetched by id once the session is done.
+"""
+
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from threading import Lock
+
+MAX_SECONDS = 120
+SAMPLE_INTERVAL = 0.005
+REPORT_LIMIT = 30
+
+# Leaf frames that mean a thread is idle (waiting for I/O, a lock or a timer)
+IDLE_FRAMES = {
+    ('selectors.py', 'select'),
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('queue.py', 'get'),
+    ('socketserver.py', 'serve_forever'),
+    ('base_events.py', '_run_once'),
+}
+
+_session = None
+LOCK = Lock()
+# Held by the one request running under cProfile. Python 3.12+ allows a single
+# active profiler per process (sys.monitoring); a second enable() raises.
+PROFILER_LOCK = Lock()
+
+class ProfileSession:
+    """One profiling run and its collected data"""
+
+    def __init__(self, seconds, mode, sample_rate):
+        self.id = uuid.uuid4().hex[:12]
+        self.mode = mode
+        self.sample_rate = sample_rate
+        self.started = time.monotonic()
+        self.until = self.started + seconds
+        self.seconds = seconds
+        self.lock = Lock()
+        # cprofile mode
+        self.stats = None
+        self.profiled_calls = 0
+        # sample mode
+        self.samples = 0
+        self.self_counts = Counter()
+        self.total_counts = Counter()
+        self.thread = None
+
+    @property
+    def active(self):
+        return time.monotonic() < self.until
+
+    @property
+    def remaining(self):
+        """Seconds left to collect"""
+        return max(0.0, self.until - time.monotonic())
+
+    @property
+    def done(self):
+        """Finished collecting: the report is final"""
+        return not self.active and (self.thread is None or not self.thread.is_alive())
+
+    def should_profile(self):
+        """Whether the current request/handler should run under cProfile"""
+        return self.mode == 'cprofile' and self.active and random.random() < self.sample_rate
+
+    def add_profile(self, profiler):
+        """Merge a finished cProfile.Profile into the session"""
+        profiler.create_stats()
+        if not profiler.stats:
+            return
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profiler)
+            else:
+                self.stats.add(profiler)
+            self.profiled_calls += 1
+
+    def _sample_loop(self, ignore):
+        me = threading.get_ident()
+        while self.active:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me or thread_id in ignore:
+                    continue
+                leaf = frame.f_code
+                if (os.path.basename(leaf.co_filename), leaf.co_name) in IDLE_FRAMES:
+                    continue
+                self.samples += 1
+                self.self_counts[_frame_key(leaf)] += 1
+                seen = set()
+                while frame is not None:
+                    key = _frame_key(frame.f_code)
+                    if key not in seen:
+                        seen.add(key)
+                        self.total_counts[key] += 1
+                    frame = frame.f_back
+            time.sleep(SAMPLE_INTERVAL)
+
+    def report(self, limit=REPORT_LIMIT):
+        """Ranked hot-function report as text"""
+        if self.mode == 'cprofile':
+            if self.stats is None:
+                return f"cProfile: {self.seconds}s, no requests or handlers were profiled\n"
+            buf = io.StringIO()
+            buf.write(f"cProfile: {self.seconds}s, {self.profiled_calls} calls profiled "
+                      f"(sample rate {self.sample_rate:g})\n")
+            with self.lock:
+                self.stats.stream = buf
+                self.stats.sort_stats('cumulative').print_stats(limit)
+            return buf.getvalue()
+
+        lines = [f"Sampling: {self.seconds}s, {self.samples} busy samples every {SAMPLE_INTERVAL * 1000:g} ms"]
+        if not self.samples:
+            return lines[0] + "\n"
+        lines.append(f"{'self%':>6} {'total%':>7}  function")
+        for key, count in self.self_counts.most_common(limit):
+            total = self.total_counts[key]
+            lines.append(f"{100.0 * count / self.samples:6.1f} {100.0 * total / self.samples:7.1f}  {_format_key(key)}")
+        return "\n".join(lines) + "\n"
+
+    def pstats_bytes(self):
+        """Collected cProfile data in the pstats file format, or None"""
+        if self.stats is None:
+            return None
+        with self.lock:
+            return marshal.dumps(self.stats.stats)
+
+def _frame_key(code):
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+def _format_key(key):
+    filename, line, name = key
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+def start(seconds, mode='sample', sample_rate=1.0, ignore_current_thread=False):
+    """Start a session; raises RuntimeError if one is already running.
+
+    Pass ignore_current_thread when the caller will just sleep until the end.
+    """
+    global _session
+    if mode not in ('sample', 'cprofile'):
+        raise ValueError(f"Unknown profiling mode: {mode}")
+    seconds = max(1, min(int(seconds), MAX_SECONDS))
+    with LOCK:
+        if _session is not None and _session.active:
+            raise RuntimeError("Profiling session already running")
+        session = ProfileSession(seconds, mode, max(0.0, min(sample_rate, 1.0)))
+        if mode == 'sample':
+            session.thread = threading.Thread(target=session._sample_loop,
+                                              args=({threading.get_ident()} if ignore_current_thread else set(),),
+                                              name='profiler-sampler', daemon=True)
+            session.thread.start()
+        _session = session
+    return session
+
+def current():
+    """The running session, if any"""
+    session = _session
+    return session if session is not None and session.active else None
+
+def get(session_id):
+    """The latest session if it has this id (running or finished), else None"""
+    session = _session
+    return session if session is not None and session.id == session_id else None
+
+def wait(session):
+    """Block until a session has finished collecting"""
+    time.sleep(max(0.0, session.until - time.monotonic()))
+    if session.thread is not None:
+        session.thread.join()
+    return session
+
+async def wait_async(session):
+    """Wait for a session to finish without blocking the event loop"""
+    # Imported here: only the bot needs it, and it slows the web server's import
+    import asyncio
+    await asyncio.sleep(max(0.0, session.until - time.monotonic()))
+    if session.thread is not None:
+        await asyncio.to_thread(session.thread.join)
+    return session
+
+def run(seconds, mode='sample', sample_rate=1.0):
+    """Profile for N seconds, blocking the calling thread; returns the session"""
+    return wait(start(seconds, mode, sample_rate, ignore_current_thread=True))
+
+def profile_call_start():
+    """Start a cProfile for the current request if the session samples it
+    and no other request is being profiled (then it runs unprofiled)"""
+    session = current()
+    if session is None or not session.should_profile():
+        return None
+    if not PROFILER_LOCK.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler (a debugger, coverage) is active
+        PROFILER_LOCK.release()
+        return None
+    return session, profiler
+
+def profile_call_end(token):
+    """Stop a profile started with profile_call_start and merge it"""
+    if token is None:
+        return
+    session, profiler = token
+    try:
+        profiler.disable()
+    finally:
+        PROFILER_LOCK.release()
+    session.add_profile(profiler)
+
+def init_app(app):
+    """Profile sampled Flask requests while a cprofile session is running"""
+    from flask import g, request
+
+    @app.before_request
+    def start_request_profile():
+        if not request.path.startswith('/admin/'):
+            g.profile_token = profile_call_start()
+
+    @app.teardown_request
+    def end_request_profile(exc):
+        profile_call_end(g.pop('profile_token', None))
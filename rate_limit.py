@@ -0,0 +1,187 @@
+"""
+Admission control shared by the web API and the Telegram bot.
+Token buckets throttle each route (or bot updates) to a configured budget,
+and a global concurrency cap sheds load with a fast rejection instead of
+queueing requests behind slow file reloads.
+
+Web requests are keyed on the client IP (the app sits behind ProxyFix, see
+web_server), with IP_BUDGET_FACTOR times the route budget since several
+users may share an address. The user_id in the body is not authenticated,
+so it only adds a second bucket with the route budget itself: changing it
+per request does not get a client past its IP bucket.
+"""
+
+import os
+import time
+from threading import Lock
+
+import metrics
+
+# Budgets: name -> (tokens refilled per second, bucket size)
+ROUTE_BUDGETS = {
+    '/api/place_bet': (0.2, 5),
+    '/api/deposit': (0.2, 5),
+    '/api/balance': (1.0, 10),
+    '/api/check_result': (0.5, 10),
+    '/api/bootstrap': (0.5, 10),
+    '/api/settings': (1.0, 20),
+}
+DEFAULT_API_BUDGET = (1.0, 20)
+BOT_BUDGET = (1.0, 5)
+# A client IP gets this many times the per-user budget of a route (users behind one NAT)
+IP_BUDGET_FACTOR = int(os.getenv('RATE_LIMIT_IP_FACTOR', 5))
+
+# Set RATE_LIMIT_ENABLED=0 to turn throttling off (e.g. for local benchmarks)
+ENABLED = os.getenv('RATE_LIMIT_ENABLED', '1') != '0'
+MAX_CONCURRENT_REQUESTS = int(os.getenv('MAX_CONCURRENT_REQUESTS', 32))
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', 64))
+
+# Buckets are swept once there are more than this many
+MAX_BUCKETS = 100000
+
+class TokenBucketLimiter:
+    """Token buckets keyed by (budget name, user key)"""
+
+    def __init__(self):
+        self.lock = Lock()
+        # key -> [tokens, last refill time, rate, burst]
+        self.buckets = {}
+        self.allowed = {}
+        self.throttled = {}
+
+    def allow(self, name, user_key, rate, burst):
+        """Take a token. Returns (allowed, seconds until the next token)"""
+        now = time.monotonic()
+        key = (name, user_key)
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= MAX_BUCKETS:
+                    self._sweep(now)
+                bucket = self.buckets[key] = [float(burst), now, rate, burst]
+            else:
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1.0:
+                bucket[0] -= 1.0
+                self.allowed[name] = self.allowed.get(name, 0) + 1
+                return True, 0.0
+            self.throttled[name] = self.throttled.get(name, 0) + 1
+            return False, (1.0 - bucket[0]) / rate
+
+    def _sweep(self, now):
+        """Drop buckets that have refilled completely (they behave like new ones)"""
+        full = [key for key, (tokens, last, rate, burst) in self.buckets.items()
+                if tokens + (now - last) * rate >= burst]
+        for key in full:
+            del self.buckets[key]
+
+class ConcurrencyLimiter:
+    """Non-blocking cap on the number of requests in progress"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.lock = Lock()
+        self.in_flight = 0
+        self.peak = 0
+        self.shed = 0
+
+    def try_acquire(self):
+        with self.lock:
+            if self.in_flight >= self.limit:
+                self.shed += 1
+                return False
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            return True
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+limiter = TokenBucketLimiter()
+web_concurrency = ConcurrencyLimiter(MAX_CONCURRENT_REQUESTS)
+bot_concurrency = ConcurrencyLimiter(MAX_CONCURRENT_UPDATES)
+
+metrics.CallbackGauge('rate_limit_allowed_total', 'Requests admitted by the token buckets',
+                      lambda: {(name,): count for name, count in list(limiter.allowed.items())},
+                      ('budget',), type='counter')
+metrics.CallbackGauge('rate_limit_throttled_total', 'Requests rejected by the token buckets',
+                      lambda: {(name,): count for name, count in list(limiter.throttled.items())},
+                      ('budget',), type='counter')
+metrics.CallbackGauge('load_shed_total', 'Requests rejected by the concurrency cap',
+                      lambda: {('web',): web_concurrency.shed, ('bot',): bot_concurrency.shed},
+                      ('side',), type='counter')
+metrics.CallbackGauge('requests_in_flight', 'Requests or updates currently being handled',
+                      lambda: {('web',): web_concurrency.in_flight, ('bot',): bot_concurrency.in_flight},
+                      ('side',))
+
+def get_route_budget(path):
+    """(budget name, rate, burst) for an HTTP path, or None if the path is not limited"""
+    if path in ROUTE_BUDGETS:
+        return (path,) + ROUTE_BUDGETS[path]
+    if path.startswith('/api/'):
+        return ('/api/*',) + DEFAULT_API_BUDGET
+    return None
+
+def snapshot():
+    """Counters for monitoring"""
+    with limiter.lock:
+        allowed = dict(limiter.allowed)
+        throttled = dict(limiter.throttled)
+        buckets = len(limiter.buckets)
+    return {
+        'allowed': allowed,
+        'throttled': throttled,
+        'buckets': buckets,
+        'web': {
+            'in_flight': web_concurrency.in_flight,
+            'peak': web_concurrency.peak,
+            'limit': web_concurrency.limit,
+            'shed': web_concurrency.shed
+        },
+        'bot': {
+            'in_flight': bot_concurrency.in_flight,
+            'peak': bot_concurrency.peak,
+            'limit': bot_concurrency.limit,
+            'shed': bot_concurrency.shed
+        }
+    }
+
+def init_app(app):
+    """Install admission control on a Flask app (API routes only)"""
+    from flask import g, jsonify, request
+
+    @app.before_request
+    def admit_request():
+        budget = get_route_budget(request.path)
+        if budget is None or not ENABLED:
+            return None
+
+        if not web_concurrency.try_acquire():
+            response = jsonify({'success': False, 'error': 'Сервер перегружен, попробуйте позже'})
+            response.status_code = 429
+            response.headers['Retry-After'] = '1'
+            return response
+        g.rate_limit_acquired = True
+
+        name, rate, burst = budget
+        allowed, retry_after = limiter.allow(name, request.remote_addr,
+                                             rate * IP_BUDGET_FACTOR, burst * IP_BUDGET_FACTOR)
+        if allowed:
+            request_data = request.get_json(silent=True)
+            user_id = request_data.get('user_id') if isinstance(request_data, dict) else None
+            if user_id:
+                allowed, retry_after = limiter.allow(name + ' user', str(user_id), rate, burst)
+        if not allowed:
+            response = jsonify({'success': False, 'error': 'Слишком много запросов, попробуйте позже'})
+            response.status_code = 429
+            response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+            return response
+        return None
+
+    @app.teardown_request
+    def release_request(exc):
+        if g.pop('rate_limit_acquired', False):
+            web_concurrency.release()
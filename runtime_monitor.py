@@ -0,0 +1,180 @@
+"""
+Runtime monitor for the bot's asyncio event loop.
+A heartbeat task measures scheduling lag every few tens of milliseconds, and a
+watchdog thread notices when the heartbeat stalls and captures what the loop
+thread is executing at that moment, so blocking handlers are reported by name.
+Pending tasks and in-flight Telegram API requests are tracked alongside.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = 0.05
+# A handler holding the loop longer than this is reported
+BLOCK_THRESHOLD = float(os.getenv('LOOP_BLOCK_THRESHOLD', 0.1))
+# Lag above this is an SLO breach and alerts the admins
+LAG_SLO = float(os.getenv('LOOP_LAG_SLO', 0.5))
+ALERT_COOLDOWN = 300
+SUMMARY_INTERVAL = 240
+
+PENDING_TASKS = metrics.Gauge('event_loop_pending_tasks', 'Tasks alive on the bot event loop')
+TELEGRAM_IN_FLIGHT = metrics.Gauge('telegram_requests_in_flight', 'Telegram Bot API requests in progress')
+TELEGRAM_LATENCY = metrics.Histogram('telegram_request_duration_seconds', 'Telegram Bot API request latency',
+                                     ('method',))
+LOOP_BLOCKED = metrics.Counter('event_loop_blocked_total', 'Times a handler held the loop past the threshold',
+                               ('handler',))
+LOOP_BLOCKED_SECONDS = metrics.Histogram('event_loop_block_duration_seconds', 'Duration of loop stalls',
+                                         buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+
+class RuntimeMonitor:
+    """Loop lag, stall attribution, task and request tracking for one event loop"""
+
+    def __init__(self, alert=None):
+        # async callable(text) used for SLO alerts
+        self.alert = alert
+        self.loop = None
+        self.loop_thread_id = None
+        self.last_beat = time.monotonic()
+        self.lags = deque(maxlen=int(SUMMARY_INTERVAL / HEARTBEAT_INTERVAL))
+        self.max_lag = 0.0
+        # task -> handler name, maintained by the handler middleware
+        self.task_handlers = {}
+        self.telegram_in_flight = 0
+        # Stall seen by the watchdog and not yet finished: (start, handler, location)
+        self.stall = None
+        self.recent_blocks = deque(maxlen=20)
+        self.last_alert = 0.0
+        self.alert_task = None
+        self.stopped = False
+
+    # --- handler / request tracking ---
+
+    def handler_started(self, name):
+        task = asyncio.current_task()
+        if task is not None:
+            self.task_handlers[task] = name
+        return task
+
+    def handler_finished(self, task):
+        if task is not None:
+            self.task_handlers.pop(task, None)
+
+    def request_started(self):
+        self.telegram_in_flight += 1
+        TELEGRAM_IN_FLIGHT.set(self.telegram_in_flight)
+
+    def request_finished(self, method, duration):
+        self.telegram_in_flight -= 1
+        TELEGRAM_IN_FLIGHT.set(self.telegram_in_flight)
+        TELEGRAM_LATENCY.observe(duration, method=method)
+
+    # --- monitoring ---
+
+    async def run(self):
+        """Heartbeat loop; also starts the watchdog thread"""
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        threading.Thread(target=self._watchdog, name='loop-watchdog', daemon=True).start()
+
+        last_summary = last_tasks = time.monotonic()
+        try:
+            while True:
+                start = time.monotonic()
+                await asyncio.sleep(HEARTBEAT_INTERVAL)
+                now = time.monotonic()
+                self.last_beat = now
+                lag = max(0.0, now - start - HEARTBEAT_INTERVAL)
+                self.lags.append(lag)
+                self.max_lag = max(self.max_lag, lag)
+                metrics.LOOP_LAG.observe(lag)
+
+                if self.stall is not None:
+                    self._finish_stall(lag)
+                if lag > LAG_SLO:
+                    self._maybe_alert(lag)
+                if now - last_tasks >= 1.0:
+                    last_tasks = now
+                    PENDING_TASKS.set(len(asyncio.all_tasks()))
+                if now - last_summary >= SUMMARY_INTERVAL:
+                    last_summary = now
+                    self._log_summary()
+        finally:
+            self.stopped = True
+
+    def _watchdog(self):
+        """Capture what the loop thread runs while the heartbeat is late"""
+        while not self.stopped:
+            time.sleep(HEARTBEAT_INTERVAL / 2)
+            if self.stall is not None or time.monotonic() - self.last_beat < BLOCK_THRESHOLD + HEARTBEAT_INTERVAL:
+                continue
+            frame = sys._current_frames().get(self.loop_thread_id)
+            task = asyncio.current_task(self.loop) if self.loop is not None else None
+            handler = self.task_handlers.get(task)
+            if handler is None and task is not None:
+                handler = task.get_name()
+            location = None
+            if frame is not None:
+                code = frame.f_code
+                location = f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+            self.stall = (self.last_beat, handler or 'unknown', location)
+
+    def _finish_stall(self, lag):
+        _, handler, location = self.stall
+        self.stall = None
+        LOOP_BLOCKED.inc(handler=handler)
+        LOOP_BLOCKED_SECONDS.observe(lag)
+        self.recent_blocks.append({'handler': handler, 'location': location, 'seconds': round(lag, 3)})
+        logger.warning("Event loop blocked for %.3fs by %s at %s", lag, handler, location)
+
+    def _maybe_alert(self, lag):
+        """Send the alert in a task of its own: a slow Telegram call must not hold up the heartbeat"""
+        now = time.monotonic()
+        if self.alert is None or now - self.last_alert < ALERT_COOLDOWN:
+            return
+        self.last_alert = now
+        culprit = self.recent_blocks[-1] if self.recent_blocks else None
+        text = f"⚠️ Задержка event loop {lag:.2f} с (SLO {LAG_SLO:.2f} с)"
+        if culprit is not None:
+            text += f"\nБлокировал: {culprit['handler']} — {culprit['location']}"
+        # Kept so the task is not garbage-collected while it runs
+        self.alert_task = asyncio.create_task(self._send_alert(text))
+
+    async def _send_alert(self, text):
+        try:
+            await self.alert(text)
+        except Exception as e:
+            logger.warning("Could not send loop lag alert: %s", e)
+
+    def summary(self):
+        """Lag percentiles over the summary window and current counters"""
+        lags = sorted(self.lags)
+
+        def pct(q):
+            return lags[min(len(lags) - 1, int(q * len(lags)))] if lags else 0.0
+
+        return {
+            'lag_p50': pct(0.5),
+            'lag_p99': pct(0.99),
+            'lag_max': self.max_lag,
+            'pending_tasks': len(asyncio.all_tasks(self.loop)) if self.loop is not None else 0,
+            'telegram_in_flight': self.telegram_in_flight,
+            'running_handlers': sorted(set(self.task_handlers.values())),
+            'recent_blocks': list(self.recent_blocks),
+        }
+
+    def _log_summary(self):
+        s = self.summary()
+        logger.info("Runtime: lag p50=%.1fms p99=%.1fms max=%.1fms | tasks=%d | telegram in flight=%d | blocks=%d",
+                    s['lag_p50'] * 1000, s['lag_p99'] * 1000, s['lag_max'] * 1000,
+                    s['pending_tasks'], s['telegram_in_flight'], len(s['recent_blocks']))
+        self.max_lag = 0.0
@@ -0,0 +1,100 @@
+"""
+Precompressed static file serving for the WebApp.
+Each file is read and compressed once per version (gzip, plus brotli when the
+optional `brotli` package is installed) and served with strong ETags, so repeat
+opens of the Mini App are answered with 304 Not Modified.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from threading import Lock
+
+from flask import abort, current_app, request
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+# Files with a content hash in the name (app.3f2a9c1e.js) never change in place
+HASHED_NAME = re.compile(r'\.[0-9a-f]{8,}\.\w+$')
+HASHED_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Everything else may be cached but must be revalidated with the ETag
+DEFAULT_CACHE_CONTROL = 'no-cache'
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+MIN_COMPRESS_SIZE = 1024
+
+# filename -> (file stamp, mimetype, {encoding: (body, etag)})
+_cache = {}
+LOCK = Lock()
+
+def _build_variants(path, mimetype):
+    """Read a file and precompress it, returning {encoding: (body, etag)}"""
+    with open(path, 'rb') as f:
+        body = f.read()
+    digest = hashlib.sha256(body).hexdigest()[:20]
+    variants = {'identity': (body, digest)}
+
+    if len(body) >= MIN_COMPRESS_SIZE and mimetype.startswith(COMPRESSIBLE_TYPES):
+        # mtime=0 keeps the gzip output (and its ETag) identical across restarts
+        variants['gzip'] = (gzip.compress(body, 9, mtime=0), digest + '-gz')
+        if brotli is not None:
+            variants['br'] = (brotli.compress(body, quality=11), digest + '-br')
+    return variants
+
+def _get_variants(filename):
+    """Return (mimetype, variants) for a static file, rebuilding only when it changed"""
+    path = safe_join(STATIC_DIR, filename)
+    if path is None:
+        abort(404)
+    try:
+        st = os.stat(path)
+    except OSError:
+        abort(404)
+    stamp = (st.st_mtime_ns, st.st_size)
+
+    cached = _cache.get(filename)
+    if cached is None or cached[0] != stamp:
+        with LOCK:
+            cached = _cache.get(filename)
+            if cached is None or cached[0] != stamp:
+                mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                cached = (stamp, mimetype, _build_variants(path, mimetype))
+                _cache[filename] = cached
+    return cached[1], cached[2]
+
+def _choose_encoding(variants):
+    """Pick the smallest encoding the client accepts"""
+    for encoding in ('br', 'gzip'):
+        if encoding in variants and request.accept_encodings[encoding]:
+            return encoding
+    return 'identity'
+
+def serve(filename):
+    """Serve a file from the static directory"""
+    mimetype, variants = _get_variants(filename)
+    encoding = _choose_encoding(variants)
+    body, etag = variants[encoding]
+
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(body, mimetype=mimetype)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+
+    response.set_etag(etag)
+    if len(variants) > 1:
+        response.vary.add('Accept-Encoding')
+    if HASHED_NAME.search(filename):
+        response.headers['Cache-Control'] = HASHED_CACHE_CONTROL
+    else:
+        response.headers['Cache-Control'] = DEFAULT_CACHE_CONTROL
+    return response
@@ -1,31 +1,65 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
+from datetime import datetime
+from functools import wraps
+import gzip
+import hmac
+import logging
 import os
 
 # Import shared data management
 import data_sync
+import balance_import
 import bot_settings
+import changelog
+import events
+import export
+import exposure
+import history
+import leaderboard
+import static_assets
+import idempotency
+import rate_limit
+import metrics
+import profiling
+import memory_report
 
-app = Flask(__name__, static_folder='static', template_folder='static')
+# Static files go through static_assets instead of Flask's built-in static route
+app = Flask(__name__, static_folder=None, template_folder='static')
+# Render's proxy is the one hop in front of the app: remote_addr becomes the client from X-Forwarded-For
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1)
 CORS(app)
+# Metrics first so rejected requests are timed too
+metrics.init_app(app)
+rate_limit.init_app(app)
+profiling.init_app(app)
+
+logger = logging.getLogger(__name__)
+
+# Token for /admin/* routes; the routes are disabled when it is not set
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+
+# Set by a launcher (main_render) to gate /health on startup:
+# a callable returning (ready, extra fields for the payload)
+readiness_probe = None
+
+def admin_required(view):
+    """Allow only requests with 'Authorization: Bearer <ADMIN_TOKEN>'"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({'error': 'Admin API is disabled (ADMIN_TOKEN is not set)'}), 403
+        auth = request.headers.get('Authorization', '')
+        token = auth[len('Bearer '):] if auth.startswith('Bearer ') else ''
+        if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+            return jsonify({'error': 'Unauthorized'}), 401
+        return view(*args, **kwargs)
+    return wrapper
 
 # Use shared data structures (direct references to module data)
 # Note: We reference data_sync module directly to ensure synchronization
 
-# Use dynamic settings
-def get_current_settings():
-    """Get current settings from bot_settings"""
-    team1, team2 = bot_settings.get_team_names()
-    return {
-        'exchange_rates': bot_settings.get_exchange_rates(),
-        'coefficients': bot_settings.get_coefficients(),
-        'team_emojis': bot_settings.get_team_emojis(),
-        'teams': {
-            'team1': team1,
-            'team2': team2
-        }
-    }
-
 def convert_to_uah(amount, currency):
     """Convert amount to UAH using current exchange rates"""
     rates = bot_settings.get_exchange_rates()
@@ -35,7 +69,12 @@ def convert_to_uah(amount, currency):
 @app.route('/')
 def index():
     """Serve the main web app"""
-    return send_from_directory('static', 'index.html')
+    return static_assets.serve('index.html')
+
+@app.route('/static/<path:filename>')
+def static_file(filename):
+    """Serve static files precompressed with strong validators"""
+    return static_assets.serve(filename)
 
 @app.route('/api/balance', methods=['POST'])
 def get_balance():
@@ -50,16 +89,17 @@ def get_balance():
     data_sync.reload_data()
     balance = data_sync.user_balances.get(user_id, 0.0)
     
-    print(f"BALANCE DEBUG: user_id={user_id}, returning balance={balance}")
+    logger.debug("Balance requested: user_id=%s balance=%s", user_id, balance, extra={'sample_rate': 100})
     
     return jsonify({'balance': balance})
 
 @app.route('/api/place_bet', methods=['POST'])
+@idempotency.idempotent
 def place_bet():
     """Place a bet via web app"""
     try:
         request_data = request.get_json()
-        print(f"Received bet request: {request_data}")
+        logger.debug("Received bet request: %s", request_data)
         
         user_id = request_data.get('user_id')
         team = request_data.get('team')
@@ -69,26 +109,14 @@ def place_bet():
         
         # Validation
         if not all([user_id, team, currency, amount, coef]):
-            print(f"Missing fields: user_id={user_id}, team={team}, currency={currency}, amount={amount}, coef={coef}")
+            logger.info("Bet rejected, missing fields: user_id=%s team=%s currency=%s amount=%s coef=%s",
+                        user_id, team, currency, amount, coef)
             return jsonify({'success': False, 'error': 'Все поля обязательны'}), 400
         
-        # Clear any previous result for this user (for new match)
-        if data_sync.get_user_result(user_id):
-            data_sync.set_user_result(user_id, None)
-            print(f"Cleared previous result for user {user_id}")
-        
-        # Reload data to get latest balances and states
-        data_sync.reload_data()
-        
-        # Check if user already made a bet
-        if user_id in data_sync.user_bets:
-            print(f"User {user_id} already has a bet")
-            return jsonify({'success': False, 'error': 'Вы уже сделали ставку на этот матч'}), 400
-        
         # Validate team
         current_coefficients = bot_settings.get_coefficients()
         if team not in current_coefficients:
-            print(f"Invalid team: {team}")
+            logger.info("Bet rejected, invalid team: %s", team)
             return jsonify({'success': False, 'error': 'Неверная команда'}), 400
         
         # Validate amount
@@ -97,7 +125,7 @@ def place_bet():
             if amount <= 0:
                 raise ValueError("Amount must be positive")
         except ValueError as e:
-            print(f"Invalid amount: {amount}, error: {e}")
+            logger.info("Bet rejected, invalid amount %s: %s", amount, e)
             return jsonify({'success': False, 'error': 'Неверная сумма ставки'}), 400
         
         # Convert currency format for compatibility with bot code
@@ -110,93 +138,105 @@ def place_bet():
         }
         
         formatted_currency = currency_map.get(currency, currency)
-        print(f"Placing bet: user_id={user_id}, team={team}, currency={formatted_currency}, amount={amount}, coef={coef}")
-        
-        # Place the bet
         bet_uah = convert_to_uah(amount, formatted_currency)
         
         # Ensure user_id is string for consistency
         user_id = str(user_id)
         
-        if user_id not in data_sync.user_balances:
-            data_sync.user_balances[user_id] = 0.0
-        
-        # Debug current balance state
-        current_balance = data_sync.user_balances.get(user_id, 0.0)
-        print(f"PLACE BET DEBUG: user_id={user_id}, current_balance={current_balance}, bet_uah={bet_uah}")
-        print(f"PLACE BET DEBUG: user_balances dict: {data_sync.user_balances}")
-        
-        # Check if user has enough balance
-        if current_balance < bet_uah:
-            raise ValueError(f"Недостаточно средств! Баланс: {current_balance:.2f} UAH, требуется: {bet_uah:.2f} UAH")
-        
-        # Deduct bet amount from balance (not add!)
-        data_sync.user_balances[user_id] -= bet_uah
-        
-        # Ensure balance doesn't go negative
-        if data_sync.user_balances[user_id] < 0:
-            data_sync.user_balances[user_id] = 0.0
-        
-        # Record bet
-        data_sync.user_state[user_id] = {
-            "team": team,
-            "currency": formatted_currency,
-            "coef": coef,
-            "bet": amount,
-            "bet_uah": bet_uah
-        }
-        data_sync.user_bets.add(user_id)
-        
-        # Save data to file for cross-process sync
-        data_sync.save_data()
+        # Check and deduct against the latest data, excluding other workers and the bot
+        with data_sync.transaction():
+            # Bets placed after settlement would never get a result
+            if data_sync.match_result is not None:
+                return jsonify({'success': False, 'error': 'Приём ставок на этот матч закрыт'}), 400
+            
+            # Check if user already made a bet
+            if user_id in data_sync.user_bets:
+                logger.info("Bet rejected, user %s already has a bet", user_id)
+                return jsonify({'success': False, 'error': 'Вы уже сделали ставку на этот матч'}), 400
+            
+            current_balance = data_sync.user_balances.get(user_id, 0.0)
+            
+            # Check if user has enough balance
+            if current_balance < bet_uah:
+                raise ValueError(f"Недостаточно средств! Баланс: {current_balance:.2f} UAH, требуется: {bet_uah:.2f} UAH")
+            
+            # Deduct bet amount from balance (not add!)
+            new_balance = max(0.0, current_balance - bet_uah)
+            data_sync.user_balances[user_id] = new_balance
+            
+            # Record bet
+            data_sync.user_state[user_id] = {
+                "team": team,
+                "currency": formatted_currency,
+                "coef": coef,
+                "bet": amount,
+                "bet_uah": bet_uah
+            }
+            data_sync.user_bets.add(user_id)
+            
+            # Written once when the transaction ends
+            data_sync.save_data()
+            data_sync.emit(events.BetPlaced(user_id=user_id, team=team, currency=formatted_currency,
+                                            amount=amount, coef=coef, bet_uah=bet_uah,
+                                            balance=new_balance, source='web'))
         
-        print(f"Bet placed successfully, new balance: {data_sync.user_balances[user_id]}")
+        logger.info("Bet placed: user_id=%s team=%s currency=%s amount=%s coef=%s bet_uah=%.2f new_balance=%.2f",
+                    user_id, team, formatted_currency, amount, coef, bet_uah, new_balance)
         
         return jsonify({
             'success': True,
-            'new_balance': data_sync.user_balances[user_id],
+            'new_balance': new_balance,
             'message': 'Ставка принята!'
         })
     except ValueError as e:
-        print(f"ValueError in place_bet: {e}")
+        logger.info("Bet rejected: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 400
-    except Exception as e:
-        print(f"Unexpected error in place_bet: {e}")
+    except data_sync.SaveError:
+        return jsonify({'success': False, 'error': 'Не удалось сохранить ставку, попробуйте ещё раз'}), 503
+    except Exception:
+        logger.exception("Unexpected error in place_bet")
         return jsonify({'success': False, 'error': 'Внутренняя ошибка сервера'}), 500
 
-@app.route('/api/settings', methods=['GET'])
-def get_current_game_settings():
-    """Get current game settings (teams, coefficients, etc.)"""
-    settings = get_current_settings()
-    teams = settings['teams']
+def build_settings_payload(settings):
+    """Build the /api/settings response body from a settings snapshot"""
+    team1 = settings['teams']['team1']
+    team2 = settings['teams']['team2']
     coefficients = settings['coefficients']
-    exchange_rates = settings['exchange_rates']
     team_emojis = settings['team_emojis']
+    emoji1 = team_emojis.get('team1', '🧑‍💼')
+    emoji2 = team_emojis.get('team2', '🦅')
     
-    team1 = teams['team1']
-    team2 = teams['team2']
-    
-    # Get coefficients by team key and name
-    team1_coef = coefficients.get('team1') or coefficients.get(team1, 1.5)
-    team2_coef = coefficients.get('team2') or coefficients.get(team2, 2.0)
-    
-    return jsonify({
+    return {
         'teams': {
             'team1': team1,
             'team2': team2
         },
         'coefficients': {
-            team1: team1_coef,
-            team2: team2_coef
+            team1: coefficients.get('team1', 1.5),
+            team2: coefficients.get('team2', 2.0)
         },
         'team_emojis': {
-            team1: team_emojis.get(team1, '🧑‍💼'),
-            team2: team_emojis.get(team2, '🦅'),
-            'team1': team_emojis.get(team1, '🧑‍💼'),
-            'team2': team_emojis.get(team2, '🦅')
+            team1: emoji1,
+            team2: emoji2,
+            'team1': emoji1,
+            'team2': emoji2
         },
-        'exchange_rates': exchange_rates
-    })
+        'exchange_rates': settings['exchange_rates']
+    }
+
+@app.route('/api/settings', methods=['GET'])
+def get_current_game_settings():
+    """Get current game settings (teams, coefficients, etc.)"""
+    version, settings = bot_settings.get_snapshot()
+    
+    # Clients revalidate with If-None-Match; unchanged settings cost a bodiless 304
+    if request.if_none_match.contains(version):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(build_settings_payload(settings))
+    response.set_etag(version)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
@@ -214,8 +254,10 @@ def get_stats():
         'total_bets': total_bets,
         'total_users': total_users,
         'team_stats': team_stats,
-        'coefficients': COEFFICIENTS,
-        'exchange_rates': EXCHANGE_RATES
+        # Open bets and payouts per team, kept current from bet events
+        'exposure': exposure.book.snapshot(),
+        'coefficients': bot_settings.get_coefficients(),
+        'exchange_rates': bot_settings.get_exchange_rates()
     })
 
 @app.route('/api/announce_winner', methods=['POST'])
@@ -225,65 +267,26 @@ def announce_winner():
         request_data = request.get_json()
         winning_team = request_data.get('winning_team')
         
-        if winning_team not in COEFFICIENTS:
+        if winning_team not in bot_settings.get_coefficients():
             return jsonify({'success': False, 'error': 'Invalid team'}), 400
         
-        # Set match result in shared data
-        data_sync.set_match_result(winning_team)
-        
+        # Settle all bets as a checkpointed job; retrying resumes it, never pays twice
         results = []
-        
-        data_sync.reload_data()  # Get latest data
-        for user_id, state in data_sync.user_state.items():
-            if 'team' in state and 'bet_uah' in state:
-                user_team = state['team']
-                bet_amount = state['bet_uah']
-                coef = state['coef']
-                
-                if user_team == winning_team:
-                    # User won - add full payout to balance (bet was deducted when placed)
-                    winnings = bet_amount * coef
-                    data_sync.user_balances[user_id] += winnings
-                    
-                    print(f"WINNER DEBUG: user_id={user_id}, bet_amount={bet_amount}, coef={coef}, winnings={winnings}, new_balance={data_sync.user_balances[user_id]}")
-                    
-                    # Store user result
-                    data_sync.set_user_result(user_id, {
-                        'result': 'win',
-                        'winnings': winnings,
-                        'balance': data_sync.user_balances[user_id],
-                        'winning_team': winning_team,
-                        'user_team': user_team
-                    })
-                    
-                    results.append({
-                        'user_id': user_id,
-                        'result': 'win',
-                        'winnings': winnings,
-                        'new_balance': data_sync.user_balances[user_id]
-                    })
-                else:
-                    # User lost - money already deducted when bet was placed, no change needed
-                    print(f"LOSER DEBUG: user_id={user_id}, bet_amount={bet_amount}, current_balance={data_sync.user_balances[user_id]}")
-                    
-                    # Store user result
-                    data_sync.set_user_result(user_id, {
-                        'result': 'lose',
-                        'lost': bet_amount,
-                        'balance': data_sync.user_balances[user_id],
-                        'winning_team': winning_team,
-                        'user_team': user_team
-                    })
-                    
-                    results.append({
-                        'user_id': user_id,
-                        'result': 'lose',
-                        'lost': bet_amount,
-                        'new_balance': data_sync.user_balances[user_id]
-                    })
-        
-        # Save all changes to file
-        data_sync.save_data()
+        for user_id, state, result in data_sync.settle_match(winning_team):
+            if result['result'] == 'win':
+                results.append({
+                    'user_id': user_id,
+                    'result': 'win',
+                    'winnings': result['payout'],
+                    'new_balance': result['balance']
+                })
+            else:
+                results.append({
+                    'user_id': user_id,
+                    'result': 'lose',
+                    'lost': result['lost'],
+                    'new_balance': result['balance']
+                })
         
         return jsonify({
             'success': True,
@@ -291,78 +294,93 @@ def announce_winner():
             'results': results
         })
     except Exception as e:
-        print(f"Error in announce_winner: {e}")
+        logger.exception("Error in announce_winner")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def get_bet_status(user_id):
+    """Get user's bet status from the loaded data (caller refreshes it)"""
+    # Results are stored for every bettor when the match is settled,
+    # so this is a plain lookup
+    user_result = data_sync.user_results.get(user_id)
+    if user_result:
+        return user_result
+    
+    # Check if user has an active bet
+    if user_id not in data_sync.user_bets:
+        return {'result': 'no_bet'}
+    
+    return {
+        'result': 'pending',
+        'balance': data_sync.user_balances.get(user_id, 0.0)
+    }
+
 @app.route('/api/check_result', methods=['POST'])
 def check_result():
     """Check result for specific user"""
     try:
         request_data = request.get_json()
-        user_id = request_data.get('user_id')
-        
-        # Check if user has a stored result from previous match
-        user_result = data_sync.get_user_result(user_id)
-        if user_result:
-            print(f"Found stored result for user {user_id}: {user_result}")
-            return jsonify(user_result)
-        
-        # Reload data to get latest state
-        data_sync.reload_data()
-        
-        # Check if user has an active bet
-        if user_id not in data_sync.user_state:
-            return jsonify({'result': 'no_bet'})
-        
-        # Check if match result has been announced for current bet
-        winner = data_sync.get_match_result()
-        if winner is None:
-            return jsonify({
-                'result': 'pending',
-                'balance': data_sync.user_balances.get(user_id, 0.0)
-            })
-        
-        # Match has been decided, calculate result based on user's bet
-        user_state_data = data_sync.user_state[user_id]
-        user_team = user_state_data['team']
-        bet_amount = user_state_data.get('bet_uah', 0)
-        coef = user_state_data.get('coef', 1.0)
-        
-        if user_team == winner:
-            # User won - add full payout to balance (bet was already deducted when placed)
-            total_payout = bet_amount * coef
-            data_sync.user_balances[user_id] += total_payout
-            
-            result_data = {
-                'result': 'win',
-                'balance': data_sync.user_balances[user_id],
-                'winnings': total_payout,
-                'winning_team': winner,
-                'user_team': user_team
-            }
-        else:
-            # User lost - money already deducted when bet was placed, no change needed
-            result_data = {
-                'result': 'lose',
-                'balance': data_sync.user_balances[user_id],
-                'lost': bet_amount,
-                'winning_team': winner,
-                'user_team': user_team
-            }
+        user_id = str(request_data.get('user_id'))
         
-        # Save updated balance to file
-        data_sync.save_data()
+        data_sync.refresh_data()
+        return jsonify(get_bet_status(user_id))
+    except Exception as e:
+        logger.exception("Error in check_result")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/history', methods=['POST'])
+def get_history():
+    """A page of the user's deposits, bets and results, newest first.
+    Pass the returned next_cursor as cursor for the following page."""
+    request_data = request.get_json() or {}
+    user_id = request_data.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'User ID required'}), 400
+    try:
+        entries, next_cursor = history.page(str(user_id), request_data.get('limit', history.PAGE_SIZE),
+                                            request_data.get('cursor'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+    return jsonify({'items': entries, 'next_cursor': next_cursor})
+
+@app.route('/api/leaderboard', methods=['GET'])
+def get_leaderboard():
+    """Top balances, winners and single payouts, for the latest match and all-time.
+    ?limit=N (default 10, at most 100). User ids are shown by their last digits only."""
+    try:
+        limit = int(request.args.get('limit', leaderboard.DEFAULT_LIMIT))
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+    boards = leaderboard.board.top(limit)
+    if boards is None:
+        return jsonify({'error': 'Leaderboard needs the history store'}), 503
+    for entries in (boards['balances'], *boards['winners'].values(), *boards['payouts'].values()):
+        for entry in entries:
+            entry['user'] = leaderboard.mask_user(entry.pop('user_id'))
+    return jsonify(boards)
+
+@app.route('/api/bootstrap', methods=['POST'])
+def bootstrap():
+    """Everything the WebApp needs on open: settings, balance and bet status"""
+    try:
+        request_data = request.get_json()
+        user_id = str(request_data.get('user_id'))
         
-        # Store the result for future checks
-        data_sync.set_user_result(user_id, result_data)
-        print(f"Calculated and stored result for user {user_id}: {result_data}")
+        # One snapshot of settings and data for the whole response
+        version, settings = bot_settings.get_snapshot()
+        data_sync.refresh_data()
         
-        return jsonify(result_data)
+        return jsonify({
+            'settings': build_settings_payload(settings),
+            'settings_version': version,
+            'balance': data_sync.user_balances.get(user_id, 0.0),
+            'bet_status': get_bet_status(user_id)
+        })
     except Exception as e:
-        print(f"Error in check_result: {e}")
+        logger.exception("Error in bootstrap")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/deposit', methods=['POST'])
+@idempotency.idempotent
 def deposit_balance():
     """Add balance to user account"""
     try:
@@ -370,38 +388,34 @@ def deposit_balance():
         user_id = str(request_data.get('user_id'))
         amount = float(request_data.get('amount', 0))
         
-        print(f"DEPOSIT DEBUG: user_id={user_id}, amount={amount}")
-        
         if amount <= 0:
             return jsonify({'success': False, 'error': 'Сумма должна быть больше 0'}), 400
             
         if amount > 10000:
             return jsonify({'success': False, 'error': 'Максимальная сумма пополнения: 10,000 UAH'}), 400
             
-        # Reload data first
-        data_sync.reload_data()
-        
-        # Get current balance BEFORE any operations
-        current_balance = data_sync.user_balances.get(user_id, 0.0)
-        print(f"DEPOSIT DEBUG: current_balance before operations = {current_balance}")
-        
-        # Add deposit amount to existing balance (correct logic)
-        new_balance = current_balance + amount
-        data_sync.user_balances[user_id] = new_balance
-        
-        print(f"DEPOSIT DEBUG: added {amount} to {current_balance}, new balance = {new_balance}")
-        
-        # Check balance limit after adding deposit
-        if new_balance > 500000:
-            return jsonify({'success': False, 'error': f'Превышен лимит баланса (500,000 UAH). Текущий баланс: {current_balance:.2f}, максимальное пополнение: {500000 - current_balance:.2f}'}), 400
-        
-        # Clear any old match data for fresh start
-        data_sync.reset_user_after_match(user_id)
-        
-        # Save the new balance
-        data_sync.save_data()
+        # Read, check and write the balance as one step across processes
+        with data_sync.transaction():
+            # Get current balance BEFORE any operations
+            current_balance = data_sync.user_balances.get(user_id, 0.0)
+            
+            # Add deposit amount to existing balance (correct logic)
+            new_balance = current_balance + amount
+            
+            # Check balance limit before changing anything
+            if new_balance > 500000:
+                return jsonify({'success': False, 'error': f'Превышен лимит баланса (500,000 UAH). Текущий баланс: {current_balance:.2f}, максимальное пополнение: {500000 - current_balance:.2f}'}), 400
+            
+            data_sync.user_balances[user_id] = new_balance
+            
+            # Clear any old match data for fresh start
+            data_sync.reset_user_after_match(user_id)
+            
+            # Save the new balance
+            data_sync.save_data()
+            data_sync.emit(events.DepositMade(user_id=user_id, amount_uah=amount, balance=new_balance, source='web'))
         
-        print(f"DEPOSIT DEBUG: Balance set for user {user_id}: {new_balance} UAH")
+        logger.info("Deposit: user_id=%s amount=%.2f balance %.2f -> %.2f", user_id, amount, current_balance, new_balance)
         
         return jsonify({
             'success': True,
@@ -411,32 +425,183 @@ def deposit_balance():
         })
     except ValueError:
         return jsonify({'success': False, 'error': 'Неверная сумма'}), 400
+    except data_sync.SaveError:
+        return jsonify({'success': False, 'error': 'Не удалось сохранить пополнение, попробуйте ещё раз'}), 503
     except Exception as e:
-        print(f"DEPOSIT ERROR: {e}")
+        logger.exception("Error in deposit")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint for anti-sleep system"""
     try:
-        data_sync.reload_data()
-        from datetime import datetime
+        data_sync.refresh_data()
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        return jsonify({
+        payload = {
             'status': 'healthy',
             'timestamp': current_time,
             'users': len(data_sync.user_balances),
             'active_bets': len(data_sync.user_bets),
             'match_result': data_sync.match_result,
+            'load_shedding': rate_limit.snapshot(),
             'uptime': 'active'
-        })
+        }
+        if readiness_probe is not None:
+            ready, details = readiness_probe()
+            payload.update(details)
+            if not ready:
+                return jsonify(payload), 503
+        return jsonify(payload)
     except Exception as e:
         return jsonify({
             'status': 'error',
             'error': str(e)
         }), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics for this process"""
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/profile', methods=['POST'])
+@admin_required
+def admin_profile():
+    """Start profiling this process for N seconds; poll the returned URL for the result"""
+    try:
+        seconds = int(request.args.get('seconds', 10))
+        mode = request.args.get('mode', 'sample')
+        rate = float(request.args.get('rate', 1.0))
+        session = profiling.start(seconds, mode, rate)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+    
+    # The session lives in this process: with several workers, poll until the same pid answers
+    return jsonify({
+        'session': session.id,
+        'mode': session.mode,
+        'seconds': session.seconds,
+        'pid': os.getpid(),
+        'poll': f'/admin/profile/{session.id}',
+    }), 202
+
+@app.route('/admin/profile/<session_id>', methods=['GET'])
+@admin_required
+def admin_profile_result(session_id):
+    """Report or pstats file of a profiling session, 202 while it is still collecting"""
+    session = profiling.get(session_id)
+    if session is None:
+        return jsonify({'error': f'No profiling session {session_id} in process {os.getpid()}'}), 404
+    if not session.done:
+        remaining = session.remaining
+        response = jsonify({'session': session.id, 'status': 'running', 'remaining_seconds': round(remaining, 1)})
+        response.status_code = 202
+        response.headers['Retry-After'] = str(max(1, int(remaining + 0.999)))
+        return response
+    
+    if request.args.get('format') == 'pstats':
+        data = session.pstats_bytes()
+        if data is None:
+            return jsonify({'error': 'Nothing was profiled'}), 404
+        response = app.response_class(data, mimetype='application/octet-stream')
+        response.headers['Content-Disposition'] = f'attachment; filename=profile-{os.getpid()}.pstats'
+        return response
+    return app.response_class(session.report(), mimetype='text/plain')
+
+@app.route('/admin/memory', methods=['GET'])
+@admin_required
+def admin_memory():
+    """Memory accounting report for this process"""
+    limit = request.args.get('limit', memory_report.TOP_SITES, type=int)
+    return jsonify(memory_report.build_report(limit))
+
+@app.route('/admin/state_at', methods=['GET'])
+@admin_required
+def admin_state_at():
+    """Data as of ?at= (unix time or ISO 8601), rebuilt from the change log; ?user_id= narrows it to one user"""
+    try:
+        at = changelog.parse_time(request.args.get('at', ''))
+    except ValueError:
+        return jsonify({'error': 'at must be a unix time or an ISO 8601 date/time'}), 400
+    state = changelog.state_at(at)
+    if state is None:
+        return jsonify({'error': 'No history before that time'}), 404
+    user_id = request.args.get('user_id')
+    if user_id:
+        return jsonify({
+            'at': at,
+            'user_id': user_id,
+            'balance': state['user_balances'].get(user_id),
+            'bet': state['user_state'].get(user_id),
+            'result': state['user_results'].get(user_id),
+            'match_result': state['match_result']
+        })
+    return jsonify({'at': at, 'state': state})
+
+@app.route('/admin/balance_history/<user_id>', methods=['GET'])
+@admin_required
+def admin_balance_history(user_id):
+    """A user's balance changes between ?since= and ?until= (default: whole history up to now)"""
+    try:
+        since = changelog.parse_time(request.args['since']) if request.args.get('since') else None
+        until = changelog.parse_time(request.args['until']) if request.args.get('until') else None
+    except ValueError:
+        return jsonify({'error': 'since/until must be unix times or ISO 8601 dates/times'}), 400
+    points = changelog.balance_history(user_id, since, until)
+    if points is None:
+        return jsonify({'error': 'No history for that window'}), 404
+    return jsonify({'user_id': user_id, 'history': [{'ts': ts, 'balance': balance} for ts, balance in points]})
+
+EXPORT_CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+@app.route('/admin/export/<kind>', methods=['GET'])
+@admin_required
+def admin_export(kind):
+    """Stream balances, bets (open) or results as ?format=ndjson|csv, ?gzip=1 to compress.
+    Filters: min_balance (balances), min_bet (bets), match, since, until (results)."""
+    fmt = request.args.get('format', 'ndjson')
+    compress = request.args.get('gzip', '') in ('1', 'true', 'yes')
+    try:
+        if kind not in export.KINDS:
+            raise ValueError(f"Unknown export {kind!r} (one of: {', '.join(export.KINDS)})")
+        filters = export.parse_filters(kind, {name: value for name, value in request.args.items()
+                                              if name not in ('format', 'gzip')})
+        chunks = export.stream(kind, fmt, compress, **filters)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    response = app.response_class(chunks, mimetype='application/gzip' if compress else EXPORT_CONTENT_TYPES[fmt])
+    response.headers['Content-Disposition'] = (
+        f'attachment; filename="{export.filename(kind, fmt, compress, datetime.now())}"')
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/admin/balances/import', methods=['POST'])
+@admin_required
+def admin_balance_import():
+    """Apply a CSV (user_id,delta|balance) or NDJSON body of balance rows in one transaction.
+    ?format=csv|ndjson (default from Content-Type), ?reason=promo, ?dry_run=1 to only check.
+    A gzip body needs Content-Encoding: gzip. Replies with applied/rejected counts and timings.
+
+    The Idempotency-Key header is the batch id. It is saved in the data file with the balances,
+    not in idempotency's per-process cache, so a retry on any worker is not applied twice."""
+    fmt = request.args.get('format') or ('ndjson' if 'json' in (request.mimetype or '') else 'csv')
+    reason = request.args.get('reason', 'import')[:64]
+    dry_run = request.args.get('dry_run', '') in ('1', 'true', 'yes')
+    batch_id = request.headers.get(idempotency.HEADER) or None
+    body = request.stream
+    if request.content_encoding == 'gzip':
+        body = gzip.GzipFile(fileobj=body)
+    try:
+        report = balance_import.import_balances(balance_import.text_lines(body), fmt, reason, dry_run, batch_id)
+    except balance_import.BatchConflict as e:
+        return jsonify({'error': str(e)}), 422
+    except (ValueError, OSError, EOFError) as e:
+        # Unknown format, CSV without a header, broken gzip or UTF-8
+        return jsonify({'error': str(e)}), 400
+    return jsonify(report)
+
 @app.route('/ping', methods=['GET'])
 def uptime_robot_ping():
     """Simple ping endpoint for UptimeRobot monitoring"""
@@ -446,10 +611,12 @@ def uptime_robot_ping():
 def bot_status():
     """Bot status endpoint for external monitoring"""
     try:
-        data_sync.reload_data()
+        data_sync.refresh_data()
         return f"CS2 Betting Bot is running. Users: {len(data_sync.user_balances)}, Active bets: {len(data_sync.user_bets)}", 200
     except Exception as e:
         return f"Error: {str(e)}", 500
 
 if __name__ == '__main__':
+    import log_setup
+    log_setup.setup_logging()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file